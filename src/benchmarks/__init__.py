@@ -0,0 +1,7 @@
+"""IVERT's built-in benchmark suite.
+
+The benchmarks measure the throughput of each stage of the DEM validation pipeline without needing any downloaded
+ICESat-2 granules or real DEMs. synthetic_data generates GeoTIFF DEMs and classified photon .nc granules (in a
+throw-away photon database), and run_benchmarks times each validation stage on them and writes the timings to a JSON
+file that can be compared across IVERT versions. Run them with 'ivert bench'.
+"""
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+
+"""run_benchmarks.py -- Time each stage of IVERT's DEM validation pipeline on synthetic data.
+
+Each benchmark case (BENCHMARK_CASES) generates a synthetic DEM and a synthetic photon database of the granules
+crossing it (see synthetic_data.py), then runs the validation pipeline of validate_dem.validate_dem_parallel() on it
+one stage at a time:
+    fetch_photons:       validate_dem._fetch_photons(), reading the photons from the granule .nc files.
+    photon_overlap:      validate_dem._compute_photon_overlap(), transforming the photons and finding the DEM cells.
+    cell_validation:     validate_dem._run_parallel_cell_validation(), in 'numprocs' worker processes.
+    write_results:       validate_dem._write_validation_outputs(), writing the results file and its summary sketch.
+    render_outputs:      validate_dem.render_validation_outputs(), writing the summary stats, error GeoTIFF, error
+                         exports and plot.
+The coastline-mask filter of misclassified photons is skipped, since it needs to download coastline data.
+
+The timings of all cases are written to a JSON file. compare_benchmark_results() compares two such files, such as from
+two versions of IVERT.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy
+
+import utils.configfile
+import utils.dem_geom as dem_geom
+import utils.parallel_funcs as parallel_funcs
+import utils.version
+import validate_dem
+import icesat2_database_v2
+import benchmarks.synthetic_data as synthetic_data
+
+# The synthetic DEMs of each benchmark case: their size in cells, horizontal CRS (EPSG:32619 is the UTM zone of the
+# synthetic scene), nodata pattern, photon class mix, and the number of granules crossing them.
+BENCHMARK_CASES = {"small_geographic": {"xsize": 1024, "ysize": 1024, "epsg": 4326,
+                                        "nodata_pattern": "none", "class_mix": "coastal", "num_granules": 2},
+                   "small_utm_holes": {"xsize": 1024, "ysize": 1024, "epsg": 32619,
+                                       "nodata_pattern": "holes", "class_mix": "coastal", "num_granules": 2},
+                   "medium_geographic_border": {"xsize": 4096, "ysize": 4096, "epsg": 4326,
+                                                "nodata_pattern": "border", "class_mix": "forested",
+                                                "num_granules": 4},
+                   "medium_utm_offshore": {"xsize": 4096, "ysize": 4096, "epsg": 32619,
+                                           "nodata_pattern": "offshore", "class_mix": "coastal", "num_granules": 4},
+                   "large_geographic_holes": {"xsize": 8192, "ysize": 8192, "epsg": 4326,
+                                              "nodata_pattern": "holes", "class_mix": "coastal", "num_granules": 6},
+                   "large_utm_border": {"xsize": 8192, "ysize": 8192, "epsg": 32619,
+                                        "nodata_pattern": "border", "class_mix": "urban", "num_granules": 6}}
+
+# The cases run in each benchmark suite.
+BENCHMARK_SUITES = {"small": ("small_geographic", "small_utm_holes"),
+                    "medium": ("small_geographic", "small_utm_holes",
+                               "medium_geographic_border", "medium_utm_offshore"),
+                    "full": tuple(BENCHMARK_CASES.keys())}
+
+# The timed stages of the validation pipeline, in order.
+PIPELINE_STAGES = ("fetch_photons", "photon_overlap", "cell_validation", "write_results", "render_outputs")
+
+# Photon classes validated, as in 'ivert validate'.
+BENCHMARK_CLASSES = (1, 6, 40)
+
+
+def run_benchmark_case(case_name: str,
+                       case_dir: str,
+                       numprocs: int,
+                       repeats: int = 1,
+                       overlap_mode: str | None = None,
+                       export_error_formats: str | list | None = None,
+                       seed: int = 0,
+                       verbose: bool = True) -> dict:
+    """Generate the synthetic data of one benchmark case in case_dir, and time the validation pipeline on it.
+
+    The pipeline is run 'repeats' times on the same data, each time with a freshly opened photon database.
+
+    Returns a dictionary of the case's settings, data sizes, and the times of each stage (and the whole pipeline) in
+    seconds: a list of every repeat, and their median and minimum.
+    """
+    case = BENCHMARK_CASES[case_name]
+    os.makedirs(case_dir, exist_ok=True)
+
+    if verbose:
+        print(f"\n=== {case_name}: {case['xsize']}x{case['ysize']} DEM in EPSG:{case['epsg']}, "
+              f"'{case['nodata_pattern']}' nodata, '{case['class_mix']}' photons ===")
+
+    t_start = time.perf_counter()
+    dem_fname = synthetic_data.write_synthetic_dem(os.path.join(case_dir, case_name + ".tif"),
+                                                   case["xsize"], case["ysize"],
+                                                   epsg=case["epsg"],
+                                                   nodata_pattern=case["nodata_pattern"],
+                                                   seed=seed)
+    wgs84_bbox = dem_geom.get_wgs84_bounding_box(dem_fname)
+    synthetic_data.build_synthetic_database(os.path.join(case_dir, "icesat2"), wgs84_bbox,
+                                            num_granules=case["num_granules"],
+                                            class_mix=case["class_mix"],
+                                            seed=seed,
+                                            verbose=verbose)
+    setup_s = time.perf_counter() - t_start
+    if verbose:
+        print(f"Generated the synthetic data in {setup_s:0.1f} s.")
+
+    stage_times = {stage: [] for stage in PIPELINE_STAGES + ("total",)}
+    counts = {}
+    for n in range(repeats):
+        run_times, counts = _run_pipeline_once(dem_fname, os.path.join(case_dir, "icesat2"), case_dir, numprocs,
+                                               overlap_mode, export_error_formats)
+        for stage, seconds in run_times.items():
+            stage_times[stage].append(seconds)
+        if verbose:
+            print(f"Run {n + 1}/{repeats}: " +
+                  ", ".join(f"{stage} {seconds:0.2f} s" for stage, seconds in run_times.items()))
+
+    total_median = statistics.median(stage_times["total"])
+    return {"case": case_name,
+            "dem": dict(case, file_size_bytes=os.path.getsize(dem_fname)),
+            "setup_seconds": setup_s,
+            "counts": counts,
+            "stages": {stage: {"seconds": times,
+                               "median": statistics.median(times),
+                               "min": min(times)}
+                       for stage, times in stage_times.items() if len(times) > 0},
+            "photons_per_second": counts.get("num_photons", 0) / total_median if total_median > 0 else None,
+            "cells_per_second": counts.get("num_cells", 0) / total_median if total_median > 0 else None}
+
+
+def _run_pipeline_once(dem_fname: str,
+                       db_dir: str,
+                       output_dir: str,
+                       numprocs: int,
+                       overlap_mode: str | None,
+                       export_error_formats: str | list | None) -> tuple[dict, dict]:
+    """Run the validation pipeline stages once on a DEM and synthetic photon database.
+
+    Returns a dictionary of the seconds taken by each stage, and one of the photon and cell counts."""
+    times = {}
+    counts = {}
+    database = icesat2_database_v2.IS2Database(synthetic_data.synthetic_database_config(db_dir))
+
+    _, _, results_dataframe_file, empty_results_filename, summary_stats_filename, result_tif_filename, \
+        plot_filename = validate_dem._setup_output_paths(dem_fname, os.path.join(output_dir, "ivert_results"), None,
+                                                         True, True, True, True, False)
+
+    t_start = time.perf_counter()
+    fetch_result = validate_dem._fetch_photons(dem_fname, 1, synthetic_data.SYNTHETIC_VERTICAL_EPSG, database,
+                                               None, list(BENCHMARK_CLASSES), None, False,
+                                               min_confidence_level=1, min_bathy_confidence=0.0)
+    times["fetch_photons"] = time.perf_counter() - t_start
+    if fetch_result is None:
+        raise RuntimeError(f"No synthetic photons found over {os.path.basename(dem_fname)}.")
+    dem_ds, photon_df, dem_epsg_str, photon_src_epsg = fetch_result
+    counts["num_photons"] = len(photon_df)
+
+    t_start = time.perf_counter()
+    overlap_result = validate_dem._compute_photon_overlap(dem_ds, photon_df, list(BENCHMARK_CLASSES), dem_epsg_str,
+                                                          False, False,
+                                                          photon_src_epsg=photon_src_epsg,
+                                                          cache_dir=os.path.join(output_dir, "transformez_cache"),
+                                                          overlap_mode=overlap_mode)
+    times["photon_overlap"] = time.perf_counter() - t_start
+    if overlap_result is None:
+        raise RuntimeError(f"No synthetic photons overlap valid cells of {os.path.basename(dem_fname)}.")
+    photon_df, height_field, _, dem_overlap_i, dem_overlap_j, dem_overlap_elevs, N, coverage_frac = overlap_result
+    counts["num_photons_in_dem"] = len(photon_df)
+    counts["num_cells"] = int(N)
+
+    t_start = time.perf_counter()
+    results = validate_dem._run_parallel_cell_validation(photon_df, height_field, dem_overlap_i, dem_overlap_j,
+                                                         dem_overlap_elevs, N, None, coverage_frac, numprocs, False)
+    times["cell_validation"] = time.perf_counter() - t_start
+
+    shared_ret_values = {}
+    t_start = time.perf_counter()
+    validate_dem._write_validation_outputs(results, dem_ds, dem_fname, results_dataframe_file, empty_results_filename,
+                                           summary_stats_filename, result_tif_filename, plot_filename,
+                                           True, True, True, None, 2.5, True, shared_ret_values, False, [],
+                                           filter_misclassified=False, export_error_formats=export_error_formats,
+                                           defer_outputs=True)
+    times["write_results"] = time.perf_counter() - t_start
+    counts["num_cells_in_results"] = len(results)
+
+    output_job = shared_ret_values.get(validate_dem.DEFERRED_OUTPUT_JOB_KEY)
+    t_start = time.perf_counter()
+    if output_job is not None:
+        validate_dem.render_validation_outputs(output_job, dem_ds=dem_ds)
+    times["render_outputs"] = time.perf_counter() - t_start
+
+    times["total"] = sum(times.values())
+    return times, counts
+
+
+def run_benchmarks(suite: str = "small",
+                   cases: list | tuple | None = None,
+                   output_json: str | None = None,
+                   work_dir: str | None = None,
+                   numprocs: int | None = None,
+                   repeats: int = 1,
+                   overlap_mode: str | None = None,
+                   export_error_formats: str | list | None = None,
+                   seed: int = 0,
+                   verbose: bool = True) -> dict:
+    """Run a suite of benchmark cases, and write their results to a JSON file.
+
+    Args:
+        suite: One of the BENCHMARK_SUITES. Ignored if 'cases' is given.
+        cases: Names of the BENCHMARK_CASES to run.
+        output_json: The JSON results file to write. Defaults to 'ivert_bench_<version>_<timestamp>.json' in the current
+                     directory.
+        work_dir: Directory for the synthetic data and outputs. It's kept afterward. Defaults to a temporary
+                  directory, deleted afterward.
+        numprocs: Number of cell-validation worker processes. Defaults to the number of physical CPUs.
+        repeats: Number of times to run the pipeline on each case's data.
+        overlap_mode: The DEM overlap mode to benchmark ('sparse' or 'blocked'). Defaults to the config setting.
+        export_error_formats: Error export formats rendered. Defaults to the config setting.
+        seed: Random seed of the synthetic data.
+        verbose: Print progress.
+
+    Returns the results dictionary written to the JSON file.
+    """
+    if cases is None:
+        if suite not in BENCHMARK_SUITES:
+            raise ValueError(f"Unknown benchmark suite '{suite}'. Use one of {list(BENCHMARK_SUITES.keys())}.")
+        cases = BENCHMARK_SUITES[suite]
+    for case_name in cases:
+        if case_name not in BENCHMARK_CASES:
+            raise ValueError(f"Unknown benchmark case '{case_name}'. Use one of {list(BENCHMARK_CASES.keys())}.")
+
+    ivert_config = utils.configfile.Config()
+    if numprocs is None:
+        numprocs = parallel_funcs.physical_cpu_count()
+    if overlap_mode is None:
+        overlap_mode = ivert_config.dem_overlap_mode
+    if output_json is None:
+        output_json = f"ivert_bench_{utils.version.__version__}_{time.strftime('%Y%m%d_%H%M%S')}.json"
+
+    results = {"ivert_version": utils.version.__version__,
+               "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "host": {"platform": platform.platform(),
+                        "python": platform.python_version(),
+                        "numpy": numpy.__version__,
+                        "cpu_count": os.cpu_count()},
+               "settings": {"suite": suite,
+                            "numprocs": numprocs,
+                            "repeats": repeats,
+                            "overlap_mode": overlap_mode,
+                            "results_file_format": ivert_config.results_file_format,
+                            "photon_array_transport": ivert_config.photon_array_transport,
+                            "export_error_formats": export_error_formats if export_error_formats is not None
+                            else ivert_config.export_error_formats,
+                            "seed": seed},
+               "cases": []}
+
+    tmp_dir = None
+    if work_dir is None:
+        tmp_dir = tempfile.mkdtemp(prefix="ivert_bench_")
+        work_dir = tmp_dir
+
+    try:
+        for case_name in cases:
+            results["cases"].append(run_benchmark_case(case_name, os.path.join(work_dir, case_name),
+                                                       numprocs,
+                                                       repeats=repeats,
+                                                       overlap_mode=overlap_mode,
+                                                       export_error_formats=export_error_formats,
+                                                       seed=seed,
+                                                       verbose=verbose))
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    with open(output_json, "w") as f:
+        json.dump(results, f, indent=2)
+    if verbose:
+        print("\n" + format_benchmark_results(results))
+        print(f"\n{output_json} written.")
+
+    return results
+
+
+def format_benchmark_results(results: dict) -> str:
+    """Return a table of the median seconds of each stage, in each case of a benchmark results dictionary."""
+    import tabulate
+
+    rows = [[case["case"], f"{case['counts'].get('num_photons', 0):,}", f"{case['counts'].get('num_cells', 0):,}"]
+            + [case["stages"][stage]["median"] for stage in PIPELINE_STAGES + ("total",)]
+            for case in results["cases"]]
+    return tabulate.tabulate(rows, headers=["case", "photons", "cells"] + list(PIPELINE_STAGES) + ["total"],
+                             tablefmt="simple", floatfmt="0.2f")
+
+
+def compare_benchmark_results(baseline: str | dict, results: str | dict) -> str:
+    """Compare two benchmark results (files, or dictionaries returned by run_benchmarks()) by their median stage times.
+
+    Returns a table of the ratio of each stage's time in 'results' to its time in 'baseline'. Ratios above 1 are
+    slowdowns. Only the cases in both are compared."""
+    import tabulate
+
+    if isinstance(baseline, str):
+        with open(baseline, "r") as f:
+            baseline = json.load(f)
+    if isinstance(results, str):
+        with open(results, "r") as f:
+            results = json.load(f)
+
+    baseline_cases = {case["case"]: case for case in baseline["cases"]}
+    rows = []
+    for case in results["cases"]:
+        base_case = baseline_cases.get(case["case"])
+        if base_case is None:
+            continue
+        row = [case["case"]]
+        for stage in PIPELINE_STAGES + ("total",):
+            base_s = base_case["stages"].get(stage, {}).get("median")
+            new_s = case["stages"].get(stage, {}).get("median")
+            row.append(f"{new_s / base_s:0.2f}x" if (base_s and new_s is not None) else "-")
+        rows.append(row)
+
+    return (f"Stage times of version {results['ivert_version']} relative to {baseline['ivert_version']}:\n" +
+            tabulate.tabulate(rows, headers=["case"] + list(PIPELINE_STAGES) + ["total"], tablefmt="simple"))
+
+
+def define_and_parse_args():
+    parser = argparse.ArgumentParser(description="Time the stages of IVERT's DEM validation on synthetic data.")
+    parser.add_argument("--suite", "-s", default="small", choices=list(BENCHMARK_SUITES.keys()),
+                        help="The suite of benchmark cases to run. Default: small.")
+    parser.add_argument("--case", "-c", dest="cases", action="append", default=None,
+                        choices=list(BENCHMARK_CASES.keys()),
+                        help="Run only this benchmark case. Can be given more than once. Overrides --suite.")
+    parser.add_argument("--output", "-o", default=None,
+                        help="The JSON results file to write. Default: ivert_bench_<version>_<timestamp>.json")
+    parser.add_argument("--work-dir", "-w", default=None,
+                        help="Directory to keep the synthetic data and outputs in. Default: a temporary directory, "
+                             "deleted afterward.")
+    parser.add_argument("--numprocs", "-np", type=int, default=None,
+                        help="Number of cell-validation worker processes. Default: the number of physical CPUs.")
+    parser.add_argument("--repeats", "-r", type=int, default=1,
+                        help="Number of times to run the pipeline on each case. Default: 1.")
+    parser.add_argument("--overlap-mode", default=None, choices=["sparse", "blocked"],
+                        help="The DEM overlap mode to benchmark. Default: the 'dem_overlap_mode' setting.")
+    parser.add_argument("--compare", default=None, metavar="BASELINE_JSON",
+                        help="Compare the results against a previous benchmark results file.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = define_and_parse_args()
+    bench_results = run_benchmarks(suite=args.suite, cases=args.cases, output_json=args.output,
+                                   work_dir=args.work_dir, numprocs=args.numprocs, repeats=args.repeats,
+                                   overlap_mode=args.overlap_mode)
+    if args.compare:
+        print("\n" + compare_benchmark_results(args.compare, bench_results))
@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+
+"""synthetic_data.py -- Synthetic DEMs and ICESat-2 photon granules for benchmarking IVERT.
+
+Both the DEMs and the photons are sampled from the same synthetic coastal surface (see synthetic_surface()), so the
+photons land on realistic terrain with a known error against the DEM:
+    - write_synthetic_dem() writes a tiled GeoTIFF DEM of any size, in a geographic or projected CRS, with one of
+      several nodata patterns (NODATA_PATTERNS).
+    - synthetic_granule_photons() generates the classified photons of one ICESat-2 overpass: three beam pairs of
+      strong and weak beams, with ATLAS's along-track shot spacing, photon rates and footprint jitter, classified by
+      one of the CLASS_MIXES.
+    - build_synthetic_database() writes a number of granules as .nc files, in the same format as
+      icesat2_database_v2.IS2Database._process_h5_to_nc(), and builds a photon database of them in its own directory.
+"""
+
+import os
+
+import numpy
+import pandas
+import pyproj
+import xarray
+from osgeo import gdal, osr
+
+import utils.configfile
+import icesat2_database_v2
+
+gdal.UseExceptions()
+
+# The center (lon, lat) of the synthetic scene: a stretch of the New England coast.
+DEFAULT_CENTER = (-70.0, 42.0)
+
+# The vertical datum of the synthetic photons and DEMs (EGM2008 geoid heights). Both use the same datum, so the
+# benchmarks don't depend on downloading vertical datum grids.
+SYNTHETIC_VERTICAL_EPSG = "EPSG:3855"
+
+# Nodata patterns of the synthetic DEMs:
+#   "none": every cell is valid.
+#   "border": an irregular nodata collar around the edges, as in a reprojected DEM tile.
+#   "holes": scattered circular voids, as in gaps between source datasets.
+#   "offshore": every cell below sea level is nodata, as in a topography-only DEM.
+NODATA_PATTERNS = ("none", "border", "holes", "offshore")
+
+# Photon class mixes. Fractions of the land photons in canopy (class 2 or 3) and on buildings (class 7), the fraction of
+# the water photons from the sea surface (class 41) rather than the sea floor (class 40), and the depth beyond which no
+# sea-floor photons are returned.
+CLASS_MIXES = {"coastal": {"canopy_frac": 0.15, "canopy_top_frac": 0.05, "buildings_frac": 0.02,
+                           "bathy_surface_frac": 0.5, "max_bathy_depth_m": 35.0},
+               "forested": {"canopy_frac": 0.55, "canopy_top_frac": 0.15, "buildings_frac": 0.0,
+                            "bathy_surface_frac": 0.6, "max_bathy_depth_m": 20.0},
+               "urban": {"canopy_frac": 0.05, "canopy_top_frac": 0.02, "buildings_frac": 0.25,
+                         "bathy_surface_frac": 0.7, "max_bathy_depth_m": 15.0}}
+
+# ATLAS geometry: 0.7 m between laser shots along-track, ~3.3 km between beam pairs, 90 m between the strong and weak
+# beam of each pair, and a ground speed of ~7 km/s.
+SHOT_SPACING_M = 0.7
+BEAM_PAIR_SPACING_M = 3300.0
+BEAM_SPACING_M = 90.0
+GROUND_SPEED_M_S = 7000.0
+# Mean signal photons returned per shot, from a strong and a weak beam. The strong beams have 4x the energy.
+STRONG_BEAM_PHOTONS_PER_SHOT = 1.0
+WEAK_BEAM_PHOTONS_PER_SHOT = 0.25
+# Standard deviation of photon positions within the ~11 m laser footprint.
+FOOTPRINT_SD_M = 3.0
+
+_M_PER_DEG_LAT = 110540.0
+_M_PER_DEG_LON_EQUATOR = 111320.0
+
+
+def _lonlat_to_local_m(lon, lat, center):
+    """Convert lon/lat to east/north distances (m) from the scene center."""
+    east = (numpy.asarray(lon) - center[0]) * _M_PER_DEG_LON_EQUATOR * numpy.cos(numpy.radians(center[1]))
+    north = (numpy.asarray(lat) - center[1]) * _M_PER_DEG_LAT
+    return east, north
+
+
+def _local_m_to_lonlat(east, north, center):
+    """Convert east/north distances (m) from the scene center to lon/lat."""
+    lon = center[0] + numpy.asarray(east) / (_M_PER_DEG_LON_EQUATOR * numpy.cos(numpy.radians(center[1])))
+    lat = center[1] + numpy.asarray(north) / _M_PER_DEG_LAT
+    return lon, lat
+
+
+def synthetic_surface(lon, lat, center=DEFAULT_CENTER) -> numpy.ndarray:
+    """The elevation (m) of the synthetic scene at lon/lat.
+
+    A wavy north-south coastline runs through the scene center, with the sea to the west. Land rises gently inland with
+    rolling hills on top. The sea floor slopes down at 1% offshore, with a few sandbars."""
+    east, north = _lonlat_to_local_m(lon, lat, center)
+    # Signed distance from the coastline, positive inland.
+    inland = east + 400.0 * numpy.sin(north / 1700.0) + 150.0 * numpy.sin(north / 430.0)
+    hills = 12.0 * numpy.sin(east / 900.0) * numpy.cos(north / 1100.0) + 4.0 * numpy.sin((east + north) / 260.0)
+    land = 0.015 * inland + hills * numpy.clip(inland / 600.0, 0.0, 1.0) + 0.5
+    sandbars = 1.5 * numpy.sin(inland / 120.0) * numpy.exp(inland / 800.0)
+    sea = 0.01 * inland + sandbars - 0.5
+    return numpy.where(inland >= 0, land, sea)
+
+
+def _vegetation(lon, lat, center=DEFAULT_CENTER) -> numpy.ndarray:
+    """A smooth 0-1 vegetation density field over the scene, to place the canopy photons in patches."""
+    east, north = _lonlat_to_local_m(lon, lat, center)
+    return 0.5 + 0.5 * numpy.sin(east / 1300.0 + 1.0) * numpy.sin(north / 800.0)
+
+
+def default_resolution(epsg: int) -> float:
+    """The default DEM cell size in the units of the CRS: 1/3 arc-second (~10 m) if geographic, else 10 m."""
+    if pyproj.CRS.from_epsg(int(epsg)).is_geographic:
+        return 1.0 / 10800.0
+    return 10.0
+
+
+def write_synthetic_dem(dem_fname: str,
+                        xsize: int,
+                        ysize: int,
+                        epsg: int = 4326,
+                        resolution: float | None = None,
+                        center: tuple = DEFAULT_CENTER,
+                        nodata_pattern: str = "none",
+                        ndv: float = -99999.0,
+                        noise_sd_m: float = 0.3,
+                        block_size: int = 256,
+                        compress: str = "DEFLATE",
+                        seed: int = 0) -> str:
+    """Write a synthetic DEM GeoTIFF of the synthetic_surface(), centered on 'center' (lon, lat).
+
+    Args:
+        dem_fname: The GeoTIFF to write.
+        xsize, ysize: Size of the DEM in cells.
+        epsg: EPSG code of the DEM's horizontal CRS. The DEM heights are in SYNTHETIC_VERTICAL_EPSG.
+        resolution: Cell size in CRS units. Defaults to default_resolution(epsg).
+        center: (lon, lat) of the DEM center.
+        nodata_pattern: One of NODATA_PATTERNS.
+        ndv: The nodata value. May be NaN.
+        noise_sd_m: Standard deviation of random noise added to the DEM heights, i.e. the DEM's "error".
+        block_size: Tile size of the GeoTIFF.
+        compress: GeoTIFF compression, or None.
+        seed: Random seed for the noise and nodata holes.
+
+    Returns the DEM file name.
+    """
+    if nodata_pattern not in NODATA_PATTERNS:
+        raise ValueError(f"Unknown nodata pattern '{nodata_pattern}'. Use one of {NODATA_PATTERNS}.")
+    if resolution is None:
+        resolution = default_resolution(epsg)
+
+    rng = numpy.random.default_rng(seed)
+
+    to_dem_crs = pyproj.Transformer.from_crs("EPSG:4326", f"EPSG:{int(epsg)}", always_xy=True)
+    to_lonlat = pyproj.Transformer.from_crs(f"EPSG:{int(epsg)}", "EPSG:4326", always_xy=True)
+    center_x, center_y = to_dem_crs.transform(center[0], center[1])
+    xstart = center_x - (xsize * resolution / 2.0)
+    ystart = center_y + (ysize * resolution / 2.0)
+    geotransform = (xstart, resolution, 0.0, ystart, 0.0, -resolution)
+
+    # Voids of the "holes" pattern: (row, col, radius) in cells.
+    num_holes = max(1, (xsize * ysize) // 500000)
+    holes = numpy.column_stack((rng.uniform(0, ysize, num_holes),
+                                rng.uniform(0, xsize, num_holes),
+                                rng.uniform(5, max(6.0, min(xsize, ysize) / 25.0), num_holes)))
+    # Width of the "border" pattern's collar, in cells.
+    collar = max(2.0, min(xsize, ysize) / 20.0)
+
+    if os.path.exists(dem_fname):
+        os.remove(dem_fname)
+    creation_options = ["TILED=YES", f"BLOCKXSIZE={block_size}", f"BLOCKYSIZE={block_size}", "BIGTIFF=IF_SAFER"]
+    if compress:
+        creation_options.append(f"COMPRESS={compress}")
+    dem_ds = gdal.GetDriverByName("GTiff").Create(dem_fname, xsize, ysize, 1, gdal.GDT_Float32,
+                                                  options=creation_options)
+    dem_ds.SetGeoTransform(geotransform)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(int(epsg))
+    dem_ds.SetProjection(srs.ExportToWkt())
+    band = dem_ds.GetRasterBand(1)
+    band.SetNoDataValue(float(ndv))
+
+    cols = numpy.arange(xsize)
+    # Write one strip of blocks at a time, so large DEMs are never held in memory.
+    for row_start in range(0, ysize, block_size):
+        rows = numpy.arange(row_start, min(row_start + block_size, ysize))
+        rr, cc = numpy.meshgrid(rows, cols, indexing="ij")
+        xs = xstart + (cc + 0.5) * resolution
+        ys = ystart - (rr + 0.5) * resolution
+        lons, lats = to_lonlat.transform(xs, ys)
+        elevs = synthetic_surface(lons, lats, center) + rng.normal(0.0, noise_sd_m, size=rr.shape)
+
+        if nodata_pattern == "border":
+            edge_dist = numpy.minimum(numpy.minimum(rr, ysize - 1 - rr), numpy.minimum(cc, xsize - 1 - cc))
+            wobble = 1.0 + 0.5 * numpy.sin(rr / 37.0) * numpy.cos(cc / 53.0)
+            nodata_mask = edge_dist < (collar * wobble)
+        elif nodata_pattern == "holes":
+            nodata_mask = numpy.zeros(rr.shape, dtype=bool)
+            for h_row, h_col, h_radius in holes:
+                if (h_row + h_radius) < rows[0] or (h_row - h_radius) > rows[-1]:
+                    continue
+                nodata_mask |= ((rr - h_row) ** 2 + (cc - h_col) ** 2) < (h_radius ** 2)
+        elif nodata_pattern == "offshore":
+            nodata_mask = elevs < 0
+        else:
+            nodata_mask = None
+
+        if nodata_mask is not None:
+            elevs[nodata_mask] = ndv
+
+        band.WriteArray(elevs.astype(numpy.float32), 0, int(row_start))
+
+    band.FlushCache()
+    band = None
+    dem_ds = None
+
+    return dem_fname
+
+
+def synthetic_granule_photons(bbox: list | tuple,
+                              yyyymmdd: int,
+                              center: tuple = DEFAULT_CENTER,
+                              track_offset_m: float = 0.0,
+                              heading_deg: float = 12.0,
+                              ascending: bool = True,
+                              class_mix: str = "coastal",
+                              seed: int = 0) -> pandas.DataFrame:
+    """Generate the classified photons of one synthetic ICESat-2 overpass over bbox.
+
+    The overpass has three beam pairs. The center of the reference ground track passes 'track_offset_m' east of the
+    scene center (perpendicular to the track), at 'heading_deg' east of north (or its reverse if not 'ascending').
+
+    Args:
+        bbox: (xmin, xmax, ymin, ymax) in lon/lat. Only photons inside it are returned.
+        yyyymmdd: Date of the overpass.
+        center: (lon, lat) of the synthetic scene center.
+        track_offset_m: Cross-track offset of the reference ground track from the scene center.
+        heading_deg: Heading of the ground track, in degrees east of north.
+        ascending: Whether the track runs northward (True) or southward.
+        class_mix: One of the CLASS_MIXES.
+        seed: Random seed.
+
+    Returns a dataframe with the columns of a processed granule: x, y, z, class_code, bathy_confidence, delta_time,
+    confidence, laser, and along_track_m. It's empty if the track misses the bbox.
+    """
+    mix = CLASS_MIXES[class_mix]
+    rng = numpy.random.default_rng(seed)
+
+    heading = numpy.radians(heading_deg if ascending else heading_deg + 180.0)
+    along_unit = numpy.array((numpy.sin(heading), numpy.cos(heading)))
+    cross_unit = numpy.array((along_unit[1], -along_unit[0]))
+
+    # Half-length of the track needed to cross the whole bbox from the scene center.
+    corner_e, corner_n = _lonlat_to_local_m(numpy.array(bbox[0:2]), numpy.array(bbox[2:4]), center)
+    half_length = float(numpy.hypot(numpy.abs(corner_e).max(), numpy.abs(corner_n).max()))
+    num_shots = int(2 * half_length / SHOT_SPACING_M)
+
+    t0 = icesat2_database_v2._yyyymmdd_to_delta_time(yyyymmdd) + rng.uniform(0, 86400)
+    beam_dfs = []
+    for pair_num, pair_offset in enumerate((-BEAM_PAIR_SPACING_M, 0.0, BEAM_PAIR_SPACING_M), start=1):
+        for side, side_offset, photons_per_shot in (("l", -BEAM_SPACING_M / 2, STRONG_BEAM_PHOTONS_PER_SHOT),
+                                                    ("r", BEAM_SPACING_M / 2, WEAK_BEAM_PHOTONS_PER_SHOT)):
+            # Photons returned from each shot along the beam.
+            shot_photons = rng.poisson(photons_per_shot, num_shots)
+            along = numpy.repeat(numpy.arange(num_shots) * SHOT_SPACING_M - half_length, shot_photons)
+            num_photons = len(along)
+            along = along + rng.normal(0.0, FOOTPRINT_SD_M, num_photons)
+            cross = track_offset_m + pair_offset + side_offset + rng.normal(0.0, FOOTPRINT_SD_M, num_photons)
+
+            east = along * along_unit[0] + cross * cross_unit[0]
+            north = along * along_unit[1] + cross * cross_unit[1]
+            lon, lat = _local_m_to_lonlat(east, north, center)
+            inside = (lon >= bbox[0]) & (lon < bbox[1]) & (lat >= bbox[2]) & (lat < bbox[3])
+            if not numpy.any(inside):
+                continue
+            lon, lat, along = lon[inside], lat[inside], along[inside]
+            num_photons = len(lon)
+
+            beam_df = _classify_photons(lon, lat, center, mix, rng)
+            beam_df["delta_time"] = t0 + (along + half_length) / GROUND_SPEED_M_S
+            beam_df["confidence"] = rng.choice(numpy.array((2, 3, 4), dtype=numpy.int8), num_photons,
+                                               p=(0.05, 0.15, 0.8))
+            beam_df["laser"] = f"gt{pair_num}{side}"
+            beam_df["along_track_m"] = along - along.min()
+            beam_dfs.append(beam_df.sort_values("delta_time", ignore_index=True))
+
+    if len(beam_dfs) == 0:
+        return pandas.DataFrame(columns=["x", "y", "z", "class_code", "bathy_confidence", "delta_time",
+                                         "confidence", "laser", "along_track_m"])
+
+    return pandas.concat(beam_dfs, ignore_index=True)
+
+
+def _classify_photons(lon, lat, center, mix, rng) -> pandas.DataFrame:
+    """Classify photons over the synthetic surface, and give them heights, per the class mix.
+
+    Returns a dataframe with x, y, z, class_code and bathy_confidence columns."""
+    num_photons = len(lon)
+    ground = synthetic_surface(lon, lat, center)
+    z = ground + rng.normal(0.0, 0.25, num_photons)
+    class_code = numpy.ones(num_photons, dtype=numpy.int8)
+    bathy_confidence = numpy.full(num_photons, numpy.nan, dtype=numpy.float32)
+    draw = rng.uniform(0.0, 1.0, num_photons)
+
+    # Land: canopy in the vegetated patches, buildings scattered among the ground photons.
+    land = ground >= 0
+    vegetation = _vegetation(lon, lat, center)
+    canopy_prob = numpy.clip(mix["canopy_frac"] * 2.0 * vegetation, 0.0, 1.0)
+    canopy_top_prob = numpy.clip(mix["canopy_top_frac"] * 2.0 * vegetation, 0.0, 1.0)
+    canopy_top = land & (draw < canopy_top_prob)
+    canopy = land & ~canopy_top & (draw < canopy_prob + canopy_top_prob)
+    buildings = land & ~canopy_top & ~canopy & (draw > 1.0 - mix["buildings_frac"])
+    class_code[canopy] = 2
+    z[canopy] += rng.uniform(2.0, 18.0, numpy.count_nonzero(canopy))
+    class_code[canopy_top] = 3
+    z[canopy_top] += rng.uniform(15.0, 22.0, numpy.count_nonzero(canopy_top))
+    class_code[buildings] = 7
+    z[buildings] += rng.uniform(3.0, 12.0, numpy.count_nonzero(buildings))
+
+    # Water: sea-surface photons, and sea-floor photons down to the maximum depth. Beyond it, only the surface.
+    water = ~land
+    bathy_surface = water & ((draw < mix["bathy_surface_frac"]) | (ground < -mix["max_bathy_depth_m"]))
+    bathy_floor = water & ~bathy_surface
+    class_code[bathy_surface] = 41
+    z[bathy_surface] = rng.normal(0.0, 0.3, numpy.count_nonzero(bathy_surface))
+    class_code[bathy_floor] = 40
+    # Confidence in the sea-floor photons drops with depth.
+    depth_frac = numpy.clip(-ground[bathy_floor] / mix["max_bathy_depth_m"], 0.0, 1.0)
+    bathy_confidence[bathy_floor] = numpy.clip(
+        1.0 - 0.4 * depth_frac - rng.uniform(0.0, 0.2, len(depth_frac)), 0.0, 1.0)
+
+    return pandas.DataFrame({"x": lon, "y": lat, "z": z,
+                             "class_code": class_code,
+                             "bathy_confidence": bathy_confidence})
+
+
+def write_synthetic_granule(nc_fname: str,
+                            photons_df: pandas.DataFrame,
+                            query_bbox: tuple,
+                            vertical_datum: str = SYNTHETIC_VERTICAL_EPSG) -> None:
+    """Write synthetic photons to a granule .nc file, with the same metadata attributes as a processed real granule."""
+    xr_ds = xarray.Dataset.from_dataframe(photons_df)
+    xr_ds.attrs = icesat2_database_v2.IS2Database._granule_metadata_attrs(photons_df, nc_fname, query_bbox,
+                                                                          vertical_datum)
+    os.makedirs(os.path.dirname(os.path.abspath(nc_fname)), exist_ok=True)
+    xr_ds.to_netcdf(nc_fname)
+
+
+def synthetic_database_config(db_dir: str) -> utils.configfile.Config:
+    """Return an IVERT configuration whose ICESat-2 photon database lives in db_dir."""
+    config = utils.configfile.Config()
+    config.icesat2_granules_directory = os.path.join(db_dir, "granules")
+    config.icesat2_granules_gpkg = os.path.join(db_dir, "synthetic_granules_database.gpkg")
+    config.icesat2_granules_blosc = os.path.join(db_dir, "synthetic_granules_database.blosc")
+    config.icesat2_download_directory = os.path.join(db_dir, "downloads")
+    return config
+
+
+def build_synthetic_database(db_dir: str,
+                             bbox: list | tuple,
+                             num_granules: int = 4,
+                             center: tuple = DEFAULT_CENTER,
+                             class_mix: str = "coastal",
+                             start_yyyymmdd: int = 20220101,
+                             seed: int = 0,
+                             verbose: bool = True) -> icesat2_database_v2.IS2Database:
+    """Write 'num_granules' synthetic granules over bbox (xmin, xmax, ymin, ymax) into db_dir, and build a photon
+    database of them there.
+
+    Successive granules alternate between ascending and descending tracks, a month apart, with their ground tracks
+    shifted across the bbox so they sample different parts of it.
+
+    Returns the IS2Database, which reads only from db_dir.
+    """
+    config = synthetic_database_config(db_dir)
+    os.makedirs(config.icesat2_granules_directory, exist_ok=True)
+
+    rng = numpy.random.default_rng(seed)
+    bbox_e, _ = _lonlat_to_local_m(numpy.array(bbox[0:2]), numpy.array(bbox[2:4]), center)
+    bbox_width_m = float(bbox_e[1] - bbox_e[0])
+
+    start_year, start_month = divmod(int(start_yyyymmdd) // 100, 100)
+    total_photons = 0
+    for n in range(num_granules):
+        year, month = start_year + ((start_month - 1 + n) // 12), ((start_month - 1 + n) % 12) + 1
+        yyyymmdd = (year * 10000) + (month * 100) + 1 + int(rng.integers(0, 28))
+        track_offset_m = ((n + 0.5) / num_granules - 0.5) * bbox_width_m
+        photons_df = synthetic_granule_photons(bbox, yyyymmdd,
+                                               center=center,
+                                               track_offset_m=track_offset_m,
+                                               heading_deg=12.0,
+                                               ascending=(n % 2 == 0),
+                                               class_mix=class_mix,
+                                               seed=seed + n)
+        if len(photons_df) == 0:
+            continue
+
+        query_bbox = (bbox[0], bbox[1], bbox[2], bbox[3], yyyymmdd,
+                      icesat2_database_v2.IS2Database.increment_yyyymmdd_by_n(yyyymmdd, 2))
+        nc_fname = os.path.join(config.icesat2_granules_directory,
+                                icesat2_database_v2.IS2Database._nc_filename(
+                                    f"SYNTH_ATL03_{yyyymmdd}_{n:04d}.h5", query_bbox))
+        write_synthetic_granule(nc_fname, photons_df, query_bbox)
+        total_photons += len(photons_df)
+
+    if verbose:
+        print(f"Wrote {num_granules} synthetic granules with {total_photons:,} photons.")
+
+    database = icesat2_database_v2.IS2Database(config)
+    database.create_new_database(overwrite=True)
+    return database
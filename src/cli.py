@@ -10,6 +10,7 @@ Command-line interface for the ICESat-2 Validation of Elevations Reporting Tool
 import glob
 import logging
 import os
+import time
 
 # Set NUMEXPR_MAX_THREADS before any import loads NumExpr, to suppress the
 # "safe limit" warning on machines with many cores.
@@ -747,7 +748,7 @@ def cache_delete(force):
 def _run_validate(files_or_directory, vdatum, region_name, include_photons,
                   measure_coverage, band_num, outlier_sd_threshold, buildings,
                   confidence_level, bathy_confidence, outdir=None, ndv=None,
-                  export_formats=None):
+                  export_formats=None, max_photons_per_cell=None, seed=None, timings=False):
     """Branch to validate_dem or validate_list_of_dems based on the number of input files."""
     verbose = logging.getLogger().level <= logging.INFO
     try:
@@ -831,6 +832,8 @@ def _run_validate(files_or_directory, vdatum, region_name, include_photons,
             include_photon_level_validation=include_photons,
             location_name=region_name,
             measure_coverage=measure_coverage,
+            max_photons_per_cell=max_photons_per_cell,
+            subsample_seed=seed,
             min_confidence_level=confidence_level,
             min_bathy_confidence=bathy_confidence,
             verbose=verbose,
@@ -841,7 +844,9 @@ def _run_validate(files_or_directory, vdatum, region_name, include_photons,
             kwargs["dem_ndv"] = ndv_float
         if export_error_formats is not None:
             kwargs["export_error_formats"] = export_error_formats
-        vd_module.validate_dem(**kwargs)
+        output_files = vd_module.validate_dem(**kwargs)
+        if timings:
+            _print_stage_timings(output_files)
     else:
         dem_input = expanded[0] if len(expanded) == 1 else expanded
         if not os.path.isabs(outdir):
@@ -862,6 +867,8 @@ def _run_validate(files_or_directory, vdatum, region_name, include_photons,
             place_name=region_name,
             include_photon_validation=include_photons,
             measure_coverage=measure_coverage,
+            max_photons_per_cell=max_photons_per_cell,
+            subsample_seed=seed,
             outliers_sd_threshold=outlier_sd_threshold,
             min_confidence_level=confidence_level,
             min_bathy_confidence=bathy_confidence,
@@ -873,7 +880,22 @@ def _run_validate(files_or_directory, vdatum, region_name, include_photons,
             kwargs["dem_ndv"] = ndv_float
         if export_error_formats is not None:
             kwargs["export_error_formats"] = export_error_formats
-        vdc_module.validate_list_of_dems(**kwargs)
+        vdc_module.validate_list_of_dems(print_stage_timings=timings, **kwargs)
+
+
+def _print_stage_timings(output_files):
+    """Print the stage timings table of a validated DEM, from the '_stage_timings.json' file among its outputs."""
+    try:
+        from utils import stage_timings
+    except ImportError:
+        from ivert_utils import stage_timings
+
+    timings_files = [fn for fn in (output_files or []) if isinstance(fn, str) and fn.endswith("_stage_timings.json")
+                     and os.path.exists(fn)]
+    if not timings_files:
+        click.echo("No stage timings were written. Enable the 'write_stage_timings' setting to record them.")
+        return
+    click.echo(stage_timings.format_stage_table(stage_timings.read_stage_timings(timings_files[0])))
 
 
 @ivert_cli.command("validate")
@@ -913,7 +935,7 @@ def _run_validate(files_or_directory, vdatum, region_name, include_photons,
     default=False,
     help=(
         "Return a point database of individual ICESat-2 photons used to validate "
-        "each DEM, in addition to the normal .h5 and .tif results outputs."
+        "each DEM, in addition to the normal results dataframe and .tif outputs."
     ),
 )
 @click.option(
@@ -926,6 +948,26 @@ def _run_validate(files_or_directory, vdatum, region_name, include_photons,
         "coarse-resolution DEMs where sampling bias may matter."
     ),
 )
+@click.option(
+    "-mp", "--max-photons", "max_photons_per_cell",
+    type=click.IntRange(min=2),
+    default=None,
+    metavar="N",
+    help=(
+        "Use at most N photons in each grid cell, randomly chosen. Speeds up "
+        "validation of coarse DEMs with many photons per cell. Default: use all photons."
+    ),
+)
+@click.option(
+    "--seed",
+    type=int,
+    default=None,
+    metavar="SEED",
+    help=(
+        "Random seed for choosing photons with --max-photons. Reruns with the "
+        "same seed select the same photons and give identical results."
+    ),
+)
 @click.option(
     "-bn", "--band-num", "band_num",
     type=int,
@@ -1004,9 +1046,50 @@ def _run_validate(files_or_directory, vdatum, region_name, include_photons,
         "for this run only. Pass 'none' (or an empty string) to skip error exports."
     ),
 )
+@click.option(
+    "--timings",
+    is_flag=True,
+    default=False,
+    help=(
+        "Print a table of the wall time, CPU time, peak memory and bytes read of each "
+        "validation stage (summed over all DEMs). The timings of each DEM are also "
+        "written to its '_stage_timings.json' file."
+    ),
+)
+@click.option(
+    "--profile", "profile_dir",
+    default=None,
+    metavar="DIR",
+    help=(
+        "Profile this run, including every validation sub-process and worker, and write "
+        "one profile per process to DIR. They are merged into 'ivert_profile.prof' and a "
+        "text report, 'ivert_profile.txt', at the end. Uses pyinstrument if installed, "
+        "otherwise cProfile."
+    ),
+)
+@click.option(
+    "--profiler",
+    type=click.Choice(["auto", "cprofile", "pyinstrument"], case_sensitive=False),
+    default="auto",
+    show_default=True,
+    help="Profiler to use with --profile. 'auto' uses pyinstrument if installed, otherwise cProfile.",
+)
+@click.option(
+    "--metrics-file", "metrics_file",
+    default=None,
+    metavar="FILE",
+    help=(
+        "Export throughput metrics (DEMs completed, cells and photons validated per "
+        "second, granule cache hits, worker restarts) to FILE in the 'metrics_format' "
+        "text format (OpenMetrics by default), rewritten periodically while validating. "
+        "Set 'metrics_format = prometheus' to scrape it with the node-exporter textfile "
+        "collector. Overrides the 'metrics_textfile' setting."
+    ),
+)
 def validate(files_or_directory, vdatum, list_vdatums, region_name, include_photons,
-             measure_coverage, band_num, outlier_sd_threshold, buildings,
-             confidence_level, bathy_confidence, outdir, ndv, export_formats):
+             measure_coverage, max_photons_per_cell, seed, band_num, outlier_sd_threshold, buildings,
+             confidence_level, bathy_confidence, outdir, ndv, export_formats, timings, profile_dir, profiler,
+             metrics_file):
     """Validate one or more DEMs against ICESat-2 photon data.
 
     FILES_OR_DIRECTORY can be one or more GeoTIFF paths, a directory
@@ -1035,10 +1118,153 @@ def validate(files_or_directory, vdatum, list_vdatums, region_name, include_phot
     if not files_or_directory:
         raise click.UsageError("Missing argument 'FILES_OR_DIRECTORY'.")
 
-    _run_validate(files_or_directory, vdatum, region_name, include_photons,
-                  measure_coverage, band_num, outlier_sd_threshold, buildings,
-                  confidence_level, bathy_confidence, outdir, ndv=ndv,
-                  export_formats=export_formats)
+    if metrics_file is not None:
+        try:
+            from utils import metrics
+            from utils.configfile import Config
+        except ImportError:
+            from ivert_utils import metrics
+            from ivert_utils.configfile import Config
+        config = Config()
+        metrics.configure(metrics_file, fmt=config.metrics_format, interval_s=config.metrics_update_interval_s)
+
+    if profile_dir is None:
+        _run_validate(files_or_directory, vdatum, region_name, include_photons,
+                      measure_coverage, band_num, outlier_sd_threshold, buildings,
+                      confidence_level, bathy_confidence, outdir, ndv=ndv,
+                      export_formats=export_formats, max_photons_per_cell=max_photons_per_cell,
+                      seed=seed, timings=timings)
+        return
+
+    try:
+        from utils import profiling
+    except ImportError:
+        from ivert_utils import profiling
+
+    try:
+        profiler = profiling.enable(profile_dir, profiler=profiler.lower())
+    except ImportError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Profiling with {profiler} into {os.path.abspath(profile_dir)}.")
+
+    start_time = time.time()
+    try:
+        with profiling.profiled("main"):
+            _run_validate(files_or_directory, vdatum, region_name, include_photons,
+                          measure_coverage, band_num, outlier_sd_threshold, buildings,
+                          confidence_level, bathy_confidence, outdir, ndv=ndv,
+                          export_formats=export_formats, max_photons_per_cell=max_photons_per_cell,
+                          seed=seed, timings=timings)
+    finally:
+        profiling.disable()
+        profiling.merge_profiles(os.path.abspath(profile_dir), since=start_time)
+
+
+###############################################################
+# bench
+###############################################################
+
+@ivert_cli.command("bench")
+@click.option(
+    "-s", "--suite",
+    type=click.Choice(["small", "medium", "full"], case_sensitive=False),
+    default="small",
+    show_default=True,
+    help=(
+        "Suite of benchmark cases to run. 'small' runs two 1024x1024 DEMs, 'medium' "
+        "adds two 4096x4096 DEMs, and 'full' adds two 8192x8192 DEMs."
+    ),
+)
+@click.option(
+    "-c", "--case", "cases",
+    multiple=True,
+    metavar="NAME",
+    help="Run only this benchmark case (repeatable). Overrides --suite. Use --list-cases to see them.",
+)
+@click.option(
+    "--list-cases",
+    is_flag=True,
+    default=False,
+    help="Print the benchmark cases and the suites they're in, then exit.",
+)
+@click.option(
+    "-o", "--output",
+    default=None,
+    metavar="JSON",
+    help="JSON results file to write. Defaults to 'ivert_bench_<version>_<timestamp>.json' in the current directory.",
+)
+@click.option(
+    "-w", "--work-dir", "work_dir",
+    default=None,
+    metavar="DIR",
+    help=(
+        "Directory to generate the synthetic DEMs, photon database and outputs in, "
+        "kept afterward. Defaults to a temporary directory that is deleted afterward."
+    ),
+)
+@click.option(
+    "-np", "--numprocs",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of cell-validation worker processes. Defaults to the number of physical CPUs.",
+)
+@click.option(
+    "-r", "--repeats",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of times to run the validation pipeline on each case. Median times are reported.",
+)
+@click.option(
+    "--overlap-mode", "overlap_mode",
+    type=click.Choice(["sparse", "blocked"], case_sensitive=False),
+    default=None,
+    help="DEM overlap mode to benchmark. Defaults to the 'dem_overlap_mode' setting.",
+)
+@click.option(
+    "--compare",
+    default=None,
+    metavar="BASELINE_JSON",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Compare the stage times against a previous 'ivert bench' results file.",
+)
+def bench(suite, cases, list_cases, output, work_dir, numprocs, repeats, overlap_mode, compare):
+    """Benchmark each stage of DEM validation on synthetic data.
+
+    Generates synthetic DEMs and a temporary ICESat-2 photon database of
+    synthetic granules, times each stage of the validation pipeline on them,
+    and writes the timings to a JSON file. No downloaded data is needed.
+
+    Example: ivert bench --suite medium --compare ivert_bench_baseline.json
+    """
+    try:
+        from ivert.benchmarks import run_benchmarks
+    except ImportError:
+        from benchmarks import run_benchmarks
+
+    if list_cases:
+        for case_name, case in run_benchmarks.BENCHMARK_CASES.items():
+            suites = [s for s, s_cases in run_benchmarks.BENCHMARK_SUITES.items() if case_name in s_cases]
+            click.echo(f"  {case_name:<26s} {case['xsize']}x{case['ysize']} EPSG:{case['epsg']}, "
+                       f"'{case['nodata_pattern']}' nodata, '{case['class_mix']}' photons, "
+                       f"{case['num_granules']} granules  (suites: {', '.join(suites)})")
+        return
+
+    unknown = [c for c in cases if c not in run_benchmarks.BENCHMARK_CASES]
+    if unknown:
+        raise click.ClickException(f"Unknown benchmark case(s): {', '.join(unknown)}. "
+                                   "Run 'ivert bench --list-cases' to see them.")
+
+    results = run_benchmarks.run_benchmarks(suite=suite.lower(),
+                                            cases=list(cases) if cases else None,
+                                            output_json=output,
+                                            work_dir=work_dir,
+                                            numprocs=numprocs,
+                                            repeats=repeats,
+                                            overlap_mode=overlap_mode.lower() if overlap_mode else None,
+                                            verbose=True)
+    if compare:
+        click.echo("\n" + run_benchmarks.compare_benchmark_results(compare, results))
 
 
 ###############################################################
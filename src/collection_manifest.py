@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""collection_manifest.py -- A JSON-lines job manifest for incremental, resumable collection validations.
+
+validate_dem_collection.validate_list_of_dems() appends one line to the manifest each time it finishes (or fails) a
+DEM. Each line records:
+    - the DEM's input fingerprint: its absolute path, modification time, and size, and a hash of the validation options,
+    - its status: "done" (results written), "empty" (no ICESat-2 results), or "failed",
+    - its output files, and
+    - (for "done" DEMs) the summary sketch of its results (see summary_sketch.py).
+
+On a rerun, a DEM whose fingerprint matches its latest "done" or "empty" record, and whose outputs still exist, is
+skipped without reading anything else. Changed or new DEMs, and ones that failed, are validated again. The
+collection summary is then rebuilt by merging the sketches already in the manifest, without re-reading any results
+files.
+
+Lines are only ever appended (and flushed) as each DEM finishes, so an interrupted run loses at most the DEM in
+progress. The latest record for a DEM wins. compact() rewrites the file with only the latest records.
+
+The set of DEMs the collection summary files were last built from is kept in a small JSON sidecar (see
+summary_inputs()). If no DEM was re-validated, the summary files are only reused if they were built from the same
+DEMs, so DEMs that were deleted or filtered out of the collection since then don't linger in the summary.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import summary_sketch
+
+STATUS_DONE = "done"
+STATUS_EMPTY = "empty"
+STATUS_FAILED = "failed"
+
+
+def options_hash(options: dict) -> str:
+    """Return a short hash of the validation options (any JSON-serializable dictionary)."""
+    options_str = json.dumps(options, sort_keys=True, default=str)
+    return hashlib.sha1(options_str.encode("utf-8")).hexdigest()[:16]
+
+
+def fingerprint(dem_path: str, opts_hash: str) -> dict:
+    """Return the input fingerprint of a DEM file: its absolute path, mtime, size, and the options hash."""
+    stat = os.stat(dem_path)
+    return {"dem_path": os.path.abspath(dem_path),
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "options_hash": opts_hash}
+
+
+def summary_inputs(results_dem_names: list | tuple, empty_files: list | tuple) -> dict:
+    """Return the inputs a collection summary is built from: the names of the DEMs with results, and the
+    empty-results files of the DEMs without, in a form that compares equal regardless of their order."""
+    return {"results_dems": sorted(results_dem_names),
+            "empty_files": sorted(os.path.abspath(fn) for fn in empty_files)}
+
+
+def read_summary_inputs(fname: str) -> dict | None:
+    """Read the summary inputs written by write_summary_inputs(), or None if they don't exist or can't be read."""
+    if not os.path.exists(fname):
+        return None
+    try:
+        with open(fname, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def write_summary_inputs(fname: str, inputs: dict) -> None:
+    """Write the inputs of a collection summary (see summary_inputs()) next to it."""
+    tmp_fname = fname + ".tmp"
+    with open(tmp_fname, "w") as f:
+        json.dump(inputs, f, indent=1)
+    os.replace(tmp_fname, fname)
+
+
+class CollectionManifest:
+    """Per-DEM status records of a collection validation, kept in a JSON-lines file."""
+
+    def __init__(self, manifest_fname: str):
+        self.fname = manifest_fname
+        # Latest record for each DEM, keyed by absolute DEM path.
+        self.records = {}
+
+        if os.path.exists(self.fname):
+            with open(self.fname, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A partial line left by an interrupted run. Ignore it.
+                        continue
+                    self.records[record["dem_path"]] = record
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def current_record(self, dem_path: str, opts_hash: str) -> dict | None:
+        """Return the DEM's latest record if it's still up to date, or None if the DEM needs (re-)validating.
+
+        A record is up to date if the DEM's fingerprint hasn't changed, its status is "done" or "empty", and its
+        results (or empty-results) file and other output files all still exist. (Outputs rendered in the background
+        may be missing if a run was interrupted.)"""
+        record = self.records.get(os.path.abspath(dem_path))
+        if record is None or record["status"] not in (STATUS_DONE, STATUS_EMPTY):
+            return None
+
+        fp = fingerprint(dem_path, opts_hash)
+        if any(record[key] != fp[key] for key in ("mtime", "size", "options_hash")):
+            return None
+
+        if record["status"] == STATUS_DONE and not os.path.exists(record["results_file"]):
+            return None
+        if record["status"] == STATUS_EMPTY and not os.path.exists(record["empty_file"]):
+            return None
+        if not all(os.path.exists(fn) for fn in record["output_files"]):
+            return None
+
+        return record
+
+    def record(self, dem_path: str, opts_hash: str, status: str,
+               results_file: str | None = None,
+               empty_file: str | None = None,
+               output_files: list | tuple = (),
+               sketch: summary_sketch.SummarySketch | None = None) -> dict:
+        """Record a DEM's status and outputs, appending the record to the manifest file right away."""
+        record = fingerprint(dem_path, opts_hash)
+        record.update({"status": status,
+                       "results_file": results_file,
+                       "empty_file": empty_file,
+                       "output_files": list(output_files),
+                       "sketch": None if sketch is None else sketch.to_dict(),
+                       "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")})
+        self.records[record["dem_path"]] = record
+
+        with open(self.fname, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+
+        return record
+
+    @staticmethod
+    def sketch_of(record: dict) -> summary_sketch.SummarySketch | None:
+        """Return the summary sketch stored in a record, or None if it doesn't have one."""
+        if record.get("sketch") is None:
+            return None
+        return summary_sketch.SummarySketch.from_dict(record["sketch"])
+
+    def compact(self) -> None:
+        """Rewrite the manifest file with only the latest record of each DEM."""
+        tmp_fname = self.fname + ".tmp"
+        with open(tmp_fname, "w") as f:
+            for record in self.records.values():
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp_fname, self.fname)
@@ -1,7 +1,8 @@
 
+import concurrent.futures
 import numpy
 import rasterio
-import shapely.geometry
+import shapely
 import os
 import geopandas
 import sys
@@ -12,46 +13,115 @@ format_dict = {"gpkg": ".gpkg",
                "shapefile": ".shp",
                "xyz": ".xyz"}
 
-def convert_ivert_error_map_to_vector(ivert_error_tifs, output_format="gpkg", overwrite=True, verbose=True):
-    """Convert an IVERT raster error_map.tif file into a vector file for easier viewing in GIS programs."""
+# Points are collected from the raster blocks and appended to the output file once at least this many are waiting.
+POINTS_PER_WRITE = 500000
 
-    # Open the raster
-    for tif_file in ivert_error_tifs:
-        src = rasterio.open(tif_file, mode='r')
-        array = src.read(1)
 
-        ndv = src.nodatavals[0]
+def convert_ivert_error_map_to_vector(ivert_error_tifs, output_format="gpkg", overwrite=True, numprocs=None,
+                                      verbose=True):
+    """Convert IVERT raster error_map.tif files into vector files for easier viewing in GIS programs.
+
+    Each file is converted block-by-block (see convert_one_error_map_to_vector()). Multiple files are converted in
+    parallel, in up to 'numprocs' worker processes (default: one per file, up to the number of CPUs)."""
+    if isinstance(ivert_error_tifs, str):
+        ivert_error_tifs = [ivert_error_tifs]
+
+    if numprocs is None:
+        numprocs = min(len(ivert_error_tifs), os.cpu_count() or 1)
+
+    if numprocs <= 1 or len(ivert_error_tifs) <= 1:
+        return [convert_one_error_map_to_vector(tif_file, output_format=output_format, overwrite=overwrite,
+                                                verbose=verbose)
+                for tif_file in ivert_error_tifs]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=numprocs) as executor:
+        futures = [executor.submit(convert_one_error_map_to_vector, tif_file,
+                                   output_format=output_format, overwrite=overwrite, verbose=verbose)
+                   for tif_file in ivert_error_tifs]
+        return [f.result() for f in futures]
+
+
+def convert_one_error_map_to_vector(tif_file, output_format="gpkg", overwrite=True, verbose=True):
+    """Convert one IVERT raster error_map.tif file into a vector file of points at the valid cell centers.
+
+    The raster is read one block at a time. Each block's valid cells are converted to points in vectorized form, and
+    the points are appended to the output file in batches of at least POINTS_PER_WRITE, so the whole raster is never
+    held in memory.
+
+    Returns the name of the vector file written, or None if it already existed and overwrite is False."""
+    # Convert the filename to the output vector format.
+    output_ext = format_dict[output_format.strip().lower()]
+    vector_fname = os.path.splitext(tif_file)[0] + (output_ext if (output_ext[0] == ".") else ('.' + output_ext))
 
-        good_rows, good_cols = numpy.where((~array.isnan()) if numpy.isnan(ndv) else (array != ndv))
-        good_xs, good_ys = rasterio.transform.xy(src.transform, good_rows, good_cols, offset='center')
-        good_data = array[good_rows, good_cols]
-        # print(min(good_data), max(good_data))
+    if os.path.exists(vector_fname):
+        if overwrite:
+            os.remove(vector_fname)
+        else:
+            if verbose:
+                print(vector_fname, "already exists.")
+            return None
+
+    num_points = 0
+    with rasterio.open(tif_file, mode='r') as src:
+        ndv = src.nodatavals[0]
         crs = src.crs
+        transform = src.transform
+
+        pending = []
+        num_pending = 0
+        for _, window in src.block_windows(1):
+            array = src.read(1, window=window)
+
+            # Cells without data are NaN, or equal to the nodata value if one is set.
+            valid_mask = ~numpy.isnan(array) if numpy.issubdtype(array.dtype, numpy.floating) \
+                else numpy.ones(array.shape, dtype=bool)
+            if ndv is not None and not numpy.isnan(ndv):
+                valid_mask &= (array != ndv)
+
+            rows, cols = numpy.nonzero(valid_mask)
+            if len(rows) == 0:
+                continue
+
+            # Cell-center coordinates, from the affine transform.
+            xs, ys = transform * (cols + window.col_off + 0.5, rows + window.row_off + 0.5)
+            pending.append((numpy.asarray(xs), numpy.asarray(ys), array[rows, cols]))
+            num_pending += len(rows)
+
+            if num_pending >= POINTS_PER_WRITE:
+                num_points += _append_points(pending, vector_fname, output_ext, crs, first=(num_points == 0))
+                pending = []
+                num_pending = 0
+
+        if num_pending > 0 or num_points == 0:
+            num_points += _append_points(pending, vector_fname, output_ext, crs, first=(num_points == 0))
+
+    if verbose:
+        print(vector_fname, "written with", num_points, "points.")
 
-        data_dict = {'error_val': good_data,
-                     'geometry': [shapely.geometry.Point(x, y) for (x,y) in zip(good_xs, good_ys)]}
+    return vector_fname
 
-        gdf = geopandas.GeoDataFrame(data=data_dict, geometry='geometry', crs=crs)
 
-        # Convert the filename to the output vector format.
-        output_ext = format_dict[output_format.strip().lower()]
-        vector_fname = os.path.splitext(tif_file)[0] + (output_ext if (output_ext[0] == ".") else ('.' + output_ext))
+def _append_points(pending, vector_fname, output_ext, crs, first=False):
+    """Append a batch of (xs, ys, error_vals) blocks to the vector file, creating it if 'first'.
 
-        if os.path.exists(vector_fname):
-            if overwrite:
-                os.remove(vector_fname)
-            else:
-                if verbose:
-                    print(vector_fname, "already exists.")
-                return
+    Returns the number of points written."""
+    if len(pending) > 0:
+        xs, ys, error_vals = (numpy.concatenate(arrays) for arrays in zip(*pending))
+    else:
+        xs = ys = error_vals = numpy.empty(0)
 
-        gdf.to_file(vector_fname)
-        if verbose:
-            print(vector_fname, "written with", len(gdf), "points.")
+    if output_ext == ".xyz":
+        with open(vector_fname, "w" if first else "a") as f:
+            numpy.savetxt(f, numpy.column_stack((xs, ys, error_vals)))
+        return len(xs)
 
-    return
+    gdf = geopandas.GeoDataFrame(data={'error_val': error_vals},
+                                 geometry=shapely.points(xs, ys),
+                                 crs=crs)
+    gdf.to_file(vector_fname, mode="w" if first else "a")
+    return len(gdf)
 
 
 if __name__ == "__main__":
     filenames = sys.argv[1:]
-    convert_ivert_error_map_to_vector(filenames)
\ No newline at end of file
+    convert_ivert_error_map_to_vector(filenames)
@@ -2,7 +2,13 @@
 """ivert_output_vector.py — convert IVERT ICESat-2 .nc granule files to GIS vector formats.
 
 Reads one or more .nc files produced by IS2Database._process_h5_to_nc() and
-writes them as geolocated point vector files (GeoPackage, Shapefile, or CSV/XYZ).
+writes them as geolocated point vector files (GeoPackage, FlatGeobuf, GeoParquet,
+Shapefile, or CSV/XYZ).
+
+Granules are streamed to the output a chunk of photons at a time, so any number of
+granules can be merged into one layer without holding them all in memory. Class and
+bounding-box filters are applied to each chunk as it's read, before the rest of its
+columns are loaded.
 
 Usage
 -----
@@ -21,10 +27,14 @@ Examples
 
     # Merge all inputs into one output file
     python ivert_output_vector.py granules/ --merge -o merged_bahamas.gpkg
+
+    # Merge the ground photons within a lon/lat box into one GeoParquet file
+    python ivert_output_vector.py granules/ --merge -of parquet --classes 1 --bbox -78.0 24.0 -77.5 24.5
 """
 
 import argparse
 import glob
+import json
 import os
 import sys
 
@@ -32,6 +42,11 @@ import geopandas
 import netCDF4
 import numpy as np
 import pandas as pd
+import pyarrow
+import pyarrow.parquet
+from osgeo import ogr, osr
+
+ogr.UseExceptions()
 
 # ---------------------------------------------------------------------------
 # Constants
@@ -46,21 +61,38 @@ CLASS_NAMES = {
 }
 
 SUPPORTED_FORMATS = {
-    "gpkg": ("GPKG",  ".gpkg"),
-    "shp":  ("ESRI Shapefile", ".shp"),
-    "csv":  (None,    ".csv"),
-    "xyz":  (None,    ".xyz"),
+    "gpkg":    ("GPKG",  ".gpkg"),
+    "fgb":     ("FlatGeobuf", ".fgb"),
+    "parquet": (None,    ".parquet"),
+    "shp":     ("ESRI Shapefile", ".shp"),
+    "csv":     (None,    ".csv"),
+    "xyz":     (None,    ".xyz"),
 }
 
 WGS84_EPSG = 4326
 
+# Number of photons read from a granule (and written to the output) at a time.
+NC_CHUNK_SIZE = 2_000_000
+
+# Number of features written per OGR transaction when GDAL's Arrow bulk path isn't available.
+_OGR_BATCH_SIZE = 100_000
+
 
 # ---------------------------------------------------------------------------
 # Core conversion
 # ---------------------------------------------------------------------------
-def nc_to_geodataframe(nc_path: str,
-                       classes: list = None) -> geopandas.GeoDataFrame:
-    """Read a single .nc granule file and return a GeoDataFrame.
+def _class_names(class_code: np.ndarray) -> pd.Categorical:
+    """Map photon class codes to class names, as a categorical (one name lookup per distinct code)."""
+    codes, inverse = np.unique(class_code, return_inverse=True)
+    return pd.Categorical.from_codes(inverse.reshape(-1),
+                                     [CLASS_NAMES.get(int(c), f"class_{c}") for c in codes])
+
+
+def read_nc_chunks(nc_path: str,
+                   classes: list = None,
+                   bbox: tuple = None,
+                   chunk_size: int = NC_CHUNK_SIZE):
+    """Read a .nc granule file a chunk of photons at a time, yielding one DataFrame per chunk.
 
     Parameters
     ----------
@@ -68,46 +100,89 @@ def nc_to_geodataframe(nc_path: str,
         Path to the .nc file.
     classes : list of int, optional
         If given, keep only photons whose class_code is in this list.
+    bbox : (west, south, east, north), optional
+        If given, keep only photons within this lon/lat box.
+    chunk_size : int
+        Number of photons read at a time. Chunks with no photons left after filtering are skipped.
+
+    The filters are applied to each chunk's x, y and class_code before any other columns are read.
     """
     with netCDF4.Dataset(nc_path) as ds:
-        def _arr(name):
-            v = ds.variables[name][:]
-            return v.data if hasattr(v, "data") else np.array(v)
-
-        x          = _arr("x")
-        y          = _arr("y")
-        z          = _arr("z").astype(float)
-        class_code = _arr("class_code").astype(int)
-        confidence = _arr("confidence").astype(int)
-        delta_time = _arr("delta_time")
-
-        bathy_conf = None
-        if "bathy_confidence" in ds.variables:
-            bathy_conf = _arr("bathy_confidence").astype(float)
+        # Read raw arrays rather than masked arrays.
+        ds.set_auto_mask(False)
+        variables = ds.variables
 
         # Pull granule-level metadata from global attributes
         granule_id = getattr(ds, "granule_id", os.path.splitext(os.path.basename(nc_path))[0])
+        has_bathy_conf = "bathy_confidence" in variables
+        num_photons = variables["x"].shape[0]
+
+        for start in range(0, num_photons, chunk_size):
+            chunk = slice(start, min(start + chunk_size, num_photons))
+            x          = variables["x"][chunk]
+            y          = variables["y"][chunk]
+            class_code = variables["class_code"][chunk].astype(int)
+
+            keep = None
+            if bbox is not None:
+                west, south, east, north = bbox
+                keep = (x >= west) & (x <= east) & (y >= south) & (y <= north)
+            if classes is not None:
+                class_mask = np.isin(class_code, classes)
+                keep = class_mask if keep is None else (keep & class_mask)
+
+            if keep is None:
+                def _arr(name):
+                    return variables[name][chunk]
+            else:
+                if not np.any(keep):
+                    continue
+                x, y, class_code = x[keep], y[keep], class_code[keep]
+
+                def _arr(name):
+                    return variables[name][chunk][keep]
+
+            df = pd.DataFrame({
+                "x":            x,
+                "y":            y,
+                "z":            _arr("z").astype(float),
+                "class_code":   class_code,
+                "class_name":   _class_names(class_code),
+                "confidence":   _arr("confidence").astype(int),
+                "delta_time":   _arr("delta_time"),
+                "granule_id":   pd.Categorical.from_codes(np.zeros(len(x), dtype=np.int8), [granule_id]),
+                # Granules without ATL24 bathymetry have no bathy_confidence. It's NaN for them, so every chunk has
+                # the same columns, and granules with and without it can be written to the same output.
+                "bathy_confidence": (_arr("bathy_confidence").astype(float) if has_bathy_conf
+                                     else np.full(len(x), np.nan)),
+            })
+
+            yield df
 
-    df = pd.DataFrame({
-        "x":            x,
-        "y":            y,
-        "z":            z,
-        "class_code":   class_code,
-        "class_name":   pd.array([CLASS_NAMES.get(c, f"class_{c}") for c in class_code],
-                                 dtype="string"),
-        "confidence":   confidence,
-        "delta_time":   delta_time,
-        "granule_id":   granule_id,
-    })
-    if bathy_conf is not None:
-        df["bathy_confidence"] = bathy_conf
-
-    if classes is not None:
-        df = df[df["class_code"].isin(classes)].reset_index(drop=True)
-
-    if df.empty:
+
+def nc_to_geodataframe(nc_path: str,
+                       classes: list = None,
+                       bbox: tuple = None) -> geopandas.GeoDataFrame:
+    """Read a single .nc granule file and return a GeoDataFrame.
+
+    Parameters
+    ----------
+    nc_path : str
+        Path to the .nc file.
+    classes : list of int, optional
+        If given, keep only photons whose class_code is in this list.
+    bbox : (west, south, east, north), optional
+        If given, keep only photons within this lon/lat box.
+    """
+    chunks = list(read_nc_chunks(nc_path, classes=classes, bbox=bbox))
+    if len(chunks) == 0:
+        df = pd.DataFrame(columns=["x", "y", "z", "class_code", "class_name", "confidence", "delta_time",
+                                   "granule_id", "bathy_confidence"])
         return geopandas.GeoDataFrame(df, geometry=[], crs=WGS84_EPSG)
 
+    df = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+    df["class_name"] = df["class_name"].astype("category")
+
     geometry = geopandas.points_from_xy(df["x"], df["y"], df["z"])
     gdf = geopandas.GeoDataFrame(df, geometry=geometry, crs=WGS84_EPSG)
     return gdf
@@ -138,6 +213,185 @@ def write_vector(gdf: geopandas.GeoDataFrame, outpath: str, fmt_key: str,
     print(f"  → {outpath}  ({len(gdf):,} photons)")
 
 
+# ---------------------------------------------------------------------------
+# Streaming output
+# ---------------------------------------------------------------------------
+def _points_to_wkb(x, y, z) -> pyarrow.Array:
+    """Encode 3D points as little-endian ISO WKB, built in numpy, as a pyarrow binary array (one point per row)."""
+    wkb_dtype = np.dtype([("byte_order", "u1"), ("geom_type", "<u4"),
+                          ("x", "<f8"), ("y", "<f8"), ("z", "<f8")])
+    wkb = np.empty(len(x), dtype=wkb_dtype)
+    wkb["byte_order"] = 1  # little-endian
+    wkb["geom_type"] = 1001  # ISO WKB "Point Z"
+    wkb["x"] = x
+    wkb["y"] = y
+    wkb["z"] = z
+    # Offsets are every 29 bytes: the WKB rows are fixed-width.
+    offsets = np.arange(0, (len(x) + 1) * wkb_dtype.itemsize, wkb_dtype.itemsize, dtype=np.int32)
+    return pyarrow.Array.from_buffers(pyarrow.binary(), len(x),
+                                      [None, pyarrow.py_buffer(offsets), pyarrow.py_buffer(wkb)])
+
+
+class StreamingVectorWriter:
+    """Write photon chunks (DataFrames from read_nc_chunks()) to a single output layer, one chunk at a time.
+
+    Point geometries are encoded as WKB in numpy, and each chunk is written in bulk: through GDAL's Arrow stream API
+    for GeoPackage, FlatGeobuf and Shapefile outputs (in batched OGR transactions if that isn't available), through a
+    Parquet writer for GeoParquet, and appended as text for CSV/XYZ. Use as a context manager, or call close().
+    """
+
+    def __init__(self, outpath: str, fmt_key: str, layer_name: str = None):
+        self.outpath = outpath
+        self.fmt_key = fmt_key
+        self.layer_name = layer_name or os.path.splitext(os.path.basename(outpath))[0]
+        self.count = 0
+
+        self._parquet_writer = None
+        self._data_source = None
+        self._layer = None
+
+    def write(self, df: pd.DataFrame) -> None:
+        """Append one chunk of photons to the output."""
+        if len(df) == 0:
+            return
+
+        if self.fmt_key in ("csv", "xyz"):
+            df.to_csv(self.outpath, mode="w" if self.count == 0 else "a", header=(self.count == 0), index=False)
+        else:
+            if self.fmt_key == "shp":
+                # Shapefiles truncate field names to 10 chars and don't support
+                # string columns well — drop granule_id if it would be truncated badly.
+                df = df.drop(columns=["class_name", "granule_id"], errors="ignore")
+                # Name the other long fields as the Shapefile driver would truncate them, so the Arrow columns match
+                # the layer's fields.
+                df = df.rename(columns={"bathy_confidence": "bathy_conf"})
+
+            table = pyarrow.Table.from_pandas(df, preserve_index=False)
+            table = table.append_column("geometry", _points_to_wkb(df["x"].to_numpy(), df["y"].to_numpy(),
+                                                                   df["z"].to_numpy()))
+            if self.fmt_key == "parquet":
+                self._write_parquet(table)
+            else:
+                self._write_ogr(table)
+
+        self.count += len(df)
+
+    def _write_parquet(self, table: pyarrow.Table) -> None:
+        if self._parquet_writer is None:
+            # GeoParquet metadata. With no "crs" given, the coordinates are OGC:CRS84 (WGS84 lon/lat).
+            geo_metadata = {"version": "1.0.0",
+                            "primary_column": "geometry",
+                            "columns": {"geometry": {"encoding": "WKB", "geometry_types": ["Point Z"]}}}
+            schema = table.schema.with_metadata({b"geo": json.dumps(geo_metadata).encode("utf-8")})
+            self._parquet_writer = pyarrow.parquet.ParquetWriter(self.outpath, schema, compression="zstd")
+        self._parquet_writer.write_table(table.cast(self._parquet_writer.schema))
+
+    def _create_ogr_layer(self, table: pyarrow.Table) -> None:
+        driver_name, _ = SUPPORTED_FORMATS[self.fmt_key]
+        driver = ogr.GetDriverByName(driver_name)
+        if driver is None:
+            raise RuntimeError(f"OGR driver '{driver_name}' is not available in this GDAL build.")
+
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(WGS84_EPSG)
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+        self._data_source = driver.CreateDataSource(self.outpath)
+        self._layer = self._data_source.CreateLayer(self.layer_name, srs, ogr.wkbPoint25D)
+        for field in table.schema:
+            if field.name == "geometry":
+                continue
+            if pyarrow.types.is_integer(field.type):
+                ftype = ogr.OFTInteger64 if field.type.bit_width > 32 else ogr.OFTInteger
+            elif pyarrow.types.is_floating(field.type):
+                ftype = ogr.OFTReal
+            else:
+                ftype = ogr.OFTString
+            self._layer.CreateField(ogr.FieldDefn(field.name, ftype))
+
+    def _write_ogr(self, table: pyarrow.Table) -> None:
+        # OGR takes plain strings rather than dictionary-encoded (categorical) columns.
+        for n, field in enumerate(table.schema):
+            if pyarrow.types.is_dictionary(field.type):
+                table = table.set_column(n, field.name, table.column(n).cast(pyarrow.string()))
+
+        if self._layer is None:
+            self._create_ogr_layer(table)
+
+        if hasattr(self._layer, "WriteArrow"):
+            # Bulk-write the chunk through GDAL's Arrow stream API (GDAL >= 3.8).
+            geometry_field = pyarrow.field(self._layer.GetGeometryColumn() or "geometry", pyarrow.binary(),
+                                           metadata={"ARROW:extension:name": "ogc.wkb"})
+            table = table.set_column(table.schema.get_field_index("geometry"), geometry_field,
+                                     table.column("geometry"))
+            self._layer.StartTransaction()
+            self._layer.WriteArrow(table)
+            self._layer.CommitTransaction()
+            return
+
+        layer_defn = self._layer.GetLayerDefn()
+        columns = [(layer_defn.GetFieldIndex(name), table.column(name).to_pylist())
+                   for name in table.column_names if name != "geometry"]
+        geometries = table.column("geometry").to_pylist()
+        for b_start in range(0, len(geometries), _OGR_BATCH_SIZE):
+            self._layer.StartTransaction()
+            for n in range(b_start, min(b_start + _OGR_BATCH_SIZE, len(geometries))):
+                feat = ogr.Feature(layer_defn)
+                for field_idx, values in columns:
+                    feat.SetField(field_idx, values[n])
+                feat.SetGeometryDirectly(ogr.CreateGeometryFromWkb(geometries[n]))
+                self._layer.CreateFeature(feat)
+                feat = None
+            self._layer.CommitTransaction()
+
+    def close(self) -> None:
+        """Finish writing the output file."""
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+        self._layer = None
+        self._data_source = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+def export_granules(nc_files: list, outpath: str, fmt_key: str,
+                    classes: list = None, bbox: tuple = None,
+                    overwrite: bool = False) -> int:
+    """Stream one or more .nc granules into a single output layer. Returns the number of photons written.
+
+    Nothing is written (and 0 is returned) if the output exists and overwrite is False, or if no photons are left
+    after filtering.
+    """
+    if os.path.exists(outpath):
+        if not overwrite:
+            print(f"  Skipping existing {os.path.basename(outpath)} (use -w to overwrite).")
+            return 0
+        os.remove(outpath)
+
+    with StreamingVectorWriter(outpath, fmt_key) as writer:
+        for nc_path in nc_files:
+            if len(nc_files) > 1:
+                print(f"Reading {os.path.basename(nc_path)} ...", flush=True)
+            count_before = writer.count
+            for chunk in read_nc_chunks(nc_path, classes=classes, bbox=bbox):
+                writer.write(chunk)
+            print(f"  {writer.count - count_before:,} photons")
+
+    if writer.count == 0:
+        if os.path.exists(outpath):
+            os.remove(outpath)
+        return 0
+
+    print(f"  → {outpath}  ({writer.count:,} photons)")
+    return writer.count
+
+
 # ---------------------------------------------------------------------------
 # File discovery
 # ---------------------------------------------------------------------------
@@ -191,6 +445,10 @@ def define_and_parse_args() -> argparse.Namespace:
         help="Comma-separated class codes to include (e.g. '1,40,41'). "
              "Default: all classes.",
     )
+    parser.add_argument(
+        "--bbox", nargs=4, type=float, default=None, metavar=("WEST", "SOUTH", "EAST", "NORTH"),
+        help="Lon/lat bounding box of photons to include. Default: all photons.",
+    )
     parser.add_argument(
         "-w", "--overwrite", action="store_true", default=False,
         help="Overwrite existing output files.",
@@ -208,6 +466,8 @@ def main():
     if args.classes:
         classes = [int(c.strip()) for c in args.classes.split(",")]
 
+    bbox = tuple(args.bbox) if args.bbox else None
+
     nc_files = collect_nc_files(args.inputs)
     if not nc_files:
         sys.exit("No .nc files found.")
@@ -216,31 +476,21 @@ def main():
         sys.exit(f"Output directory does not exist: {args.output_dir}")
 
     # ------------------------------------------------------------------
-    # Merged mode: combine all granules into one output file
+    # Merged mode: stream all granules into one output file
     # ------------------------------------------------------------------
     if args.merge:
-        gdfs = []
-        for nc_path in nc_files:
-            print(f"Reading {os.path.basename(nc_path)} ...", flush=True)
-            gdf = nc_to_geodataframe(nc_path, classes=classes)
-            print(f"  {len(gdf):,} photons")
-            gdfs.append(gdf)
-
-        if not gdfs:
-            sys.exit("No photons found after filtering.")
-
-        merged = geopandas.GeoDataFrame(
-            pd.concat(gdfs, ignore_index=True),
-            crs=WGS84_EPSG,
-        )
-
         if args.output:
             outpath = args.output
         else:
             outdir = args.output_dir or os.path.dirname(nc_files[0])
             outpath = os.path.join(outdir, "merged" + ext)
 
-        write_vector(merged, outpath, fmt_key, overwrite=args.overwrite)
+        if os.path.exists(outpath) and not args.overwrite:
+            print(f"  Skipping existing {os.path.basename(outpath)} (use -w to overwrite).")
+            return
+
+        if export_granules(nc_files, outpath, fmt_key, classes=classes, bbox=bbox, overwrite=args.overwrite) == 0:
+            sys.exit("No photons found after filtering.")
         return
 
     # ------------------------------------------------------------------
@@ -251,8 +501,6 @@ def main():
 
     for nc_path in nc_files:
         print(f"\n{os.path.basename(nc_path)}", flush=True)
-        gdf = nc_to_geodataframe(nc_path, classes=classes)
-        print(f"  {len(gdf):,} photons")
 
         if args.output:
             outpath = args.output
@@ -261,7 +509,7 @@ def main():
             outdir = args.output_dir or os.path.dirname(nc_path)
             outpath = os.path.join(outdir, stem + ext)
 
-        write_vector(gdf, outpath, fmt_key, overwrite=args.overwrite)
+        export_granules([nc_path], outpath, fmt_key, classes=classes, bbox=bbox, overwrite=args.overwrite)
 
 
 if __name__ == "__main__":
@@ -20,6 +20,7 @@ import globato
 import utils.pickle_blosc
 import utils.configfile
 import utils.cuboid_funcs
+import utils.metrics
 from icesat2_requests import ICESat2RequestsCSV
 
 logger = logging.getLogger(__name__)
@@ -291,6 +292,48 @@ class IS2Database:
         """Map a validated vertical_datum value to its vertical EPSG code string."""
         return "EPSG:4979" if vertical_datum == "ellipsoid" else "EPSG:3855"
 
+    @staticmethod
+    def _granule_metadata_attrs(df: pandas.DataFrame,
+                                nc_fn: str,
+                                query_bbox: tuple,
+                                vertical_datum: str) -> dict:
+        """Compute the metadata attributes of a granule .nc file (and its database record) from its photons.
+
+        df must have at least x, y, z, and class_code columns. vertical_datum is the vertical EPSG string of the
+        photon heights (e.g. 'EPSG:4979').
+        """
+        xmin, xmax = float(df["x"].min()), float(df["x"].max())
+        ymin, ymax = float(df["y"].min()), float(df["y"].max())
+        zmin = float(df["z"].min()) if "z" in df.columns else float("nan")
+        zmax = float(df["z"].max()) if "z" in df.columns else float("nan")
+        if "delta_time" in df.columns:
+            tmin = int(_delta_time_to_yyyymmdd(float(df["delta_time"].min())))
+            tmax = int(_delta_time_to_yyyymmdd(float(df["delta_time"].max())))
+        else:
+            tmin, tmax = int(query_bbox[4]), int(query_bbox[5])
+
+        cc = df["class_code"]
+        metadata_attrs = {
+            "granule_id":               os.path.splitext(os.path.basename(nc_fn))[0],
+            "laser_name":               "all",
+            "query_bbox":               list(query_bbox),
+            "data_bbox":                [xmin, xmax, ymin, ymax, tmin, tmax],
+            "zbounds":                  [zmin, zmax],
+            "numphotons":               len(df),
+            "numphotons_unclassified":  int(numpy.count_nonzero(cc == -1)),
+            "numphotons_noise":         int(numpy.count_nonzero(cc == 0)),
+            "numphotons_ground":        int(numpy.count_nonzero(cc == 1)),
+            "numphotons_canopy":        int(numpy.count_nonzero(cc == 2)),
+            "numphotons_canopy_top":    int(numpy.count_nonzero(cc == 3)),
+            "numphotons_buildings":     int(numpy.count_nonzero(cc == 7)),
+            "numphotons_bathy_floor":   int(numpy.count_nonzero(cc == 40)),
+            "numphotons_bathy_surface": int(numpy.count_nonzero(cc == 41)),
+            "downloaded_on":            int(datetime.datetime.now().strftime("%Y%m%d")),
+            "horizontal_datum":         "EPSG:4326",
+            "vertical_datum":           vertical_datum,
+        }
+        return metadata_attrs
+
     def _process_h5_to_nc(self,
                            h5_fn: str,
                            nc_fn: str,
@@ -309,8 +352,11 @@ class IS2Database:
         Returns the metadata dict, or None if no photons survived filtering.
         """
         if os.path.exists(nc_fn) and not overwrite:
+            utils.metrics.inc("granule_cache_hits")
             return self._read_nc_metadata(nc_fn)
 
+        utils.metrics.inc("granule_cache_misses")
+
         vertical_datum = self._validate_vertical_datum(self.config.icesat2_vertical_datum)
         vertical_datum = self._vertical_datum_to_vertical_epsg(vertical_datum)
 
@@ -358,37 +404,8 @@ class IS2Database:
                      "delta_time", "confidence", "laser"]
         df = df[[c for c in keep_cols if c in df.columns]].copy()
 
-        # Compute metadata for file attributes and the database record.
-        xmin, xmax = float(df["x"].min()), float(df["x"].max())
-        ymin, ymax = float(df["y"].min()), float(df["y"].max())
-        zmin = float(df["z"].min()) if "z" in df.columns else float("nan")
-        zmax = float(df["z"].max()) if "z" in df.columns else float("nan")
-        if "delta_time" in df.columns:
-            tmin = int(_delta_time_to_yyyymmdd(float(df["delta_time"].min())))
-            tmax = int(_delta_time_to_yyyymmdd(float(df["delta_time"].max())))
-        else:
-            tmin, tmax = int(query_bbox[4]), int(query_bbox[5])
-
-        cc = df["class_code"]
-        metadata_attrs = {
-            "granule_id":               os.path.splitext(os.path.basename(nc_fn))[0],
-            "laser_name":               "all",
-            "query_bbox":               list(query_bbox),
-            "data_bbox":                [xmin, xmax, ymin, ymax, tmin, tmax],
-            "zbounds":                  [zmin, zmax],
-            "numphotons":               len(df),
-            "numphotons_unclassified":  int(numpy.count_nonzero(cc == -1)),
-            "numphotons_noise":         int(numpy.count_nonzero(cc == 0)),
-            "numphotons_ground":        int(numpy.count_nonzero(cc == 1)),
-            "numphotons_canopy":        int(numpy.count_nonzero(cc == 2)),
-            "numphotons_canopy_top":    int(numpy.count_nonzero(cc == 3)),
-            "numphotons_buildings":     int(numpy.count_nonzero(cc == 7)),
-            "numphotons_bathy_floor":   int(numpy.count_nonzero(cc == 40)),
-            "numphotons_bathy_surface": int(numpy.count_nonzero(cc == 41)),
-            "downloaded_on":            int(datetime.datetime.now().strftime("%Y%m%d")),
-            "horizontal_datum":         "EPSG:4326",
-            "vertical_datum":           vertical_datum,
-        }
+        metadata_attrs = self._granule_metadata_attrs(df, nc_fn, query_bbox, vertical_datum)
+        xmin, xmax, ymin, ymax = metadata_attrs["data_bbox"][:4]
 
         # Add per-photon cumulative along-track distance from h5 geolocation data.
         # Merge on (laser, delta_time, x, y) — the four fields that uniquely identify
@@ -631,6 +648,8 @@ class IS2Database:
             fpath = os.path.join(self.granules_dir, granule_line["filename"])
             # print(os.path.basename(fpath))
             granule_dfs.append(self.read_granule(fpath, subset_bbox=bbox, photon_classes=photon_classes))
+            utils.metrics.inc("granules_read")
+            utils.metrics.inc("photons_read", len(granule_dfs[-1]))
             # print()
 
         if len(granule_dfs) == 0:
@@ -931,6 +950,7 @@ class IS2Database:
                 nc_dest = os.path.join(self.granules_dir, nc_basename)
                 if nc_basename in existing_filenames:
                     logger.info("Skipping %s (already in database).", nc_basename)
+                    utils.metrics.inc("granule_cache_hits")
                 else:
                     files_to_process.append((h5_src, nc_dest))
 
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""output_stage.py -- A background pool for rendering validation output files off the validation critical path.
+
+When validating a collection of DEMs, validate_dem.validate_dem() hands each DEM's output-rendering job (summary stats,
+error GeoTIFF, error exports, and plot) to an OutputStage instead of rendering them itself. The job is rendered by a
+background worker process from the DEM's results file, while the next DEM in the collection starts validating.
+
+join() waits for every job dispatched so far. Callers must join the stage before using any of the rendered outputs,
+such as before building a collection summary.
+"""
+
+import concurrent.futures
+import multiprocessing as mp
+import traceback
+
+import utils.configfile
+
+ivert_config = utils.configfile.Config()
+
+
+class OutputStage:
+    """A pool of worker processes that render validation outputs in the background."""
+
+    def __init__(self, max_workers: int | None = None, verbose: bool = True):
+        """Create the output stage.
+
+        Args:
+            max_workers: Number of worker processes. Defaults to the 'output_stage_workers' config setting.
+            verbose: Print each failed job's traceback when joining.
+        """
+        if max_workers is None:
+            max_workers = int(ivert_config.output_stage_workers)
+        assert max_workers > 0
+        self.max_workers = max_workers
+        self.verbose = verbose
+        # Pending jobs, keyed by a name for each (usually the DEM name).
+        self.futures = {}
+        self._executor = None
+
+    def submit(self, key: str, func, *args, **kwargs) -> None:
+        """Dispatch func(*args, **kwargs) to a background worker. All arguments must be picklable."""
+        if self._executor is None:
+            # The worker processes are only started when the first job is dispatched.
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers,
+                                                                    mp_context=mp.get_context())
+        self.futures[key] = self._executor.submit(func, *args, **kwargs)
+
+    def __len__(self) -> int:
+        """Number of jobs dispatched and not yet joined."""
+        return len(self.futures)
+
+    def join(self) -> dict:
+        """Wait for every dispatched job to finish.
+
+        Returns a dictionary of {key: exception} of the jobs that failed. It's empty if they all succeeded."""
+        failures = {}
+        for key, future in self.futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                failures[key] = e
+                if self.verbose:
+                    print(f"Rendering the outputs of {key} failed:\n" +
+                          "".join(traceback.format_exception(type(e), e, e.__traceback__)))
+
+        self.futures = {}
+        return failures
+
+    def shutdown(self, cancel_pending: bool = False) -> None:
+        """Shut down the worker processes. Jobs not yet started are cancelled if cancel_pending is set."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=cancel_pending)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(cancel_pending=exc_type is not None)
+        return False
@@ -20,6 +20,7 @@ Class codes (current convention):
 """
 
 import argparse
+import concurrent.futures
 import os
 import glob
 import sys
@@ -29,6 +30,7 @@ import pandas as pd
 import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
+import matplotlib.patches as mpatches
 import netCDF4
 
 
@@ -49,6 +51,9 @@ DEFAULT_STYLE = dict(color="lightgrey", label="Other", zorder=0, alpha=0.3, s=1)
 
 DEM_COLORS = ["dimgrey", "purple", "darkcyan", "darkmagenta", "darkgoldenrod"]
 
+# (along-track, elevation) bins of the noise density image drawn with noise_density=True.
+NOISE_DENSITY_BINS = (1200, 400)
+
 
 
 def _granule_id(filepath):
@@ -187,6 +192,103 @@ def _apply_vdatum_to_df(df, target_vert_epsg_int, cache_dir=None):
     return df
 
 
+class _DEMSampler:
+    """An opened DEM, with its CRS transformers and metadata, for sampling it along laser tracks.
+
+    Samplers are cached per DEM by _get_dem_sampler(), so each DEM is opened (and its transformers built) only once,
+    however many beams are profiled against it. Samples are read through utils.raster_access.RasterArray, which
+    memory-maps the DEM where it can and otherwise keeps the DEM blocks it has read in a cache, so blocks shared by
+    neighbouring beams are only read once.
+    """
+
+    def __init__(self, dem_path):
+        import rasterio
+        import pyproj
+        import utils.raster_access as raster_access
+
+        self.dem_path = dem_path
+        with rasterio.open(dem_path) as src:
+            self.nodata = src.nodata
+            self.inv_transform = ~src.transform
+            self.res = src.res  # native CRS units
+            self.height, self.width = src.height, src.width
+            bounds = tuple(src.bounds)
+            dem_rc_crs = src.crs
+
+        if dem_rc_crs is not None:
+            self.crs = pyproj.CRS.from_user_input(dem_rc_crs.to_wkt())
+            self.to_dem_crs = pyproj.Transformer.from_crs(pyproj.CRS.from_epsg(4326), self.crs, always_xy=True)
+            # The DEM's bounding box in lon/lat, for quickly skipping tracks that don't cross it.
+            self.lonlat_bounds = pyproj.Transformer.from_crs(self.crs, pyproj.CRS.from_epsg(4326), always_xy=True) \
+                .transform_bounds(*bounds)
+        else:
+            self.crs = None
+            self.to_dem_crs = None
+            self.lonlat_bounds = bounds
+
+        self.raster = raster_access.RasterArray(dem_path)
+        self._vert_epsg = None
+        self._vert_epsg_read = False
+
+    def resolution_m(self, clat):
+        """Estimate the DEM pixel size in metres, at latitude clat."""
+        res_crs_x, res_crs_y = self.res
+        if self.crs is not None and self.crs.is_geographic:
+            res_m = min(res_crs_x * 111320.0 * np.cos(np.radians(clat)),
+                        res_crs_y * 111320.0)
+        else:
+            res_m = min(res_crs_x, res_crs_y)
+        return max(res_m, 1.0)  # guard against zero or sub-metre values
+
+    def lonlat_mask(self, lons, lats, pad_frac=0.01):
+        """Return a boolean mask of the lon/lat points within the DEM's bounding box (padded by pad_frac)."""
+        west, south, east, north = self.lonlat_bounds
+        pad_x = (east - west) * pad_frac
+        pad_y = (north - south) * pad_frac
+        return (lons >= west - pad_x) & (lons <= east + pad_x) & (lats >= south - pad_y) & (lats <= north + pad_y)
+
+    def sample(self, lons, lats):
+        """Return the DEM values at lon/lat points in one vectorized lookup. Points outside the DEM are NaN."""
+        if self.to_dem_crs is not None:
+            px, py = self.to_dem_crs.transform(lons, lats)
+        else:
+            px, py = lons.copy(), lats.copy()
+
+        # Convert to pixel indices from the inverse affine transform.
+        cols_f, rows_f = self.inv_transform * (np.asarray(px), np.asarray(py))
+        rows = np.floor(rows_f).astype(np.int64)
+        cols = np.floor(cols_f).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.height) & (cols >= 0) & (cols < self.width)
+
+        z_dem = np.full(len(rows), np.nan)
+        z_dem[inside] = self.raster.sample(rows[inside], cols[inside])
+        return z_dem
+
+    def vertical_epsg(self):
+        """Return the EPSG code of the DEM's vertical datum, or None if it has none (or it can't be read)."""
+        if not self._vert_epsg_read:
+            self._vert_epsg_read = True
+            try:
+                import utils.dem_geom as dem_geom
+                _, dem_vert = dem_geom.get_dem_reference_frame_from_file(self.dem_path)
+                self._vert_epsg = dem_vert.to_epsg() if dem_vert is not None else None
+            except Exception:
+                self._vert_epsg = None
+        return self._vert_epsg
+
+
+# Opened DEM samplers, keyed by DEM path. Kept for the life of the process (or beam-plotting worker process).
+_DEM_SAMPLERS = {}
+
+
+def _get_dem_sampler(dem_path):
+    """Return the cached _DEMSampler for a DEM, opening it the first time."""
+    key = os.path.abspath(dem_path)
+    if key not in _DEM_SAMPLERS:
+        _DEM_SAMPLERS[key] = _DEMSampler(dem_path)
+    return _DEM_SAMPLERS[key]
+
+
 def _sample_dem_along_track(dem_path, lons, lats, along_track_m,
                              target_vert_epsg_int=None, cache_dir=None):
     """Sample a DEM raster along a laser track at the DEM's native pixel resolution.
@@ -196,13 +298,14 @@ def _sample_dem_along_track(dem_path, lons, lats, along_track_m,
     the DEM's pixel size, producing a continuous profile.  Individual DEM grid cells
     may be sampled more than once where the track runs at a shallow angle.
 
+    Only the stretch of track within the DEM's bounding box is sampled, and DEMs
+    the track doesn't cross are skipped before any sampling. The opened DEMs are
+    cached across calls (see _get_dem_sampler()).
+
     Returns (along_track_km, z_dem, label) or None if the DEM has no overlap.
     When target_vert_epsg_int is given and differs from the DEM's native vertical datum,
     the sampled elevations are transformed to that datum.
     """
-    import rasterio
-    import pyproj
-
     lons = np.asarray(lons, dtype=float)
     lats = np.asarray(lats, dtype=float)
     along_track_m = np.asarray(along_track_m, dtype=float)
@@ -212,79 +315,52 @@ def _sample_dem_along_track(dem_path, lons, lats, along_track_m,
     lons, lats, along_track_m = lons[order], lats[order], along_track_m[order]
 
     try:
-        with rasterio.open(dem_path) as src:
-            dem_nodata = src.nodata
-            dem_rc_crs = src.crs
+        sampler = _get_dem_sampler(dem_path)
+
+        in_bounds = sampler.lonlat_mask(lons, lats)
+        if not np.any(in_bounds):
+            print(f"  DEM {os.path.basename(dem_path)}: no overlap with laser track.", flush=True)
+            return None
+
+        # Build a dense along-track grid at DEM resolution spacing, over the stretch of track crossing the DEM.
+        res_m = sampler.resolution_m(float(np.mean(lats[in_bounds])))
+        atm_min, atm_max = along_track_m[in_bounds][0], along_track_m[in_bounds][-1]
+        n_pts = max(2, int(np.ceil((atm_max - atm_min) / res_m)) + 1)
+        dense_atm = np.linspace(atm_min, atm_max, n_pts)
+
+        # Interpolate lon/lat onto the dense grid.
+        dense_lons = np.interp(dense_atm, along_track_m, lons)
+        dense_lats = np.interp(dense_atm, along_track_m, lats)
 
-            # Estimate the DEM pixel size in metres along-track.
-            res_crs_x, res_crs_y = src.res  # native CRS units
-            if dem_rc_crs is not None:
-                dem_py_crs = pyproj.CRS.from_user_input(dem_rc_crs.to_wkt())
-                if dem_py_crs.is_geographic:
-                    clat = float(np.mean(lats))
-                    res_m = min(res_crs_x * 111320.0 * np.cos(np.radians(clat)),
-                                res_crs_y * 111320.0)
-                else:
-                    res_m = min(res_crs_x, res_crs_y)
-            else:
-                res_m = min(res_crs_x, res_crs_y)
-            res_m = max(res_m, 1.0)  # guard against zero or sub-metre values
-
-            # Build a dense along-track grid at DEM resolution spacing.
-            atm_min, atm_max = along_track_m[0], along_track_m[-1]
-            n_pts = max(2, int(np.ceil((atm_max - atm_min) / res_m)) + 1)
-            dense_atm = np.linspace(atm_min, atm_max, n_pts)
-
-            # Interpolate lon/lat onto the dense grid.
-            dense_lons = np.interp(dense_atm, along_track_m, lons)
-            dense_lats = np.interp(dense_atm, along_track_m, lats)
-
-            # Reproject to DEM CRS and sample.
-            if dem_rc_crs is not None:
-                xformer = pyproj.Transformer.from_crs(
-                    pyproj.CRS.from_epsg(4326), dem_py_crs, always_xy=True)
-                px, py = xformer.transform(dense_lons, dense_lats)
-            else:
-                px, py = dense_lons.copy(), dense_lats.copy()
-
-            samples = list(src.sample(zip(px.tolist(), py.tolist())))
+        z_dem = sampler.sample(dense_lons, dense_lats)
     except Exception as e:
         print(f"  Warning: could not sample DEM {os.path.basename(dem_path)}: {e}", flush=True)
         return None
 
-    z_dem = np.array([s[0] if len(s) else np.nan for s in samples], dtype=float)
-
-    if dem_nodata is not None:
-        z_dem[np.isclose(z_dem, dem_nodata, rtol=0, atol=1e-3)] = np.nan
+    if sampler.nodata is not None:
+        z_dem[np.isclose(z_dem, sampler.nodata, rtol=0, atol=1e-3)] = np.nan
     valid = np.isfinite(z_dem)
     if not np.any(valid):
         print(f"  DEM {os.path.basename(dem_path)}: no overlap with laser track.", flush=True)
         return None
 
     if target_vert_epsg_int is not None:
-        try:
-            import utils.dem_geom as dem_geom
-            import transform_points as tp
-            _, dem_vert = dem_geom.get_dem_reference_frame_from_file(dem_path)
-        except Exception:
-            dem_vert = None
-
-        if dem_vert is not None:
-            dem_vert_epsg = dem_vert.to_epsg()
-            if dem_vert_epsg is not None and dem_vert_epsg != target_vert_epsg_int:
-                try:
-                    _, _, z_tx = tp.transform_points(
-                        dense_lons[valid], dense_lats[valid], z_dem[valid],
-                        src_epsg=f"EPSG:4326+{dem_vert_epsg}",
-                        dst_epsg=f"EPSG:4326+{target_vert_epsg_int}",
-                        cache_dir=cache_dir,
-                    )
-                    z_out = np.full(len(z_dem), np.nan)
-                    z_out[valid] = z_tx
-                    z_dem = z_out
-                    valid = np.isfinite(z_dem)
-                except Exception as e:
-                    print(f"  Warning: DEM vertical transform failed: {e}", flush=True)
+        dem_vert_epsg = sampler.vertical_epsg()
+        if dem_vert_epsg is not None and dem_vert_epsg != target_vert_epsg_int:
+            try:
+                import transform_points as tp
+                _, _, z_tx = tp.transform_points(
+                    dense_lons[valid], dense_lats[valid], z_dem[valid],
+                    src_epsg=f"EPSG:4326+{dem_vert_epsg}",
+                    dst_epsg=f"EPSG:4326+{target_vert_epsg_int}",
+                    cache_dir=cache_dir,
+                )
+                z_out = np.full(len(z_dem), np.nan)
+                z_out[valid] = z_tx
+                z_dem = z_out
+                valid = np.isfinite(z_dem)
+            except Exception as e:
+                print(f"  Warning: DEM vertical transform failed: {e}", flush=True)
 
     sort_idx = np.argsort(dense_atm[valid])
     valid_idx = np.where(valid)[0][sort_idx]
@@ -319,13 +395,41 @@ def _positions_for_dem_sampling(df, dlim):
     return df["x"].values[mask], df["y"].values[mask], df["along_track_m"].values[mask]
 
 
+def _draw_noise_density(ax, along_track, z, zlim=None, dlim=None, bins=NOISE_DENSITY_BINS):
+    """Draw noise photons as a rasterized 2D along-track/elevation density image (log-scaled grey).
+
+    Bins span dlim/zlim where given, and the photons' own range otherwise. Returns the legend handle."""
+    style = CLASS_STYLE[0]
+    handle = mpatches.Patch(color=style["color"], alpha=style["alpha"],
+                            label=f"{style['label']} (n={len(z):,}, binned)")
+    if len(z) == 0:
+        return handle
+
+    def _range(values, lim):
+        lo = lim[0] if (lim is not None and lim[0] is not None) else np.min(values)
+        hi = lim[1] if (lim is not None and lim[1] is not None) else np.max(values)
+        return (lo, hi) if hi > lo else (lo - 0.5, hi + 0.5)
+
+    xrange = _range(along_track, dlim)
+    zrange = _range(z, zlim)
+    counts, _, _ = np.histogram2d(along_track, z, bins=bins, range=[xrange, zrange])
+    counts = np.ma.masked_equal(counts.T, 0)
+    # Log-scaled, so single noise photons still show faintly against the dense background.
+    ax.imshow(np.ma.log10(counts), origin="lower", extent=(*xrange, *zrange), aspect="auto",
+              cmap="Greys", vmin=-0.5, interpolation="nearest", rasterized=True,
+              zorder=style["zorder"], alpha=style["alpha"])
+    return handle
+
+
 def plot_beam(df_beam, beam_name, outpath, zlim=None, dlim=None, classes=None, title_extra="",
-              dem_profiles=None, ylabel=None):
+              dem_profiles=None, ylabel=None, noise_density=False):
     """Plot one beam's photon curtain (along-track km vs elevation).
 
     classes: None  → plot all class codes present
              set() → reclassify all classified photons as noise (class 0)
              {1, 40, …} → plot those class codes; all others reclassified as noise
+    noise_density: draw noise photons (class 0) as a binned density image rather than one point each, and only
+             the classified signal photons as points. Much faster, and much smaller, for full ATL03 beams.
     """
     sort_col = "delta_time" if "delta_time" in df_beam.columns else "y"
     df_beam = df_beam.sort_values(sort_col).reset_index(drop=True)
@@ -344,7 +448,14 @@ def plot_beam(df_beam, beam_name, outpath, zlim=None, dlim=None, classes=None, t
 
     fig, ax = plt.subplots(figsize=(12, 4))
 
-    for code in np.unique(cc):
+    codes = np.unique(cc)
+    noise_handle = None
+    if noise_density:
+        noise_mask = cc == 0
+        noise_handle = _draw_noise_density(ax, along_track[noise_mask], z[noise_mask], zlim=zlim, dlim=dlim)
+        codes = codes[codes != 0]
+
+    for code in codes:
         mask = cc == code
         style = CLASS_STYLE.get(int(code), DEFAULT_STYLE)
         ax.scatter(along_track[mask], z[mask],
@@ -368,7 +479,10 @@ def plot_beam(df_beam, beam_name, outpath, zlim=None, dlim=None, classes=None, t
         ax.set_ylim(bottom=zlim[0], top=zlim[1])
     if dlim is not None:
         ax.set_xlim(left=dlim[0], right=dlim[1])
-    ax.legend(loc="upper right", fontsize=7, markerscale=2)
+    handles, labels = ax.get_legend_handles_labels()
+    if noise_handle is not None:
+        handles.insert(0, noise_handle)
+    ax.legend(handles=handles, loc="upper right", fontsize=7, markerscale=2)
     ax.grid(True, linewidth=0.3, alpha=0.5)
     fig.tight_layout()
     fig.savefig(outpath, dpi=200)
@@ -376,6 +490,92 @@ def plot_beam(df_beam, beam_name, outpath, zlim=None, dlim=None, classes=None, t
     print(f"  Saved {outpath}")
 
 
+def _plot_beam_job(beam, outpath, h5_path=None, df_nc=None, dem_paths=None, dlim=None,
+                   target_vert_epsg_int=None, cache_dir=None, plot_kwargs=None):
+    """Load, prepare and plot one beam. Runs in a worker process when beams are plotted in parallel.
+
+    h5_path only → plot the beam's ATL03 .h5 photons (all as noise).
+    df_nc only   → plot the beam's .nc photons (needs 'laser' and 'along_track_m' columns).
+    both         → plot the beam's .nc photons over its .h5 photons as a noise background.
+    """
+    plot_kwargs = dict(plot_kwargs or {}, dlim=dlim)
+
+    df_bg = None
+    if h5_path is not None:
+        df_bg = _load_h5_beam_photons(h5_path, beam)
+        if df_bg.empty:
+            print(f"  Beam {beam}: no {'h5 ' if df_nc is not None else ''}photons, skipping.")
+            return None
+
+    if df_nc is None:
+        print(f"  Beam {beam}: {len(df_bg):,} photons", flush=True)
+        df_plot = df_bg
+
+    elif df_bg is None:
+        df_beam = df_nc[df_nc["laser"] == beam].copy()
+        if df_beam.empty:
+            return None
+        if "along_track_m" not in df_beam.columns:
+            print(f"  Beam {beam}: nc has no along_track_m, skipping.", flush=True)
+            return None
+        print(f"  Beam {beam}: {len(df_beam):,} photons (nc only)", flush=True)
+        df_plot = df_beam
+
+    else:
+        # Filter nc photons to this beam using the laser column when present;
+        # fall back to exact (delta_time, x, y) matching for old nc files.
+        if "laser" in df_nc.columns:
+            df_beam = df_nc[df_nc["laser"] == beam].copy()
+        else:
+            df_beam = df_nc.merge(
+                df_bg[["delta_time", "x", "y"]],
+                on=["delta_time", "x", "y"], how="inner"
+            )
+
+        if df_beam.empty:
+            print(f"  Beam {beam}: no photons in .nc, skipping.")
+            return None
+
+        # Ensure along_track_m exists on the nc photons; get it from the h5
+        # position match if the nc file predates the field being added.
+        if "along_track_m" not in df_beam.columns:
+            df_beam = df_beam.merge(
+                df_bg[["delta_time", "x", "y", "along_track_m"]],
+                on=["delta_time", "x", "y"], how="left"
+            ).dropna(subset=["along_track_m"])
+
+        print(f"  Beam {beam}: {len(df_beam):,} classified + {len(df_bg):,} background photons", flush=True)
+        df_plot = pd.concat([df_bg, df_beam], ignore_index=True)
+
+    if target_vert_epsg_int:
+        df_plot = _apply_vdatum_to_df(df_plot, target_vert_epsg_int, cache_dir)
+    _dlons, _dlats, _datm = _positions_for_dem_sampling(df_plot, dlim)
+    dem_profiles = _collect_dem_profiles(
+        dem_paths, _dlons, _dlats, _datm, target_vert_epsg_int, cache_dir)
+    plot_beam(df_plot, beam, outpath, dem_profiles=dem_profiles or None, **plot_kwargs)
+    return outpath
+
+
+def _run_beam_jobs(jobs, numprocs=None):
+    """Run _plot_beam_job() for each job's kwargs, with up to numprocs beams plotted at once in worker processes.
+
+    numprocs defaults to one process per beam, up to the number of CPUs. Returns the list of images written."""
+    if numprocs is None:
+        numprocs = min(len(jobs), os.cpu_count() or 1)
+
+    if numprocs <= 1 or len(jobs) <= 1:
+        outpaths = [_plot_beam_job(**job) for job in jobs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=numprocs) as executor:
+            outpaths = list(executor.map(_plot_beam_job_from_kwargs, jobs))
+
+    return [p for p in outpaths if p is not None]
+
+
+def _plot_beam_job_from_kwargs(job):
+    return _plot_beam_job(**job)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Plot classified ICESat-2 photon curtains.")
     parser.add_argument("input_file",
@@ -415,6 +615,13 @@ def main():
                              "'egm2008', 'EPSG:5703'). Transforms ICESat-2 photons from "
                              "EGM2008 and DEM elevations to the given datum so both are "
                              "on the same vertical reference. Default: EGM2008 (no transform).")
+    parser.add_argument("--noise-density", action="store_true", default=False,
+                        help="Bin the noise photons into a 2D along-track/elevation density image, and draw only "
+                             "the classified photons as points. Much faster (and smaller) when plotting the full "
+                             "ATL03 noise background of a beam.")
+    parser.add_argument("--numprocs", "-np", type=int, default=None,
+                        help="Number of beams to plot at once, in parallel worker processes. Default: one per "
+                             "beam, up to the number of CPUs.")
     args = parser.parse_args()
 
     # Resolve vertical datum --------------------------------------------------
@@ -461,6 +668,11 @@ def main():
     else:
         classes = {int(c) for c in args.classes.split("/")}
 
+    # Options shared by every beam's plotting job.
+    job_kwargs = dict(dem_paths=args.dem, dlim=dlim, target_vert_epsg_int=target_vert_epsg_int,
+                      cache_dir=cache_dir,
+                      plot_kwargs=dict(zlim=zlim, classes=classes, ylabel=ylabel, noise_density=args.noise_density))
+
     # ------------------------------------------------------------------ h5-only
     h5_only = args.h5_only or input_path.lower().endswith(".h5")
 
@@ -489,23 +701,14 @@ def main():
         beam_dts = _beam_delta_times(h5_path)
         beams_to_plot = [args.laser] if args.laser else list(beam_dts.keys())
 
+        jobs = []
         for beam in beams_to_plot:
             if beam not in beam_dts:
                 print(f"  Beam {beam} not in .h5, skipping.")
                 continue
-            df_plot = _load_h5_beam_photons(h5_path, beam)
-            if df_plot.empty:
-                print(f"  Beam {beam}: no photons, skipping.")
-                continue
-            print(f"  Beam {beam}: {len(df_plot):,} photons", flush=True)
-            if target_vert_epsg_int:
-                df_plot = _apply_vdatum_to_df(df_plot, target_vert_epsg_int, cache_dir)
-            _dlons, _dlats, _datm = _positions_for_dem_sampling(df_plot, dlim)
-            dem_profiles = _collect_dem_profiles(
-                args.dem, _dlons, _dlats, _datm, target_vert_epsg_int, cache_dir)
-            outpath = os.path.join(outdir, f"{h5_stem}_{beam}.png")
-            plot_beam(df_plot, beam, outpath, zlim=zlim, dlim=dlim, classes=classes,
-                      dem_profiles=dem_profiles or None, ylabel=ylabel)
+            jobs.append(dict(job_kwargs, beam=beam, h5_path=h5_path,
+                             outpath=os.path.join(outdir, f"{h5_stem}_{beam}.png")))
+        _run_beam_jobs(jobs, numprocs=args.numprocs)
         return
 
     # ------------------------------------------------------------------ nc + optional h5
@@ -534,69 +737,25 @@ def main():
         beam_dts = _beam_delta_times(h5_path)
         beams_to_plot = [args.laser] if args.laser else list(beam_dts.keys())
 
+        jobs = []
         for beam in beams_to_plot:
             if beam not in beam_dts:
                 print(f"  Beam {beam} not in .h5, skipping.")
                 continue
-
-            df_bg = _load_h5_beam_photons(h5_path, beam)
-            if df_bg.empty:
-                print(f"  Beam {beam}: no h5 photons, skipping.")
-                continue
-
-            # Filter nc photons to this beam using the laser column when present;
-            # fall back to exact (delta_time, x, y) matching for old nc files.
-            if "laser" in df.columns:
-                df_beam = df[df["laser"] == beam].copy()
-            else:
-                df_beam = df.merge(
-                    df_bg[["delta_time", "x", "y"]],
-                    on=["delta_time", "x", "y"], how="inner"
-                )
-
-            if df_beam.empty:
-                print(f"  Beam {beam}: no photons in .nc, skipping.")
-                continue
-
-            # Ensure along_track_m exists on the nc photons; get it from the h5
-            # position match if the nc file predates the field being added.
-            if "along_track_m" not in df_beam.columns:
-                df_beam = df_beam.merge(
-                    df_bg[["delta_time", "x", "y", "along_track_m"]],
-                    on=["delta_time", "x", "y"], how="left"
-                ).dropna(subset=["along_track_m"])
-
-            print(f"  Beam {beam}: {len(df_beam):,} classified + {len(df_bg):,} background photons", flush=True)
-            df_plot = pd.concat([df_bg, df_beam], ignore_index=True)
-            if target_vert_epsg_int:
-                df_plot = _apply_vdatum_to_df(df_plot, target_vert_epsg_int, cache_dir)
-            _dlons, _dlats, _datm = _positions_for_dem_sampling(df_plot, dlim)
-            dem_profiles = _collect_dem_profiles(
-                args.dem, _dlons, _dlats, _datm, target_vert_epsg_int, cache_dir)
-            outpath = os.path.join(outdir, f"{nc_stem}_{beam}.png")
-            plot_beam(df_plot, beam, outpath, zlim=zlim, dlim=dlim, classes=classes,
-                      dem_profiles=dem_profiles or None, ylabel=ylabel)
+            # Only hand each worker its own beam's nc photons, when the nc file says which beam they're from.
+            df_nc = df[df["laser"] == beam] if "laser" in df.columns else df
+            jobs.append(dict(job_kwargs, beam=beam, h5_path=h5_path, df_nc=df_nc,
+                             outpath=os.path.join(outdir, f"{nc_stem}_{beam}.png")))
+        _run_beam_jobs(jobs, numprocs=args.numprocs)
     else:
         # No .h5 — use laser/along_track_m from the nc file directly if present.
         if "laser" in df.columns:
             beams_in_nc = sorted(df["laser"].unique())
             beams_to_plot_noh5 = [args.laser] if args.laser else beams_in_nc
-            for beam in beams_to_plot_noh5:
-                df_beam = df[df["laser"] == beam].copy()
-                if df_beam.empty:
-                    continue
-                if "along_track_m" not in df_beam.columns:
-                    print(f"  Beam {beam}: nc has no along_track_m, skipping.", flush=True)
-                    continue
-                print(f"  Beam {beam}: {len(df_beam):,} photons (nc only)", flush=True)
-                if target_vert_epsg_int:
-                    df_beam = _apply_vdatum_to_df(df_beam, target_vert_epsg_int, cache_dir)
-                _dlons, _dlats, _datm = _positions_for_dem_sampling(df_beam, dlim)
-                dem_profiles = _collect_dem_profiles(
-                    args.dem, _dlons, _dlats, _datm, target_vert_epsg_int, cache_dir)
-                outpath = os.path.join(outdir, f"{nc_stem}_{beam}.png")
-                plot_beam(df_beam, beam, outpath, zlim=zlim, dlim=dlim, classes=classes,
-                          dem_profiles=dem_profiles or None, ylabel=ylabel)
+            jobs = [dict(job_kwargs, beam=beam, df_nc=df[df["laser"] == beam],
+                         outpath=os.path.join(outdir, f"{nc_stem}_{beam}.png"))
+                    for beam in beams_to_plot_noh5]
+            _run_beam_jobs(jobs, numprocs=args.numprocs)
         else:
             print("No .h5 found and nc has no beam/distance info — cannot plot.", flush=True)
 
@@ -12,6 +12,7 @@ from osgeo import gdal
 import import_parent_dir; import_parent_dir.import_src_dir_via_pythonpath()
 ####################################3
 import utils.configfile
+import utils.dataframe_io as dataframe_io
 my_config = utils.configfile.Config()
 import icesat2.plot_validation_results
 
@@ -40,7 +41,7 @@ def add_lat_lons(df):
 
 def get_slopes(df, files_dirname):
     fnames = [os.path.join(files_dirname, fn) for fn in df.filename.unique()]
-    slope_fnames = [fn.replace("_results.h5", "_slope.tif") for fn in fnames]
+    slope_fnames = [re.sub(dataframe_io.RESULTS_SUFFIX_REGEX, "_slope.tif", fn) for fn in fnames]
     fnames_dict = dict([(os.path.basename(fn), sfn) for fn, sfn in zip(fnames, slope_fnames)])
 
     fn_array_dict = {}
@@ -72,9 +73,10 @@ def plot_errors_against_slope_centrality(results_h5_or_list,
                         dpi=600,
                         exclude_ice_sheets = False,
                         verbose=True):
-    total_results_h5 = os.path.join(os.path.dirname(output_figure_name), "total_results.h5")
+    total_results_h5 = dataframe_io.existing_results_file(
+        os.path.join(os.path.dirname(output_figure_name), "total_results" + dataframe_io.results_file_ext()))
     if os.path.exists(total_results_h5):
-        data = pandas.read_hdf(total_results_h5)
+        data = dataframe_io.read_dataframe_file(total_results_h5)
         if verbose:
             print(os.path.basename(total_results_h5), "read.")
     else:
@@ -97,7 +99,7 @@ def plot_errors_against_slope_centrality(results_h5_or_list,
                           ((lat >= 68) & (lon > -75) & (lon < -12)))]
 
 
-        data.to_hdf(total_results_h5, "results_all")
+        dataframe_io.write_dataframe_file(data, total_results_h5, key="results_all")
 
         if verbose:
             print(os.path.basename(total_results_h5), "written.")
@@ -231,7 +233,7 @@ def plot_errors_against_slope_centrality(results_h5_or_list,
 
 if __name__ == "__main__":
     dirname = "/home/mmacferrin/Research/DATA/ETOPO/data/validation_results/15s/2022.09.29"
-    h5_list = sorted([os.path.join(dirname, fn) for fn in os.listdir(dirname) if re.search("_results.h5", fn) is not None])
+    h5_list = sorted([os.path.join(dirname, fn) for fn in os.listdir(dirname) if re.search(dataframe_io.RESULTS_SUFFIX_REGEX, fn) is not None])
     outdir = os.path.join(dirname, "plots")
 
     # print("reading", h5_list[0])
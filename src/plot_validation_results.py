@@ -7,6 +7,7 @@ import matplotlib
 import pandas
 import os
 import collections
+import concurrent.futures
 import six
 import math
 import typing
@@ -17,6 +18,8 @@ import typing
 ####################################3
 import utils.configfile
 import utils.progress_bar
+import utils.dataframe_io as dataframe_io
+import summary_sketch
 
 ivert_config = utils.configfile.Config()
 
@@ -29,40 +32,58 @@ def get_data_from_h5_or_list(h5_name_or_list: typing.Union[str, typing.List[str]
                              orig_filenames: typing.Union[None, str, typing.List[str]] = None,
                              empty_val: float = ivert_config.dem_default_ndv,
                              include_filenames: bool = False,
+                             columns: typing.Union[None, typing.List[str], typing.Tuple[str]] = None,
+                             numthreads: typing.Union[None, int] = None,
                              verbose: bool = True) -> pandas.DataFrame:
-    """Return the data either from a single hdf5 results file, or a list of them. Filter out empty (bad data) values."""
+    """Return the data either from a single results file, or a list of them. Filter out empty (bad data) values.
+
+    Results files may be in any format read by utils.dataframe_io.read_dataframe_file() (parquet, feather, or hdf5).
+    A list of files is read in parallel with a pool of 'numthreads' threads (default: the ThreadPoolExecutor default).
+    If 'columns' is given, only those columns are read. If include_filenames, a categorical 'filename' column gives
+    the (base) name of the file each row came from.
+    """
     if type(h5_name_or_list) is str:
-        data = pandas.read_hdf(h5_name_or_list)
+        data = dataframe_io.read_dataframe_file(h5_name_or_list, columns=columns)
         if include_filenames:
             if orig_filenames is None:
-                data["filename"] = os.path.basename(h5_name_or_list)
+                fname = os.path.basename(h5_name_or_list)
             else:
                 assert type(orig_filenames) is str
-                data["filename"] = os.path.basename(orig_filenames)
+                fname = os.path.basename(orig_filenames)
+            data["filename"] = pandas.Categorical.from_codes(numpy.zeros(len(data), dtype=numpy.int32), [fname])
 
     elif is_iterable(h5_name_or_list):
 
         if verbose:
-            print("Reading {0} h5 results files.".format(len(h5_name_or_list)))
-        data_list = []
+            print("Reading {0} results files.".format(len(h5_name_or_list)))
 
-        for i, h5_file in enumerate(h5_name_or_list):
-            if os.path.exists(h5_file):
-                temp_data = pandas.read_hdf(h5_file)
-                if include_filenames:
-                    if orig_filenames is None:
-                        temp_data["filename"] = os.path.basename(h5_file)
-                    else:
-                        assert is_iterable(orig_filenames)
-                        temp_data["filename"] = os.path.basename(orig_filenames[i])
+        if include_filenames and orig_filenames is not None:
+            assert is_iterable(orig_filenames)
 
-                data_list.append(temp_data)
+        file_idxs = [i for i, h5_file in enumerate(h5_name_or_list) if os.path.exists(h5_file)]
+        data_list = [None] * len(file_idxs)
 
-            if verbose:
-                utils.progress_bar.ProgressBar(i + 1, len(h5_name_or_list),
-                                               suffix='{0}/{1}'.format(i + 1, len(h5_name_or_list)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=numthreads) as executor:
+            futures = {executor.submit(dataframe_io.read_dataframe_file, h5_name_or_list[i], columns): n
+                       for n, i in enumerate(file_idxs)}
+            for num_done, future in enumerate(concurrent.futures.as_completed(futures)):
+                data_list[futures[future]] = future.result()
+
+                if verbose:
+                    utils.progress_bar.ProgressBar(num_done + 1, len(file_idxs),
+                                                   suffix='{0}/{1}'.format(num_done + 1, len(file_idxs)))
 
         data = pandas.concat(data_list)
+
+        if include_filenames:
+            if orig_filenames is None:
+                fnames = [os.path.basename(h5_name_or_list[i]) for i in file_idxs]
+            else:
+                fnames = [os.path.basename(orig_filenames[i]) for i in file_idxs]
+            # One category per unique file name, with each row coded by the file it came from.
+            categories, codes = numpy.unique(fnames, return_inverse=True)
+            data["filename"] = pandas.Categorical.from_codes(
+                numpy.repeat(codes.astype(numpy.int32), [len(df) for df in data_list]), categories)
     else:
         raise TypeError("Non-iterable value for parameter 'results_h5_name_or_list':", h5_name_or_list)
     # print(data)
@@ -100,40 +121,293 @@ def plot_histograms_and_line(results_h5_or_list_or_df,
     2) Histogram of mean errors bathy (blue)
     3) 1:1 line of DEM vs ICESat-2 elevationss
 
+    The cells are binned with numpy first (the histograms with the same bins ax.hist() would use, the 1:1 panel as a
+    rasterized 2D density image), so drawing the figure takes the same time however many cells there are.
+
     If 'place_name' is provided, use it in the title of the plot.
     """
-    # If we're writing a PNG file, use the "Agg" backend (no display).
-    # This helps avoid errors.
-    if os.path.splitext(output_figure_name)[1].lower() == ".png":
-        matplotlib.use("Agg")
-
     if type(results_h5_or_list_or_df) == pandas.DataFrame:
         data = results_h5_or_list_or_df
     else:
         data = get_data_from_h5_or_list(results_h5_or_list_or_df,
                                         empty_val = empty_val)
 
-    meandiff        = data['diff_mean']
+    meandiff        = data['diff_mean'].to_numpy()
     # numphotons      = data['numphotons']
     # numphotons_intd = data['numphotons_intd']
-    numphotons_bathy = data['numphotons_bathy']
-    dem_elev        = data["dem_elev"]
-    mean_elev       = data["mean"]
+    numphotons_bathy = data['numphotons_bathy'].to_numpy()
+    dem_elev        = data["dem_elev"].to_numpy()
+    mean_elev       = data["mean"].to_numpy()
 
     if len(meandiff) < 3:
         if verbose:
             print("Not enough cells to plot statistics. Aborting.")
         return
 
-    # Determine which histogram panels have data before creating the figure.
     land_only_mask = (numphotons_bathy == 0)
-    meandiff_land = meandiff[land_only_mask]
     bathy_mask = (numphotons_bathy > 0)
-    meandiff_bathy = meandiff[bathy_mask]
-    has_land = len(meandiff_land) > 0
-    has_bathy = len(meandiff_bathy) > 0
 
-    # ncols = number of histogram panels present + 1 scatter panel.
+    error_bins = {"land": _error_bins_from_values(meandiff[land_only_mask], 200),
+                  "bathy": _error_bins_from_values(meandiff[bathy_mask], 100)}
+    elev_density = _elevation_density_from_values({"land": (mean_elev[land_only_mask], dem_elev[land_only_mask]),
+                                                   "bathy": (mean_elev[~land_only_mask], dem_elev[~land_only_mask])})
+    rmse = (numpy.nansum(meandiff ** 2) / len(meandiff)) ** 0.5
+
+    _plot_binned_histograms_and_line(error_bins, elev_density, rmse, len(meandiff), output_figure_name,
+                                     place_name=place_name,
+                                     figsize=figsize,
+                                     labels_uppercase=labels_uppercase,
+                                     dpi=dpi,
+                                     hist_cutoff_num_stddevs=hist_cutoff_num_stddevs,
+                                     also_add_rmse_to_hist=also_add_rmse_to_hist,
+                                     verbose=verbose)
+
+    return
+
+
+def plot_histograms_and_line_from_sketch(sketch,
+                                         output_figure_name,
+                                         place_name=None,
+                                         figsize = (10.0, 4.0), # Width/height, in inches
+                                         labels_uppercase = True,
+                                         dpi = 600,
+                                         hist_cutoff_num_stddevs = 2.5,
+                                         also_add_rmse_to_hist = False,
+                                         verbose=True):
+    """Generate the same figure as plot_histograms_and_line(), from a summary_sketch.SummarySketch of the results.
+
+    The histograms are drawn from the sketch's error bins, and the DEM vs. ICESat-2 panel as a density image of its
+    elevation bins. The figure takes the same time and memory whatever the number of cells summarized.
+    """
+    if sketch.count() < 3:
+        if verbose:
+            print("Not enough cells to plot statistics. Aborting.")
+        return
+
+    error_bins = {"land": _error_bins_from_sketch(sketch, "land", 200),
+                  "bathy": _error_bins_from_sketch(sketch, "bathy", 100)}
+    elev_density = _elevation_density_from_sketch(sketch)
+
+    _plot_binned_histograms_and_line(error_bins, elev_density, sketch.rmse(), sketch.n_cells, output_figure_name,
+                                     place_name=place_name,
+                                     figsize=figsize,
+                                     labels_uppercase=labels_uppercase,
+                                     dpi=dpi,
+                                     hist_cutoff_num_stddevs=hist_cutoff_num_stddevs,
+                                     also_add_rmse_to_hist=also_add_rmse_to_hist,
+                                     verbose=verbose)
+
+    return
+
+
+def _error_bins_from_values(meandiff, nbins):
+    """Bin the errors of one histogram panel, and compute the stats shown on it.
+
+    The bins are the ones ax.hist(meandiff, bins=nbins) would use, nbins equal bins spanning the data range. Like
+    ax.hist() and the pandas reductions used before, NaN errors are left out of the bins and stats, but still counted in
+    the percentages."""
+    count = len(meandiff)
+    if count == 0:
+        return {"count": 0}
+
+    counts, edges = numpy.histogram(meandiff[numpy.isfinite(meandiff)], bins=nbins)
+
+    # Crop the left & right (only if greater than 20 points)
+    if count >= 20:
+        cutoffs = list(numpy.percentile(meandiff, [1, 99]))
+    else:
+        cutoffs = [numpy.min(meandiff), numpy.max(meandiff)]
+
+    return {"count": count,
+            "counts": counts,
+            "edges": edges,
+            "center": numpy.nanmean(meandiff),
+            "std": numpy.nanstd(meandiff),
+            "rmse": numpy.sqrt(numpy.nanmean(meandiff ** 2)),
+            "cutoffs": cutoffs}
+
+
+def _error_bins_from_sketch(sketch, group, nbins):
+    """Bin the errors of one histogram panel from a summary sketch's errors in 'group' ("land" or "bathy").
+
+    The sketch's fine error bins are weighted into 'nbins' bins spanning the data range, as ax.hist() would bin the
+    raw errors."""
+    count = sketch.count(group)
+    if count == 0:
+        return {"count": 0}
+
+    err_hist = sketch.error_histogram(group)
+    vmin, vmax = sketch.min(group), sketch.max(group)
+    counts, edges = numpy.histogram(err_hist.bin_centers()[0], bins=nbins,
+                                    range=(vmin, vmax) if vmax > vmin else None,
+                                    weights=err_hist.counts)
+
+    # Crop the left & right (only if greater than 20 points)
+    if count >= 20:
+        cutoffs = list(sketch.percentile([1, 99], group))
+    else:
+        cutoffs = [vmin, vmax]
+
+    return {"count": count,
+            "counts": counts,
+            "edges": edges,
+            "center": sketch.mean(group),
+            "std": sketch.std(group),
+            "rmse": sketch.rmse(group),
+            "cutoffs": cutoffs}
+
+
+def _elevation_density_from_values(elevs_by_group, max_pixels=500):
+    """Bin the (ICESat-2, DEM) elevation pairs of each group onto a common grid of max_pixels x max_pixels cells.
+
+    'elevs_by_group' is {group: (icesat2_elevs, dem_elevs)}. Returns (densities_by_group, plot_limits)."""
+    elevs_by_group = {g: (numpy.asarray(x), numpy.asarray(y)) for g, (x, y) in elevs_by_group.items() if len(x) > 0}
+    if len(elevs_by_group) == 0:
+        return {}, None
+
+    all_elevs = numpy.concatenate([numpy.concatenate(xy) for xy in elevs_by_group.values()])
+    all_elevs = all_elevs[numpy.isfinite(all_elevs)]
+    if len(all_elevs) == 0:
+        return {}, None
+    lo, hi = _padded_plot_limits(all_elevs.min(), all_elevs.max())
+
+    densities = {}
+    for g, (x, y) in elevs_by_group.items():
+        densities[g], _, _ = numpy.histogram2d(x, y, bins=max_pixels, range=[[lo, hi], [lo, hi]])
+
+    return densities, (lo, hi)
+
+
+def _elevation_density_from_sketch(sketch, max_pixels=500):
+    """Bin a summary sketch's 2D elevation bins of each group onto a common grid of at most max_pixels x max_pixels.
+
+    Returns (densities_by_group, plot_limits)."""
+    hists = {g: sketch.elevation_histogram(g) for g in summary_sketch.GROUPS}
+    hists = {g: h for g, h in hists.items() if h.total > 0}
+    if len(hists) == 0:
+        return {}, None
+
+    all_centers = numpy.concatenate([h.bin_centers() for h in hists.values()], axis=1)
+    half_bin = summary_sketch.ELEV_BIN_WIDTH / 2
+    lo, hi = _padded_plot_limits(all_centers.min() - half_bin, all_centers.max() + half_bin)
+    npixels = int(min(max_pixels, max(1, numpy.ceil((hi - lo) / summary_sketch.ELEV_BIN_WIDTH))))
+
+    densities = {}
+    for g, h in hists.items():
+        centers = h.bin_centers()
+        densities[g], _, _ = numpy.histogram2d(centers[0], centers[1], bins=npixels, range=[[lo, hi], [lo, hi]],
+                                               weights=h.counts)
+
+    return densities, (lo, hi)
+
+
+def _padded_plot_limits(vmin, vmax, margin=0.05):
+    """Pad a data range by 'margin' of its width on each side, as matplotlib's default autoscaling does."""
+    if vmax <= vmin:
+        return vmin - 1, vmax + 1
+    pad = (vmax - vmin) * margin
+    return vmin - pad, vmax + pad
+
+
+def _plot_binned_error_histogram(ax, bins, color, title, hist_cutoff_num_stddevs, also_add_rmse_to_hist,
+                                 panel_letter, plot_label_kwargs):
+    """Draw one error-histogram panel from its pre-computed bins and stats (see _error_bins_from_values())."""
+    edges = bins["edges"]
+    ax.hist(edges[:-1], bins=edges, weights=bins["counts"], color=color)
+    ax.set_title(title)
+    ax.set_ylabel("% of data cells")
+    ax.set_xlabel("Elevation difference (m)")
+    ax.yaxis.set_major_formatter(ticker.PercentFormatter(max(bins["count"], 1), decimals=0))
+
+    # Add the lines for mean +- std
+    center = bins["center"]
+    std = bins["std"]
+    ax.axvline(x=center, color="black", linewidth=0.75)
+    ax.axvline(x=center+std, color="black", linestyle="--", linewidth=0.5)
+    ax.axvline(x=center-std, color="black", linestyle="--", linewidth=0.5)
+
+    cutoffs = list(bins["cutoffs"])
+
+    # If we have a zero-width range, arbitrarily buffer it by 1 m in each direction.
+    if cutoffs[0] == cutoffs[1]:
+        cutoffs[0] = cutoffs[0] - 1
+        cutoffs[1] = cutoffs[1] + 1
+
+    # Do not crop the photo to make the stddev lines fall outside the plot.
+    # If they do, reset the min/max cutoff to be 2 stddev away from the mean on that side.
+    if (center + std) >= cutoffs[1] or hist_cutoff_num_stddevs is not None:
+        cutoffs[1] = center + (std * hist_cutoff_num_stddevs)
+    if (center - std) <= cutoffs[0] or hist_cutoff_num_stddevs is not None:
+        cutoffs[0] = center - (std * hist_cutoff_num_stddevs)
+
+    # Just error checking, if any of the cutoffs come back with NaN or Inf, just clip it to -1, 1, debug later.
+    if numpy.any(numpy.isnan(cutoffs) | numpy.isinf(cutoffs)):
+        cutoffs = [-1, 1]
+
+    ax.set_xlim(cutoffs)
+
+    # Pad the top by 10%
+    ylim = ax.get_ylim()
+    ax.set_ylim((ylim[0], ylim[1] * 1.1))
+
+    txt = ax.text(0.11, 0.95,
+                  r"{0:.2f} $\pm$ {1:.2f} m".format(center, std),
+                  ha="left", va="top", fontsize="small",
+                  transform=ax.transAxes)
+    txt.set_bbox(dict(facecolor="white", alpha=0.85, edgecolor="white", boxstyle="square,pad=0"))
+
+    # If requested, add the RMSE value to the figure.
+    if also_add_rmse_to_hist:
+        txt_std = ax.text(0.97, 0.95,
+                          "RMSE: {0:0.2f} m".format(bins["rmse"]),
+                          ha="right", va="top", fontsize="small",
+                          transform=ax.transAxes)
+        txt_std.set_bbox(dict(facecolor="white", alpha=0.95, edgecolor="white", boxstyle="square,pad=0"))
+
+    ax.text(*plot_label_kwargs["margin"], panel_letter,
+            ha=plot_label_kwargs["ha"], va=plot_label_kwargs["va"], fontsize=plot_label_kwargs["size"],
+            fontweight=plot_label_kwargs["weight"], transform=ax.transAxes)
+
+
+def _plot_binned_elevation_density(ax, densities, plotlim):
+    """Draw the DEM vs. ICESat-2 elevation panel as rasterized density images (land in red, bathy in blue)."""
+    lo, hi = plotlim
+    for g, cmap_name in (("land", "Reds"), ("bathy", "Blues")):
+        if g not in densities:
+            continue
+        density = numpy.ma.masked_equal(densities[g].T, 0)
+        # Log-scaled color, so sparse cells still show up against dense ones.
+        ax.imshow(numpy.ma.log10(density) + 1, origin="lower", extent=(lo, hi, lo, hi), cmap=cmap_name,
+                  vmin=0, interpolation="nearest", aspect="auto", rasterized=True,
+                  alpha=0.85 if g == "land" else 0.7)
+
+
+def _plot_binned_histograms_and_line(error_bins,
+                                     elev_density,
+                                     rmse,
+                                     n_cells,
+                                     output_figure_name,
+                                     place_name=None,
+                                     figsize = (10.0, 4.0), # Width/height, in inches
+                                     labels_uppercase = True,
+                                     dpi = 600,
+                                     hist_cutoff_num_stddevs = 2.5,
+                                     also_add_rmse_to_hist = False,
+                                     verbose=True):
+    """Draw the histograms-and-1:1-line figure from pre-binned errors and elevations.
+
+    'error_bins' is {"land": bins, "bathy": bins} (see _error_bins_from_values()), and 'elev_density' is
+    (densities_by_group, plot_limits) (see _elevation_density_from_values()). Used by both plot_histograms_and_line()
+    and plot_histograms_and_line_from_sketch()."""
+    # If we're writing a PNG file, use the "Agg" backend (no display).
+    # This helps avoid errors.
+    if os.path.splitext(output_figure_name)[1].lower() == ".png":
+        matplotlib.use("Agg")
+
+    has_land = error_bins["land"]["count"] > 0
+    has_bathy = error_bins["bathy"]["count"] > 0
+
+    # ncols = number of histogram panels present + 1 density panel.
     ncols = int(has_land) + int(has_bathy) + 1
 
     # Generate figure. Scale width proportionally to panel count.
@@ -144,199 +418,51 @@ def plot_histograms_and_line(results_h5_or_list_or_df,
     if ncols == 1:
         axes = [axes]
 
-    plot_label_margin = [0.015, 0.97]
-    plot_label_ha = "left"
-    plot_label_va = "top"
-    plot_label_size = "large"
-    plot_label_weight = "book"
-
+    plot_label_kwargs = {"margin": [0.015, 0.97], "ha": "left", "va": "top", "size": "large", "weight": "book"}
     panel_letters = ("ABCDE" if labels_uppercase else "abcde")
     panel_idx = 0
 
-    #############################################################################
-    # Plot: Histogram of differences from ICESat-2 mean (land only), if present.
+    # Histograms of differences from ICESat-2 mean (land only, then bathy only), if present.
+    # Unicode "minus" sign is \u2212
     if has_land:
-        nbins = 200
-        ax1 = axes[panel_idx]
-        panel_letter = panel_letters[panel_idx]
+        _plot_binned_error_histogram(axes[panel_idx], error_bins["land"], "darkred",
+                                     "DEM " + u"\u2212" + " ICESat-2 elevation: land",
+                                     hist_cutoff_num_stddevs, also_add_rmse_to_hist,
+                                     panel_letters[panel_idx], plot_label_kwargs)
         panel_idx += 1
 
-        ax1.hist(meandiff_land, bins=nbins, color="darkred")
-        # Unicode "minus" sign is \u2212
-        ax1.set_title("DEM " + u"\u2212" + " ICESat-2 elevation: land")
-        ax1.set_ylabel("% of data cells")
-        ax1.set_xlabel("Elevation difference (m)")
-        ax1.yaxis.set_major_formatter(ticker.PercentFormatter(max(len(meandiff_land), 1), decimals=0))
-
-        # Add the lines for mean +- std
-        center = numpy.mean(meandiff_land)
-        std = numpy.std(meandiff_land)
-        ax1.axvline(x=center, color="black", linewidth=0.75)
-        ax1.axvline(x=center+std, color="black", linestyle="--", linewidth=0.5)
-        ax1.axvline(x=center-std, color="black", linestyle="--", linewidth=0.5)
-
-        # Crop the left & right (only if greater than 20 points)
-        if len(meandiff_land) >= 20:
-            cutoffs = numpy.percentile(meandiff_land, [1, 99])
-        else:
-            cutoffs = [min(meandiff_land), max(meandiff_land)]
-
-        # If we have a zero-width range, arbitrarily buffer it by 1 m in each direction.
-        if cutoffs[0] == cutoffs[1]:
-            cutoffs[0] = cutoffs[0] - 1
-            cutoffs[1] = cutoffs[1] + 1
-
-        # Do not crop the photo to make the stddev lines fall outside the plot.
-        # If they do, reset the min/max cutoff to be 2 stddev away from the mean on that side.
-        if (center + std) >= cutoffs[1] or hist_cutoff_num_stddevs is not None:
-            cutoffs[1] = center + (std * hist_cutoff_num_stddevs)
-        if (center - std) <= cutoffs[0] or hist_cutoff_num_stddevs is not None:
-            cutoffs[0] = center - (std * hist_cutoff_num_stddevs)
-
-        # Just error checking, if any of the cutoffs come back with NaN or Inf, just clip it to -1, 1, debug later.
-        if numpy.any(numpy.isnan(cutoffs) | numpy.isinf(cutoffs)):
-            cutoffs = [-1, 1]
-
-        ax1.set_xlim(cutoffs)
-
-        # Pad the top by 10%
-        ylim = ax1.get_ylim()
-        ax1.set_ylim((ylim[0], ylim[1] * 1.1))
-
-        txt = ax1.text(0.11, 0.95,
-                       r"{0:.2f} $\pm$ {1:.2f} m".format(center, std),
-                       ha="left", va="top", fontsize="small",
-                       transform=ax1.transAxes)
-        txt.set_bbox(dict(facecolor="white", alpha=0.85, edgecolor="white", boxstyle="square,pad=0"))
-
-        # If requested, add the RMSE value to the figure.
-        if also_add_rmse_to_hist:
-            rmse = numpy.sqrt(numpy.mean(meandiff_land ** 2))
-            txt_std = ax1.text(0.97, 0.95,
-                               "RMSE: {0:0.2f} m".format(rmse),
-                               ha="right", va="top", fontsize="small",
-                               transform=ax1.transAxes)
-            txt_std.set_bbox(dict(facecolor="white", alpha=0.95, edgecolor="white", boxstyle="square,pad=0"))
-
-        ax1.text(*plot_label_margin,
-                 panel_letter,
-                 ha=plot_label_ha, va=plot_label_va, fontsize=plot_label_size,
-                 fontweight=plot_label_weight, transform=ax1.transAxes)
-
-    #############################################################################
-    # Plot: Histogram of differences from ICESat-2 mean (bathy only), if present.
     if has_bathy:
-        nbins = 100  # fewer bins than land histogram
-        ax2 = axes[panel_idx]
-        panel_letter = panel_letters[panel_idx]
+        _plot_binned_error_histogram(axes[panel_idx], error_bins["bathy"], "blue",
+                                     "DEM " + u"\u2212" + " ICESat-2 elevation: bathy",
+                                     hist_cutoff_num_stddevs, also_add_rmse_to_hist,
+                                     panel_letters[panel_idx], plot_label_kwargs)
         panel_idx += 1
 
-        ax2.hist(meandiff_bathy, bins=nbins, color="blue")
-        # Unicode "minus" sign is \u2212
-        ax2.set_title("DEM " + u"\u2212" + " ICESat-2 elevation: bathy")
-        ax2.set_ylabel("% of data cells")
-        ax2.set_xlabel("Elevation difference (m)")
-        ax2.yaxis.set_major_formatter(ticker.PercentFormatter(max(len(meandiff_bathy), 1), decimals=0))
-
-        # Add the lines for mean +- std
-        center = numpy.mean(meandiff_bathy)
-        std = numpy.std(meandiff_bathy)
-        ax2.axvline(x=center, color="black", linewidth=0.75)
-        ax2.axvline(x=center+std, color="black", linestyle="--", linewidth=0.5)
-        ax2.axvline(x=center-std, color="black", linestyle="--", linewidth=0.5)
-
-        # Crop the left & right (only if greater than 20 points)
-        if len(meandiff_bathy) >= 20:
-            cutoffs = numpy.percentile(meandiff_bathy, [1, 99])
-        else:
-            cutoffs = [min(meandiff_bathy), max(meandiff_bathy)]
-
-        # If we have a zero-width range, arbitrarily buffer it by 1 m in each direction.
-        if cutoffs[0] == cutoffs[1]:
-            cutoffs[0] = cutoffs[0] - 1
-            cutoffs[1] = cutoffs[1] + 1
-
-        # Do not crop the photo to make the stddev lines fall outside the plot.
-        # If they do, reset the min/max cutoff to be 2 stddev away from the mean on that side.
-        if (center + std) >= cutoffs[1] or hist_cutoff_num_stddevs is not None:
-            cutoffs[1] = center + (std * hist_cutoff_num_stddevs)
-        if (center - std) <= cutoffs[0] or hist_cutoff_num_stddevs is not None:
-            cutoffs[0] = center - (std * hist_cutoff_num_stddevs)
-
-        # Just error checking, if any of the cutoffs come back with NaN or Inf, just clip it to -1, 1, debug later.
-        if numpy.any(numpy.isnan(cutoffs) | numpy.isinf(cutoffs)):
-            cutoffs = [-1, 1]
-
-        ax2.set_xlim(cutoffs)
-
-        # Pad the top by 10%
-        ylim = ax2.get_ylim()
-        ax2.set_ylim((ylim[0], ylim[1] * 1.1))
-
-        txt = ax2.text(0.11, 0.95,
-                       r"{0:.2f} $\pm$ {1:.2f} m".format(center, std),
-                       ha="left", va="top", fontsize="small",
-                       transform=ax2.transAxes)
-        txt.set_bbox(dict(facecolor="white", alpha=0.85, edgecolor="white", boxstyle="square,pad=0"))
-
-        # If requested, add the RMSE value to the figure.
-        if also_add_rmse_to_hist:
-            rmse = numpy.sqrt(numpy.mean(meandiff_bathy ** 2))
-            txt_std = ax2.text(0.97, 0.95,
-                               "RMSE: {0:0.2f} m".format(rmse),
-                               ha="right", va="top", fontsize="small",
-                               transform=ax2.transAxes)
-            txt_std.set_bbox(dict(facecolor="white", alpha=0.95, edgecolor="white", boxstyle="square,pad=0"))
-
-        ax2.text(*plot_label_margin,
-                 panel_letter,
-                 ha=plot_label_ha, va=plot_label_va, fontsize=plot_label_size,
-                 fontweight=plot_label_weight, transform=ax2.transAxes)
-
-    # Plot: 1:1 line of DEM/ICESat-2 elevations (always present).
-    #############################################################################
+    # Density plot of DEM/ICESat-2 elevations, with the 1:1 line (always present).
     ax3 = axes[panel_idx]
-    panel_letter = panel_letters[panel_idx]
-
-    dotsize=3
-    # Adjust the alpha depending how many points there are (more points == lighter dots)
-    alpha = 0.35 * max(0.0025, min(4, (math.log10(100)/math.log10(len(mean_elev)))))
-    # Can't have an alpha > 1.0, so cap it there.
-    alpha = min(alpha, 1.0)
-
-    # Scatter plots of both land and elev
-    ax3.scatter(mean_elev[land_only_mask], dem_elev[land_only_mask], c="darkred", s=dotsize, linewidth=0, alpha=alpha)
-    ax3.scatter(mean_elev[~land_only_mask], dem_elev[~land_only_mask], c="blue", s=dotsize, linewidth=0, alpha=min(alpha * 2, 0.35))
     ax3.set_title("DEM vs. ICESat-2")
     ax3.set_ylabel("DEM elevation (m)")
     ax3.set_xlabel("ICESat-2 elevation (m)")
-    xlim = ax3.get_xlim()
-    ylim = ax3.get_ylim()
-
-    plotlim =( min(xlim[0], ylim[0]), max(xlim[1],ylim[1]))
-    ax3.set_xlim(plotlim)
-    ax3.set_ylim(plotlim)
-    ax3.plot(plotlim, plotlim, ls="--", c=".3", lw=0.5, alpha=0.6)
-    # Set the y-ticks the same as the x-ticks.
-    xticks = ax3.get_xticks()
-    ax3.set_yticks(xticks)
-
-    ax3.text(*plot_label_margin,
-             panel_letter,
-             ha=plot_label_ha,
-             va=plot_label_va,
-             fontsize=plot_label_size,
-             fontweight=plot_label_weight,
-             transform=ax3.transAxes)
-    # lbltxt.set_bbox(dict(facecolor="white", alpha=0.7, edgecolor="white", boxstyle="square,pad=0"))
+    densities, plotlim = elev_density
+    if plotlim is not None:
+        _plot_binned_elevation_density(ax3, densities, plotlim)
+        ax3.set_xlim(plotlim)
+        ax3.set_ylim(plotlim)
+        ax3.plot(plotlim, plotlim, ls="--", c=".3", lw=0.5, alpha=0.6)
+        # Set the y-ticks the same as the x-ticks.
+        xticks = ax3.get_xticks()
+        ax3.set_yticks(xticks)
+        ax3.set_ylim(plotlim)
+
+    ax3.text(*plot_label_kwargs["margin"], panel_letters[panel_idx],
+             ha=plot_label_kwargs["ha"], va=plot_label_kwargs["va"], fontsize=plot_label_kwargs["size"],
+             fontweight=plot_label_kwargs["weight"], transform=ax3.transAxes)
 
     # Figure title
     if place_name is None:
         place_name = "DEM"
 
-    rmse = (numpy.sum(meandiff ** 2) / len(meandiff)) ** 0.5
-
-    fig.suptitle(f"{place_name}: Errors and Distributions\nRMSE = {rmse:0.3f} m,   N = {len(meandiff):,} cells")
+    fig.suptitle(f"{place_name}: Errors and Distributions\nRMSE = {rmse:0.3f} m,   N = {n_cells:,} cells")
     fig.tight_layout()
 
     # Save the figure to disk.
@@ -353,8 +479,6 @@ def plot_histograms_and_line(results_h5_or_list_or_df,
     plt.clf()
     plt.close(fig)
 
-    return
-
 
 def plot_histogram_and_error_stats_4_panels(results_h5_or_list_or_df,
                                             output_figure_name,
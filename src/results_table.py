@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""results_table.py -- Per-cell DEM validation results held as flat column arrays.
+
+A ResultsTable stores the per-cell validation statistics as plain numpy columns, alongside flat int32 'i' (row) and
+'j' (column) DEM-cell indices and a combined int64 cell key. Filters (empty cells, outliers, mis-classified photons)
+are and-ed into a single keep-mask rather than copying the table at each step. materialize() then applies that mask
+to every column once, and to_dataframe() produces the (i, j)-MultiIndexed pandas.DataFrame used for the results files.
+
+Writers such as validate_dem.generate_result_geotiff() read the flat i/j arrays directly, without rebuilding any
+(i, j) index tuples.
+"""
+
+import numpy
+import pandas
+
+
+class ResultsTable:
+    """Per-cell validation results: flat i/j index arrays, a combined cell key, and named column arrays."""
+
+    def __init__(self, i, j, columns: dict):
+        """Create a results table.
+
+        Args:
+            i: DEM row index of each cell.
+            j: DEM column index of each cell.
+            columns: {column_name: array} of per-cell values, in output column order, all the same length as i and j.
+        """
+        self._i = numpy.asarray(i, dtype=numpy.int32)
+        self._j = numpy.asarray(j, dtype=numpy.int32)
+        assert self._i.shape == self._j.shape
+        self._columns = {name: numpy.asarray(values) for name, values in columns.items()}
+        for values in self._columns.values():
+            assert values.shape == self._i.shape
+
+        # Rows still kept after all the filters applied so far. None means every row is kept.
+        self._keep_mask = None
+
+    @classmethod
+    def from_dataframe(cls, results_dataframe: pandas.DataFrame):
+        """Build a results table from an (i, j)-MultiIndexed results dataframe."""
+        return cls(results_dataframe.index.get_level_values("i").to_numpy(),
+                   results_dataframe.index.get_level_values("j").to_numpy(),
+                   {col: results_dataframe[col].to_numpy() for col in results_dataframe.columns})
+
+    @staticmethod
+    def make_cell_key(i, j) -> numpy.ndarray:
+        """Combine (i, j) cell indices into a single int64 key. Keys sort in row-major (i, j) order."""
+        return (numpy.asarray(i, dtype=numpy.int64) << 32) | numpy.asarray(j, dtype=numpy.int64)
+
+    def _kept(self, array: numpy.ndarray) -> numpy.ndarray:
+        return array if self._keep_mask is None else array[self._keep_mask]
+
+    @property
+    def i(self) -> numpy.ndarray:
+        """int32 DEM row index of each kept cell."""
+        return self._kept(self._i)
+
+    @property
+    def j(self) -> numpy.ndarray:
+        """int32 DEM column index of each kept cell."""
+        return self._kept(self._j)
+
+    @property
+    def cell_key(self) -> numpy.ndarray:
+        """Combined int64 cell key of each kept cell. See make_cell_key()."""
+        return self.make_cell_key(self.i, self.j)
+
+    @property
+    def columns(self) -> list:
+        """Names of the value columns."""
+        return list(self._columns.keys())
+
+    def __contains__(self, col: str) -> bool:
+        return col in self._columns
+
+    def __getitem__(self, col: str) -> numpy.ndarray:
+        """The values of one column, for the kept cells."""
+        return self._kept(self._columns[col])
+
+    def __len__(self) -> int:
+        """Number of kept cells."""
+        if self._keep_mask is None:
+            return len(self._i)
+        return int(numpy.count_nonzero(self._keep_mask))
+
+    def filter(self, keep) -> "ResultsTable":
+        """Keep only the cells where 'keep' is True, and-ing it into the table's keep-mask. No data are copied.
+
+        'keep' is aligned with the currently-kept cells (i.e. with the arrays returned by table[col]).
+        Returns this table, so filters can be chained."""
+        keep = numpy.asarray(keep, dtype=bool)
+        assert len(keep) == len(self)
+        if self._keep_mask is None:
+            self._keep_mask = keep.copy()
+        else:
+            self._keep_mask[self._keep_mask] = keep
+        return self
+
+    def filter_empty(self, empty_val, min_photons_intd: int = 3) -> "ResultsTable":
+        """Drop cells with no valid mean elevation, or with fewer than min_photons_intd inter-decile photons."""
+        # The empty value may come from the config file as a string, such as "NaN".
+        empty_val = float(empty_val)
+        mean = self["mean"]
+        keep = ~numpy.isnan(mean) & (self["numphotons_intd"] >= min_photons_intd)
+        if not numpy.isnan(empty_val):
+            keep &= (mean != empty_val)
+        return self.filter(keep)
+
+    def filter_outliers(self, sd_threshold: float, col: str = "diff_mean") -> "ResultsTable":
+        """Drop cells whose 'col' value lies more than sd_threshold standard deviations from the mean."""
+        values = self[col]
+        if len(values) == 0:
+            return self
+        meanval = numpy.nanmean(values)
+        stdval = numpy.nanstd(values, ddof=1) if numpy.count_nonzero(~numpy.isnan(values)) > 1 else numpy.nan
+        low_cutoff = meanval - (stdval * sd_threshold)
+        hi_cutoff = meanval + (stdval * sd_threshold)
+        return self.filter((values >= low_cutoff) & (values <= hi_cutoff))
+
+    def materialize(self) -> "ResultsTable":
+        """Return a new table holding only the kept cells, applying the composed keep-mask to every column once."""
+        if self._keep_mask is None:
+            return self
+        return ResultsTable(self.i, self.j, {col: self[col] for col in self._columns})
+
+    def to_dataframe(self) -> pandas.DataFrame:
+        """Return the kept cells as a pandas.DataFrame, MultiIndexed by (i, j)."""
+        table = self.materialize()
+        return pandas.DataFrame(table._columns,
+                                index=pandas.MultiIndex.from_arrays((table._i, table._j), names=("i", "j")),
+                                copy=False)
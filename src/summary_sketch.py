@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+"""summary_sketch.py -- Small, mergeable summaries of per-cell DEM validation results.
+
+A SummarySketch holds everything needed to write a summary-stats file and draw the summary plot for a set of validated
+DEM cells, without holding the cells themselves:
+    - counts, sums and sums of squares of the DEM - ICESat-2 errors ('diff_mean'), separately for land-only cells and
+      cells with bathymetry photons,
+    - fixed-width (sparse) histograms of those errors, from which percentiles are computed,
+    - sums of the photon counts and cell roughness ('stddev'),
+    - a fixed-width 2D histogram of ICESat-2 vs. DEM elevations, for the 1:1 plot panel.
+
+Sketches of separate DEMs are merged by adding them, so a collection's summary is built in constant memory no matter
+how many cells it has. Percentiles from a sketch are accurate to within half an error bin (DIFF_BIN_WIDTH), and are
+exact at the 0th and 100th percentiles.
+"""
+
+import json
+import os
+
+import numpy
+import pandas
+
+# Width of the error histogram bins (m). Sets the precision of the percentiles computed from a sketch.
+DIFF_BIN_WIDTH = 0.01
+# Width of the elevation bins (m) in the 2D ICESat-2 vs. DEM elevation histogram.
+ELEV_BIN_WIDTH = 1.0
+
+# The results columns needed to build a sketch.
+SKETCH_COLUMNS = ("diff_mean", "numphotons_intd", "numphotons_bathy", "stddev", "mean", "dem_elev")
+
+# Land-only cells, and cells containing bathymetry photons.
+GROUPS = ("land", "bathy")
+
+
+class SparseHistogram:
+    """A fixed-bin-width histogram over an unbounded range, storing only the non-empty bins.
+
+    Bin k covers [k * bin_width, (k + 1) * bin_width) in each dimension. Histograms with the same bin widths are merged
+    by adding their counts."""
+
+    def __init__(self, bin_widths, ndim: int = 1):
+        self.bin_widths = numpy.broadcast_to(numpy.asarray(bin_widths, dtype=float), (ndim,)).copy()
+        self.ndim = ndim
+        # Bin indices of the non-empty bins (ndim x K, sorted), and their counts.
+        self.bins = numpy.zeros((ndim, 0), dtype=numpy.int64)
+        self.counts = numpy.zeros((0,), dtype=numpy.int64)
+
+    def _set(self, bins, counts) -> None:
+        """Set the bins from (possibly duplicated, unsorted) bin indices, summing the counts of duplicates."""
+        if bins.shape[1] == 0:
+            self.bins = numpy.zeros((self.ndim, 0), dtype=numpy.int64)
+            self.counts = numpy.zeros((0,), dtype=numpy.int64)
+            return
+        self.bins, inverse = numpy.unique(bins, axis=1, return_inverse=True)
+        self.counts = numpy.bincount(inverse.ravel(), weights=counts, minlength=self.bins.shape[1]).astype(numpy.int64)
+
+    def add(self, *values) -> "SparseHistogram":
+        """Add values to the histogram, one array per dimension. Non-finite values are ignored."""
+        values = [numpy.asarray(v, dtype=float) for v in values]
+        assert len(values) == self.ndim
+        finite = numpy.all([numpy.isfinite(v) for v in values], axis=0)
+        new_bins = numpy.array([numpy.floor(v[finite] / w) for v, w in zip(values, self.bin_widths)],
+                               dtype=numpy.int64).reshape(self.ndim, -1)
+        self._set(numpy.concatenate((self.bins, new_bins), axis=1),
+                  numpy.concatenate((self.counts, numpy.ones(new_bins.shape[1], dtype=numpy.int64))))
+        return self
+
+    def merge(self, other: "SparseHistogram") -> "SparseHistogram":
+        """Add another histogram's counts into this one."""
+        assert numpy.array_equal(self.bin_widths, other.bin_widths)
+        self._set(numpy.concatenate((self.bins, other.bins), axis=1),
+                  numpy.concatenate((self.counts, other.counts)))
+        return self
+
+    @property
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+    def bin_centers(self) -> numpy.ndarray:
+        """Centers of the non-empty bins, as an ndim x K array."""
+        return (self.bins + 0.5) * self.bin_widths[:, numpy.newaxis]
+
+    def to_dict(self) -> dict:
+        return {"bin_widths": self.bin_widths.tolist(),
+                "bins": self.bins.tolist(),
+                "counts": self.counts.tolist()}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "SparseHistogram":
+        hist = cls(d["bin_widths"], ndim=len(d["bin_widths"]))
+        hist.bins = numpy.array(d["bins"], dtype=numpy.int64).reshape(hist.ndim, -1)
+        hist.counts = numpy.array(d["counts"], dtype=numpy.int64)
+        return hist
+
+
+class SummarySketch:
+    """Mergeable summary of a set of validated DEM cells. See the module docstring."""
+
+    def __init__(self):
+        self.n_cells = 0
+        self.sum_numphotons_intd = 0
+        self.n_stddev = 0
+        self.sum_stddev = 0.0
+        # Per-group ("land", "bathy") error statistics.
+        self.n_diff = {g: 0 for g in GROUPS}
+        self.sum_diff = {g: 0.0 for g in GROUPS}
+        self.sum_diff_sq = {g: 0.0 for g in GROUPS}
+        self.min_diff = {g: numpy.inf for g in GROUPS}
+        self.max_diff = {g: -numpy.inf for g in GROUPS}
+        self.diff_hist = {g: SparseHistogram(DIFF_BIN_WIDTH) for g in GROUPS}
+        # 2D histograms of (ICESat-2 mean elevation, DEM elevation).
+        self.elev_hist = {g: SparseHistogram(ELEV_BIN_WIDTH, ndim=2) for g in GROUPS}
+
+    @classmethod
+    def from_dataframe(cls, results_df: pandas.DataFrame) -> "SummarySketch":
+        """Build a sketch from a (filtered) per-cell results dataframe."""
+        sketch = cls()
+        sketch.n_cells = len(results_df)
+        if sketch.n_cells == 0:
+            return sketch
+
+        sketch.sum_numphotons_intd = int(results_df["numphotons_intd"].sum())
+        stddev = results_df["stddev"].to_numpy(dtype=float)
+        stddev = stddev[numpy.isfinite(stddev)]
+        sketch.n_stddev = len(stddev)
+        sketch.sum_stddev = float(stddev.sum())
+
+        diff = results_df["diff_mean"].to_numpy(dtype=float)
+        is_bathy = results_df["numphotons_bathy"].to_numpy() > 0
+        has_elevs = ("mean" in results_df.columns) and ("dem_elev" in results_df.columns)
+        for g, group_mask in zip(GROUPS, (~is_bathy, is_bathy)):
+            group_diff = diff[group_mask]
+            finite_diff = group_diff[numpy.isfinite(group_diff)]
+            sketch.n_diff[g] = len(finite_diff)
+            if len(finite_diff) > 0:
+                sketch.sum_diff[g] = float(finite_diff.sum())
+                sketch.sum_diff_sq[g] = float(numpy.square(finite_diff).sum())
+                sketch.min_diff[g] = float(finite_diff.min())
+                sketch.max_diff[g] = float(finite_diff.max())
+                sketch.diff_hist[g].add(finite_diff)
+            if has_elevs:
+                sketch.elev_hist[g].add(results_df["mean"].to_numpy(dtype=float)[group_mask],
+                                        results_df["dem_elev"].to_numpy(dtype=float)[group_mask])
+
+        return sketch
+
+    def merge(self, other: "SummarySketch") -> "SummarySketch":
+        """Add another sketch into this one. Returns this sketch."""
+        self.n_cells += other.n_cells
+        self.sum_numphotons_intd += other.sum_numphotons_intd
+        self.n_stddev += other.n_stddev
+        self.sum_stddev += other.sum_stddev
+        for g in GROUPS:
+            self.n_diff[g] += other.n_diff[g]
+            self.sum_diff[g] += other.sum_diff[g]
+            self.sum_diff_sq[g] += other.sum_diff_sq[g]
+            self.min_diff[g] = min(self.min_diff[g], other.min_diff[g])
+            self.max_diff[g] = max(self.max_diff[g], other.max_diff[g])
+            self.diff_hist[g].merge(other.diff_hist[g])
+            self.elev_hist[g].merge(other.elev_hist[g])
+        return self
+
+    def __add__(self, other: "SummarySketch") -> "SummarySketch":
+        return SummarySketch().merge(self).merge(other)
+
+    ######################################################################
+    # Statistics
+    ######################################################################
+
+    def _groups(self, group: str | None) -> tuple:
+        return GROUPS if group is None else (group,)
+
+    def count(self, group: str | None = None) -> int:
+        """Number of cells with a valid error, in a group ("land" or "bathy"), or in all cells if group is None."""
+        return sum(self.n_diff[g] for g in self._groups(group))
+
+    def n_bathy_cells(self) -> int:
+        """Number of cells containing bathymetry photons."""
+        return self.n_diff["bathy"]
+
+    def mean_photons_per_cell(self) -> float:
+        return self.sum_numphotons_intd / self.n_cells if self.n_cells > 0 else numpy.nan
+
+    def mean_stddev(self) -> float:
+        """Mean roughness (stddev. of photon elevations within each cell)."""
+        return self.sum_stddev / self.n_stddev if self.n_stddev > 0 else numpy.nan
+
+    def mean(self, group: str | None = None) -> float:
+        """Mean error (DEM - ICESat-2)."""
+        n = self.count(group)
+        return sum(self.sum_diff[g] for g in self._groups(group)) / n if n > 0 else numpy.nan
+
+    def sum_of_squares(self, group: str | None = None) -> float:
+        return sum(self.sum_diff_sq[g] for g in self._groups(group))
+
+    def rmse(self, group: str | None = None) -> float:
+        n = self.count(group)
+        return numpy.sqrt(self.sum_of_squares(group) / n) if n > 0 else numpy.nan
+
+    def std(self, group: str | None = None, ddof: int = 0) -> float:
+        """Standard deviation of the errors."""
+        n = self.count(group)
+        if n - ddof <= 0:
+            return numpy.nan
+        mean = self.mean(group)
+        variance = (self.sum_of_squares(group) - n * mean * mean) / (n - ddof)
+        return numpy.sqrt(max(variance, 0.0))
+
+    def min(self, group: str | None = None) -> float:
+        return min(self.min_diff[g] for g in self._groups(group))
+
+    def max(self, group: str | None = None) -> float:
+        return max(self.max_diff[g] for g in self._groups(group))
+
+    def error_histogram(self, group: str | None = None) -> SparseHistogram:
+        """The (sparse) histogram of errors in a group, or of all cells if group is None."""
+        hist = SparseHistogram(DIFF_BIN_WIDTH)
+        for g in self._groups(group):
+            hist.merge(self.diff_hist[g])
+        return hist
+
+    def elevation_histogram(self, group: str | None = None) -> SparseHistogram:
+        """The 2D (sparse) histogram of (ICESat-2, DEM) elevations in a group, or of all cells if group is None."""
+        hist = SparseHistogram(ELEV_BIN_WIDTH, ndim=2)
+        for g in self._groups(group):
+            hist.merge(self.elev_hist[g])
+        return hist
+
+    def percentile(self, levels, group: str | None = None) -> numpy.ndarray:
+        """Percentiles of the errors, from the error histogram, using the same ranks as numpy.percentile().
+
+        Values are the centers of the bins holding each rank, clipped to the exact min and max."""
+        levels = numpy.atleast_1d(numpy.asarray(levels, dtype=float))
+        hist = self.error_histogram(group)
+        n = hist.total
+        if n == 0:
+            return numpy.full(levels.shape, numpy.nan)
+
+        centers = hist.bin_centers()[0]
+        cumulative = numpy.cumsum(hist.counts)
+        ranks = levels / 100.0 * (n - 1)
+        lo_vals = centers[numpy.searchsorted(cumulative, numpy.floor(ranks), side="right")]
+        hi_vals = centers[numpy.minimum(numpy.searchsorted(cumulative, numpy.ceil(ranks), side="right"),
+                                        len(centers) - 1)]
+        frac = ranks - numpy.floor(ranks)
+        values = lo_vals + (hi_vals - lo_vals) * frac
+        values = numpy.clip(values, self.min(group), self.max(group))
+        values[levels <= 0] = self.min(group)
+        values[levels >= 100] = self.max(group)
+        return values
+
+    ######################################################################
+    # Reading and writing
+    ######################################################################
+
+    def to_dict(self) -> dict:
+        def _float(x):
+            return None if not numpy.isfinite(x) else float(x)
+
+        return {"n_cells": self.n_cells,
+                "sum_numphotons_intd": self.sum_numphotons_intd,
+                "n_stddev": self.n_stddev,
+                "sum_stddev": self.sum_stddev,
+                "groups": {g: {"n_diff": self.n_diff[g],
+                               "sum_diff": self.sum_diff[g],
+                               "sum_diff_sq": self.sum_diff_sq[g],
+                               "min_diff": _float(self.min_diff[g]),
+                               "max_diff": _float(self.max_diff[g]),
+                               "diff_hist": self.diff_hist[g].to_dict(),
+                               "elev_hist": self.elev_hist[g].to_dict()}
+                           for g in GROUPS}}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "SummarySketch":
+        sketch = cls()
+        sketch.n_cells = d["n_cells"]
+        sketch.sum_numphotons_intd = d["sum_numphotons_intd"]
+        sketch.n_stddev = d["n_stddev"]
+        sketch.sum_stddev = d["sum_stddev"]
+        for g in GROUPS:
+            gd = d["groups"][g]
+            sketch.n_diff[g] = gd["n_diff"]
+            sketch.sum_diff[g] = gd["sum_diff"]
+            sketch.sum_diff_sq[g] = gd["sum_diff_sq"]
+            sketch.min_diff[g] = numpy.inf if gd["min_diff"] is None else gd["min_diff"]
+            sketch.max_diff[g] = -numpy.inf if gd["max_diff"] is None else gd["max_diff"]
+            sketch.diff_hist[g] = SparseHistogram.from_dict(gd["diff_hist"])
+            sketch.elev_hist[g] = SparseHistogram.from_dict(gd["elev_hist"])
+        return sketch
+
+    def write(self, fname: str) -> None:
+        """Write the sketch to a JSON file."""
+        with open(fname, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def read(cls, fname: str) -> "SummarySketch":
+        """Read a sketch from a JSON file written by write()."""
+        with open(fname, "r") as f:
+            return cls.from_dict(json.load(f))
+
+
+def sketch_filename(results_dataframe_file: str) -> str:
+    """Return the summary-sketch file name that goes with a '_results' dataframe file."""
+    base = os.path.splitext(results_dataframe_file)[0]
+    return base.replace("_results", "_summary_sketch") + ".json"
@@ -0,0 +1,171 @@
+"""Read and write IVERT results dataframes in the configured results file format.
+
+New results files are written in the format set by the 'results_file_format' config setting:
+    "parquet": Apache Parquet, zstd-compressed (the default). Keeps the (i, j) MultiIndex.
+    "feather": Arrow IPC (Feather v2), lz4-compressed. Compression and reads are multithreaded.
+    "h5": HDF5 through pandas/PyTables, zlib-compressed. (The format of older IVERT outputs.)
+Results files of any of these formats, as well as pickle, CSV and blosc2 files, can be read back with
+read_dataframe_file(), so outputs from older runs stay readable.
+"""
+
+import os
+import re
+import sys
+
+import pandas
+import pyarrow
+import pyarrow.ipc
+import pyarrow.parquet
+
+if vars(sys.modules[__name__])['__package__'] == 'ivert_utils':
+    # When this is built a setup.py package, it names the modules 'ivert' and 'ivert_utils'. This reflects that.
+    import ivert_utils.configfile as configfile
+else:
+    # If running as a script, import this way.
+    # Depends if we're importing from this directory or from the parent directory.
+    try:
+        import configfile
+    except ModuleNotFoundError:
+        import utils.configfile as configfile
+
+# File extension for each results file format.
+RESULTS_FILE_EXTENSIONS = {"parquet": ".parquet",
+                           "feather": ".feather",
+                           "h5": ".h5"}
+
+# Matches the '_results.<ext>' suffix of a results file in any of the formats above.
+RESULTS_SUFFIX_REGEX = r"_results\.(parquet|feather|h5)\Z"
+
+
+def results_file_format(fmt: str | None = None) -> str:
+    """Return the results file format to write, by default the 'results_file_format' config setting."""
+    if fmt is None:
+        fmt = configfile.Config().results_file_format
+    fmt = str(fmt).strip().lower().lstrip(".")
+    if fmt == "hdf":
+        fmt = "h5"
+    if fmt not in RESULTS_FILE_EXTENSIONS:
+        raise ValueError(f"Unknown results file format '{fmt}'. Use one of {list(RESULTS_FILE_EXTENSIONS.keys())}.")
+    return fmt
+
+
+def results_file_ext(fmt: str | None = None) -> str:
+    """Return the file extension (with the leading '.') of the results file format."""
+    return RESULTS_FILE_EXTENSIONS[results_file_format(fmt)]
+
+
+def existing_results_file(results_fname: str) -> str:
+    """Return the existing results file for results_fname, a '_results.<ext>' file name in the configured format.
+
+    If results_fname doesn't exist, but the same results were written in another format (such as a '_results.h5' file
+    from an older version of IVERT), return that file instead, so it still counts as finished output. Otherwise return
+    results_fname."""
+    if os.path.exists(results_fname):
+        return results_fname
+    for ext in RESULTS_FILE_EXTENSIONS.values():
+        other_fname = re.sub(RESULTS_SUFFIX_REGEX, "_results" + ext, results_fname)
+        if other_fname != results_fname and os.path.exists(other_fname):
+            return other_fname
+    return results_fname
+
+
+def write_dataframe_file(dataframe: pandas.DataFrame, df_filename: str, key: str = "icesat2") -> None:
+    """Write a dataframe file, in the format given by its file extension.
+
+    'key' is the HDF5 group key, only used for .h5 files."""
+    ext = os.path.splitext(df_filename)[1].lower()
+    if ext == ".parquet":
+        dataframe.to_parquet(df_filename, engine="pyarrow", compression="zstd")
+    elif ext == ".feather":
+        # Feather doesn't store an index. Keep the (i, j) index as columns, and restore it in read_dataframe_file().
+        if isinstance(dataframe.index, pandas.RangeIndex):
+            dataframe = dataframe.reset_index(drop=True)
+        else:
+            dataframe = dataframe.reset_index()
+        dataframe.to_feather(df_filename, compression="lz4")
+    elif ext in (".h5", ".hdf"):
+        # The "fixed" HDF5 format can't store categorical columns (such as a collection's 'filename').
+        hdf_format = "table" if any(isinstance(dtype, pandas.CategoricalDtype) for dtype in dataframe.dtypes) \
+            else "fixed"
+        dataframe.to_hdf(df_filename, key=key, complib="zlib", complevel=3, mode='w', format=hdf_format)
+    elif ext in (".csv", ".txt"):
+        dataframe.to_csv(df_filename)
+    else:
+        raise NotImplementedError(f"ERROR: Unknown dataframe file extension '{ext}'. (Currently supporting .parquet, .feather, .h5, .hdf, .csv, or .txt)")
+
+
+def read_dataframe_file(df_filename: str, columns: list | tuple | None = None) -> pandas.DataFrame:
+    """Read a dataframe file, either from a picklefile, HDF, CSV, feather, or parquet.
+
+    If 'columns' is given, only those columns are returned (along with the index). Parquet and feather files read only
+    those columns from disk; other formats are read in full and then subset.
+
+    (Can handle other formats by adding more "elif ..." statements in the function.)
+    """
+    assert os.path.exists(df_filename)
+    ext = os.path.splitext(df_filename)[1]
+    ext = ext.lower()
+    if columns is not None:
+        columns = list(columns)
+
+    if ext == ".parquet":
+        return pandas.read_parquet(df_filename, engine="pyarrow", columns=columns)
+    elif ext == ".feather":
+        if columns is not None:
+            # Also read the (i, j) index columns, if the file has them.
+            file_columns = pyarrow.ipc.open_file(df_filename).schema.names
+            columns = [col for col in ("i", "j") if col in file_columns and col not in columns] + columns
+        dataframe = pandas.read_feather(df_filename, columns=columns)
+        if "i" in dataframe.columns and "j" in dataframe.columns:
+            dataframe = dataframe.set_index(["i", "j"])
+        return dataframe
+
+    if ext == ".pickle":
+        dataframe = pandas.read_pickle(df_filename)
+    elif ext in (".h5", ".hdf"):
+        dataframe = pandas.read_hdf(df_filename, mode="r")
+    elif ext in (".csv", ".txt"):
+        dataframe = pandas.read_csv(df_filename)
+    elif ext == ".blosc2":
+        try:
+            import pickle_blosc
+        except ModuleNotFoundError:
+            import utils.pickle_blosc as pickle_blosc
+        dataframe = pickle_blosc.read(df_filename)
+    else:
+        raise NotImplementedError(f"ERROR: Unknown dataframe file extension '{ext}'. (Currently supporting .pickle, .h5, .hdf, .csv, .txt, .feather, .parquet, or .blosc2)")
+
+    if columns is not None:
+        dataframe = dataframe[columns]
+    return dataframe
+
+
+def concat_dataframe_files(input_fnames: list, output_fname: str, filenames: list | None = None,
+                           key: str = "icesat2") -> None:
+    """Concatenate dataframe files into one output file, optionally adding a 'filename' column naming each input.
+
+    Parquet outputs are streamed, one input file at a time, so only one input is ever held in memory. Other output
+    formats are concatenated in memory and written with write_dataframe_file()."""
+    if filenames is not None:
+        assert len(filenames) == len(input_fnames)
+
+    def _read_input(n):
+        dataframe = read_dataframe_file(input_fnames[n])
+        if filenames is not None:
+            dataframe["filename"] = pandas.Categorical.from_codes([0] * len(dataframe), [filenames[n]])
+        return dataframe
+
+    if os.path.splitext(output_fname)[1].lower() != ".parquet":
+        write_dataframe_file(pandas.concat([_read_input(n) for n in range(len(input_fnames))]), output_fname, key=key)
+        return
+
+    writer = None
+    try:
+        for n in range(len(input_fnames)):
+            table = pyarrow.Table.from_pandas(_read_input(n))
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(output_fname, table.schema, compression="zstd")
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+"""Throughput counters of long-running validation jobs, exported as an OpenMetrics (Prometheus) text file.
+
+Validation and database code count what they do with:
+
+    metrics.inc("cells_validated", num_cells)
+
+Counting is always on and costs a dictionary update. The counts are only exported if a metrics text file is set up in
+the main process, with configure() (as 'ivert validate --metrics-file FILE' or the 'metrics_textfile' setting do).
+The file is then rewritten at most every 'interval_s' seconds while counts change, in the OpenMetrics or the older
+Prometheus text format. No network is needed. The node-exporter textfile collector only reads the Prometheus format
+('metrics_format = prometheus'); in OpenMetrics, a counter's TYPE line names the family without the '_total' suffix of
+its sample, which it doesn't recognize.
+
+Each DEM is validated in a sub-process (see validate_dem.validate_dem()). Its counts are sent back to the main process
+through the sub-process's shared return values (see publishing()), both while it runs, so the main process can keep the
+file up to date, and when it's done, when they're added to the main process's counts with merge().
+"""
+
+import contextlib
+import os
+import time
+
+# Each counter's name (without the "ivert_" prefix and "_total" suffix) and description.
+COUNTERS = {"dems_completed": "DEMs validated.",
+            "dems_failed": "DEMs whose validation failed.",
+            "dems_skipped": "DEMs skipped because their results were already up to date.",
+            "cells_validated": "DEM cells validated against ICESat-2 photons.",
+            "photons_validated": "ICESat-2 photons used to validate DEM cells.",
+            "granules_read": "ICESat-2 granule files read from the photon database.",
+            "photons_read": "ICESat-2 photons read from granule files.",
+            "granule_cache_hits": "ICESat-2 granules already in the local photon database, that didn't need to be "
+                                  "processed again.",
+            "granule_cache_misses": "ICESat-2 granules processed and added to the local photon database.",
+            "worker_restarts": "Cell-validation worker processes restarted after terminating unexpectedly.",
+            }
+
+METRIC_PREFIX = "ivert_"
+FORMATS = ("openmetrics", "prometheus")
+
+# The counts of this process, by counter name.
+_counts = {}
+# Where this process sends its counts, if anywhere: a _TextfileSink or a _SharedDictSink.
+_sink = None
+_last_publish_time = 0.0
+
+
+def inc(name: str, amount: int | float = 1) -> None:
+    """Add 'amount' to a counter."""
+    _counts[name] = _counts.get(name, 0) + amount
+    publish()
+
+
+def snapshot() -> dict:
+    """Return a copy of this process's counts."""
+    return dict(_counts)
+
+
+def merge(counts: dict | None) -> None:
+    """Add counts from another process (see publishing()) to this process's counts."""
+    if not counts:
+        return
+    for name, amount in counts.items():
+        _counts[name] = _counts.get(name, 0) + amount
+    publish(force=True)
+
+
+def _add_counts(counts_a: dict, counts_b: dict | None) -> dict:
+    total = dict(counts_a)
+    for name, amount in (counts_b or {}).items():
+        total[name] = total.get(name, 0) + amount
+    return total
+
+
+def render(counts: dict,
+           start_time: float | None = None,
+           fmt: str = "openmetrics") -> str:
+    """Render counts as an OpenMetrics ('openmetrics') or Prometheus ('prometheus') text exposition.
+
+    If start_time (a time.time() timestamp) is given, also include the run's start time, and its average cells and
+    photons validated per second since then."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown metrics format '{fmt}'. Must be one of {FORMATS}.")
+
+    lines = []
+    for name, description in COUNTERS.items():
+        family = METRIC_PREFIX + name
+        # In OpenMetrics a counter family is named without the '_total' suffix its sample has. The Prometheus text
+        # format names both the same.
+        type_name = family if fmt == "openmetrics" else family + "_total"
+        lines.append(f"# HELP {type_name} {description}")
+        lines.append(f"# TYPE {type_name} counter")
+        lines.append(f"{family}_total {counts.get(name, 0)}")
+
+    if start_time is not None:
+        elapsed_s = max(time.time() - start_time, 1e-9)
+        gauges = (("start_time_seconds", "Start time of the run, in seconds since the epoch.", start_time),
+                  ("cells_per_second", "Average DEM cells validated per second since the start of the run.",
+                   counts.get("cells_validated", 0) / elapsed_s),
+                  ("photons_per_second", "Average ICESat-2 photons validated per second since the start of the run.",
+                   counts.get("photons_validated", 0) / elapsed_s))
+        for name, description, value in gauges:
+            family = METRIC_PREFIX + name
+            lines.append(f"# HELP {family} {description}")
+            lines.append(f"# TYPE {family} gauge")
+            lines.append(f"{family} {float(value)}")
+
+    if fmt == "openmetrics":
+        lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+class _TextfileSink:
+    """Rewrites a metrics text file with the counts of this process (and any of a running sub-process)."""
+
+    def __init__(self, fname: str, fmt: str, interval_s: float):
+        self.fname = fname
+        self.fmt = fmt
+        self.interval_s = interval_s
+        self.pid = os.getpid()
+        self.start_time = time.time()
+
+    def publish(self, pending: dict | None = None) -> None:
+        text = render(_add_counts(_counts, pending), start_time=self.start_time, fmt=self.fmt)
+        # Write to a temporary file and rename it, so scrapers never read a half-written file.
+        tmp_fname = self.fname + ".tmp"
+        try:
+            with open(tmp_fname, "w") as f:
+                f.write(text)
+            os.replace(tmp_fname, self.fname)
+        except OSError as e:
+            print(f"Could not write metrics to {self.fname}: {e}")
+
+
+class _SharedDictSink:
+    """Puts the counts this process made since it started publishing into a (multiprocessing-shared) dictionary."""
+
+    def __init__(self, shared_dict, key: str, interval_s: float):
+        self.shared_dict = shared_dict
+        self.key = key
+        self.interval_s = interval_s
+        self.pid = os.getpid()
+        # A forked process inherits its parent's counts, which the parent already has.
+        self.baseline = snapshot()
+
+    def publish(self, pending: dict | None = None) -> None:
+        self.shared_dict[self.key] = {name: amount - self.baseline.get(name, 0) for name, amount in _counts.items()
+                                      if amount != self.baseline.get(name, 0)}
+
+
+def _active_sink():
+    """This process's sink, or None. A forked process inherits its parent's sink, which isn't its own."""
+    if _sink is not None and _sink.pid == os.getpid():
+        return _sink
+    return None
+
+
+def publish(pending: dict | None = None, force: bool = False) -> None:
+    """Send this process's counts to its sink, if it has one and its interval has passed since the last time (or if
+    'force').
+
+    'pending' are counts of a running sub-process, not merged yet, to add to the text file."""
+    global _last_publish_time
+    sink = _active_sink()
+    if sink is None:
+        return
+    now = time.monotonic()
+    if not force and now - _last_publish_time < sink.interval_s:
+        return
+    _last_publish_time = now
+    sink.publish(pending)
+
+
+def configure(textfile: str | None,
+              fmt: str = "openmetrics",
+              interval_s: float = 15) -> None:
+    """Write this process's counts (plus those merged from its sub-processes) to a text file, at most every
+    interval_s seconds. The counts start from zero. If textfile is None, stop writing it."""
+    global _sink, _counts, _last_publish_time
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown metrics format '{fmt}'. Must be one of {FORMATS}.")
+    if textfile is None:
+        _sink = None
+        return
+    textfile = os.path.abspath(os.path.expanduser(textfile))
+    os.makedirs(os.path.dirname(textfile), exist_ok=True)
+    _counts = {}
+    _sink = _TextfileSink(textfile, fmt, interval_s)
+    _last_publish_time = 0.0
+    publish(force=True)
+
+
+def textfile_enabled() -> bool:
+    """Whether this process writes a metrics text file."""
+    return isinstance(_active_sink(), _TextfileSink)
+
+
+@contextlib.contextmanager
+def publishing(shared_dict, key: str, interval_s: float = 5):
+    """In a sub-process, put the counts made inside this context into shared_dict[key], every interval_s seconds and at
+    the end, for the main process to pick up.
+
+    Does nothing in a process that writes the metrics text file itself (i.e. when not run in a sub-process)."""
+    global _sink
+    if textfile_enabled():
+        yield
+        return
+
+    previous_sink = _sink
+    _sink = _SharedDictSink(shared_dict, key, interval_s)
+    try:
+        yield
+    finally:
+        try:
+            publish(force=True)
+        finally:
+            _sink = previous_sink
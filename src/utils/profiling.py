@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+"""Optional profiling of IVERT and all of its sub-processes.
+
+Validating a DEM runs in several processes: the main process, the validate_dem_parallel sub-process it starts for each
+DEM, the cell-validation workers that sub-process starts, and the output-stage workers. To profile all of them, call
+enable(profile_dir) in the main process before starting any work (as 'ivert validate --profile DIR' does). This sets
+the IVERT_PROFILE_DIR environment variable, which every sub-process inherits, whether forked or spawned.
+
+Functions that run as the body of a process are decorated with:
+
+    @profiling.profiled_process("validate_dem_parallel")
+    def validate_dem_parallel(...):
+
+While IVERT_PROFILE_DIR is set, each call of a decorated function is profiled and written to its own file in that
+directory, named <role>.<pid>.<call number>.prof. Otherwise the decorator does nothing. A function called from a process
+that's already being profiled (such as validate_dem_parallel called directly rather than in a sub-process) is included
+in that process's profile instead.
+
+Two profilers are supported:
+    cProfile:     The standard-library deterministic profiler. Files can be read with pstats, snakeviz, etc.
+    pyinstrument: A sampling profiler with much lower overhead, if installed. Files are pyinstrument sessions.
+The profiler is chosen by the IVERT_PROFILER environment variable ('cprofile', 'pyinstrument' or 'auto'), which
+enable() also sets. 'auto' uses pyinstrument if installed, otherwise cProfile.
+
+At the end, merge_profiles() combines the files of all processes into one profile and a text report.
+
+Processes can also be sampled from outside with py-spy ('py-spy record --subprocesses -p <pid>'), which needs no
+changes here.
+"""
+
+import contextlib
+import cProfile
+import functools
+import glob
+import importlib.util
+import io
+import os
+import pstats
+
+PROFILE_DIR_ENV = "IVERT_PROFILE_DIR"
+PROFILER_ENV = "IVERT_PROFILER"
+PROFILERS = ("auto", "cprofile", "pyinstrument")
+
+MERGED_PROFILE_BASENAME = "ivert_profile"
+
+# The profiler running in this process, and the pid of the process that started it. A forked child inherits its
+# parent's running profiler, which must be stopped in the child rather than treated as its own.
+_active_profiler = None
+_active_profiler_pid = None
+# How many profiles each role has written from this process, to keep file names unique in long-lived workers.
+_call_counts = {}
+
+
+def enable(profile_dir: str, profiler: str = "auto") -> str:
+    """Profile this process and every sub-process started after this call, writing the profiles to profile_dir.
+
+    Returns the name of the profiler used, 'cprofile' or 'pyinstrument'."""
+    if profiler not in PROFILERS:
+        raise ValueError(f"Unknown profiler '{profiler}'. Must be one of {PROFILERS}.")
+    if profiler == "auto":
+        profiler = "pyinstrument" if importlib.util.find_spec("pyinstrument") is not None else "cprofile"
+    elif profiler == "pyinstrument" and importlib.util.find_spec("pyinstrument") is None:
+        raise ImportError("The 'pyinstrument' profiler is not installed. Install it with 'pip install pyinstrument'.")
+
+    profile_dir = os.path.abspath(os.path.expanduser(profile_dir))
+    os.makedirs(profile_dir, exist_ok=True)
+    os.environ[PROFILE_DIR_ENV] = profile_dir
+    os.environ[PROFILER_ENV] = profiler
+    return profiler
+
+
+def disable() -> None:
+    """Stop profiling sub-processes started after this call."""
+    os.environ.pop(PROFILE_DIR_ENV, None)
+    os.environ.pop(PROFILER_ENV, None)
+
+
+def profile_dir() -> str | None:
+    """The directory profiles are written to, or None if profiling isn't enabled."""
+    return os.environ.get(PROFILE_DIR_ENV) or None
+
+
+def _profiler_name() -> str:
+    return os.environ.get(PROFILER_ENV, "cprofile")
+
+
+def _profile_extension(profiler: str) -> str:
+    return ".pyisession" if profiler == "pyinstrument" else ".prof"
+
+
+class _CProfiler:
+    """Wraps cProfile.Profile, for a common interface with _PyinstrumentProfiler."""
+
+    def __init__(self):
+        self._profiler = cProfile.Profile()
+
+    def start(self):
+        self._profiler.enable()
+
+    def stop(self):
+        self._profiler.disable()
+
+    def write(self, fname):
+        self._profiler.dump_stats(fname)
+
+
+class _PyinstrumentProfiler:
+    """Wraps pyinstrument.Profiler, for a common interface with _CProfiler."""
+
+    def __init__(self):
+        import pyinstrument
+        self._profiler = pyinstrument.Profiler()
+        self._session = None
+
+    def start(self):
+        self._profiler.start()
+
+    def stop(self):
+        self._session = self._profiler.stop()
+
+    def write(self, fname):
+        self._session.save(fname)
+
+
+@contextlib.contextmanager
+def profiled(role: str):
+    """Profile the code run inside this context to its own file in the profile directory, if profiling is enabled and
+    this process isn't already being profiled."""
+    global _active_profiler, _active_profiler_pid
+    outdir = profile_dir()
+    pid = os.getpid()
+
+    if _active_profiler is not None and _active_profiler_pid != pid:
+        # Inherited from the parent through fork. Stop it; its results belong to the parent.
+        try:
+            _active_profiler.stop()
+        except Exception:
+            pass
+        _active_profiler, _active_profiler_pid = None, None
+
+    if outdir is None or _active_profiler is not None:
+        yield
+        return
+
+    profiler_name = _profiler_name()
+    _active_profiler = _PyinstrumentProfiler() if profiler_name == "pyinstrument" else _CProfiler()
+    _active_profiler_pid = pid
+    _active_profiler.start()
+    try:
+        yield
+    finally:
+        profiler, _active_profiler, _active_profiler_pid = _active_profiler, None, None
+        profiler.stop()
+        call_num = _call_counts.get(role, 0)
+        _call_counts[role] = call_num + 1
+        fname = os.path.join(outdir, f"{role}.{pid}.{call_num}{_profile_extension(profiler_name)}")
+        try:
+            profiler.write(fname)
+        except OSError as e:
+            print(f"Could not write profile {fname}: {e}")
+
+
+def profiled_process(role: str):
+    """Decorate a function that runs as the body of a process, to profile it while profiling is enabled.
+
+    See profiled()."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profiled(role):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _role_of(fname: str) -> str:
+    """The role ('main', 'validate_dem_parallel', etc.) in a profile file name."""
+    return os.path.basename(fname).split(".")[0]
+
+
+def merge_profiles(profile_dir: str,
+                   since: float | None = None,
+                   num_functions: int = 40,
+                   verbose: bool = True) -> tuple[str, str] | None:
+    """Merge the per-process profiles in profile_dir into one profile and a text report.
+
+    If 'since' (a time.time() timestamp) is given, only merge profiles written after it, leaving out those of earlier
+    runs into the same directory.
+
+    Writes ivert_profile.prof (or .pyisession for pyinstrument) and ivert_profile.txt in profile_dir, and returns their
+    names. The report lists the profiles merged by role, then the num_functions functions with the most cumulative and
+    internal time (cProfile), or the combined call tree (pyinstrument). Returns None if there were no profiles."""
+    merged_basename = os.path.join(profile_dir, MERGED_PROFILE_BASENAME)
+    report_fname = merged_basename + ".txt"
+
+    for profiler_name in ("cprofile", "pyinstrument"):
+        ext = _profile_extension(profiler_name)
+        merged_fname = merged_basename + ext
+        profile_files = sorted(fn for fn in glob.glob(os.path.join(profile_dir, "*" + ext))
+                               if fn != merged_fname and (since is None or os.path.getmtime(fn) >= since))
+        if len(profile_files) > 0:
+            break
+    else:
+        if verbose:
+            print(f"No profiles found in {profile_dir}.")
+        return None
+
+    roles = {}
+    for fn in profile_files:
+        roles[_role_of(fn)] = roles.get(_role_of(fn), 0) + 1
+    role_lines = [f"    {role}: {count}" for role, count in roles.items()]
+
+    report = io.StringIO()
+    report.write(f"Merged {len(profile_files)} profiles from {profile_dir}:\n" + "\n".join(role_lines) + "\n\n")
+
+    if profiler_name == "cprofile":
+        stats = pstats.Stats(*profile_files, stream=report)
+        stats.dump_stats(merged_fname)
+        stats.strip_dirs()
+        report.write(f"Top {num_functions} functions by cumulative time (summed over all processes):\n")
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(num_functions)
+        report.write(f"Top {num_functions} functions by internal time (summed over all processes):\n")
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(num_functions)
+    else:
+        from pyinstrument.renderers import ConsoleRenderer
+        from pyinstrument.session import Session
+        session = functools.reduce(Session.combine, [Session.load(fn) for fn in profile_files])
+        session.save(merged_fname)
+        report.write(ConsoleRenderer(unicode=False, color=False, show_all=False).render(session))
+
+    with open(report_fname, "w") as f:
+        f.write(report.getvalue())
+
+    if verbose:
+        print(f"Merged {len(profile_files)} profiles into {merged_fname} and {report_fname}.")
+
+    return merged_fname, report_fname
@@ -0,0 +1,140 @@
+"""Zero-copy, memory-mapped (where possible) read access to single-band rasters such as DEMs.
+
+For uncompressed rasters whose on-disk layout allows it (ENVI/raw binary, uncompressed GeoTIFFs), GDAL's virtual memory
+(GetVirtualMemAutoArray) maps the band straight into a numpy array. The OS page cache then handles residency, shared
+across the parent process and any workers reading the same file, and nothing is copied until it's touched.
+
+Everything else (compressed GeoTIFFs, etc.) falls back to reading whole GDAL blocks on demand, keeping the most
+recently-used blocks in a small cache.
+"""
+
+import collections
+
+import numpy
+from osgeo import gdal, gdal_array
+
+gdal.UseExceptions()
+
+# Drivers whose uncompressed files can generally be memory-mapped by GDAL.
+_MAPPABLE_DRIVERS = ("GTiff", "ENVI", "EHdr", "GenBin", "ISCE", "PAux")
+
+
+class RasterArray:
+    """Read access to one band of a raster, memory-mapped when the file layout allows it, block-cached otherwise."""
+
+    def __init__(self, raster, band_num: int = 1, use_virtual_memory: bool = True, max_cached_blocks: int = 64):
+        """Open a raster band for reading.
+
+        Args:
+            raster: A raster filename, or an already-opened gdal.Dataset.
+            band_num: The (1-based) band number to read.
+            use_virtual_memory: Try to memory-map the band through GDAL virtual memory. If False, or if the file layout
+                doesn't allow it, reads go through the block cache.
+            max_cached_blocks: Maximum number of GDAL blocks kept in the block cache.
+        """
+        if isinstance(raster, gdal.Dataset):
+            self.ds = raster
+        else:
+            self.ds = gdal.Open(str(raster), gdal.GA_ReadOnly)
+
+        self.band = self.ds.GetRasterBand(band_num)
+        self.shape = (self.band.YSize, self.band.XSize)
+        self.block_xsize, self.block_ysize = self.band.GetBlockSize()
+        self.num_blocks_x = int(numpy.ceil(self.shape[1] / self.block_xsize))
+        self.max_cached_blocks = max_cached_blocks
+
+        self._block_cache = collections.OrderedDict()
+        self._vmem_array = self._open_virtual_memory() if use_virtual_memory else None
+
+    def _open_virtual_memory(self):
+        """Return a numpy array memory-mapped onto the band, or None if the file layout doesn't allow it."""
+        if self.ds.GetDriver().ShortName not in _MAPPABLE_DRIVERS:
+            return None
+        if self.ds.GetMetadataItem("COMPRESSION", "IMAGE_STRUCTURE") is not None:
+            return None
+
+        try:
+            return self.band.GetVirtualMemAutoArray(gdal.GF_Read)
+        except (RuntimeError, AttributeError, TypeError, ValueError):
+            return None
+
+    @property
+    def is_memory_mapped(self) -> bool:
+        """True if the band is read through GDAL virtual memory."""
+        return self._vmem_array is not None
+
+    @property
+    def dtype(self) -> numpy.dtype:
+        """The numpy dtype of the band."""
+        return numpy.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(self.band.DataType))
+
+    @property
+    def nodata(self):
+        """The band's nodata value, or None if it has none."""
+        return self.band.GetNoDataValue()
+
+    def read(self) -> numpy.ndarray:
+        """Return the whole band as a 2D array. This is a zero-copy memory map if available, a full read otherwise."""
+        if self._vmem_array is not None:
+            return self._vmem_array
+        return self.band.ReadAsArray()
+
+    def _get_block(self, block_key: int) -> tuple:
+        """Return (block_array, yoff, xoff) for a block, from the cache if it's there."""
+        if block_key in self._block_cache:
+            self._block_cache.move_to_end(block_key)
+            return self._block_cache[block_key]
+
+        yoff = int(block_key // self.num_blocks_x) * self.block_ysize
+        xoff = int(block_key % self.num_blocks_x) * self.block_xsize
+        block_array = self.band.ReadAsArray(xoff, yoff,
+                                            min(self.block_xsize, self.shape[1] - xoff),
+                                            min(self.block_ysize, self.shape[0] - yoff))
+        block = (block_array, yoff, xoff)
+
+        if self.max_cached_blocks > 0:
+            self._block_cache[block_key] = block
+            if len(self._block_cache) > self.max_cached_blocks:
+                self._block_cache.popitem(last=False)
+
+        return block
+
+    def sample(self, rows, cols) -> numpy.ndarray:
+        """Return the band values at the given (row, col) cells. All cells must be within the raster.
+
+        Memory-mapped bands are indexed directly. Otherwise, the cells are grouped by GDAL block so that each block is
+        read at most once per call."""
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        cols = numpy.asarray(cols, dtype=numpy.int64)
+
+        if self._vmem_array is not None:
+            return self._vmem_array[rows, cols]
+
+        values = numpy.empty(rows.shape, dtype=self.dtype)
+        if rows.size == 0:
+            return values
+
+        block_keys = (rows // self.block_ysize) * self.num_blocks_x + (cols // self.block_xsize)
+        sort_order = numpy.argsort(block_keys, kind="stable")
+        unique_blocks, block_starts = numpy.unique(block_keys[sort_order], return_index=True)
+        block_ends = numpy.append(block_starts[1:], len(block_keys))
+
+        for block_key, b_start, b_end in zip(unique_blocks, block_starts, block_ends):
+            block_array, yoff, xoff = self._get_block(block_key)
+            idx = sort_order[b_start:b_end]
+            values[idx] = block_array[rows[idx] - yoff, cols[idx] - xoff]
+
+        return values
+
+    def close(self) -> None:
+        """Release the memory map, the block cache and the dataset."""
+        self._vmem_array = None
+        self._block_cache.clear()
+        self.band = None
+        self.ds = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""Per-stage timing and memory instrumentation of the DEM validation pipeline.
+
+Code marks each stage it runs with:
+
+    with stage_timings.stage("fetch_photons"):
+        ...
+
+Stages are only measured while a StageRecorder is recording in the process (see recording()). Otherwise stage() does
+nothing, so instrumented functions can be called from anywhere. Stages can be nested. For each stage, the recorder
+measures:
+    wall_s:         Wall-clock time.
+    cpu_s:          CPU time of this process, plus that of any child processes that finished during the stage (such
+                    as the cell-validation workers).
+    rss_bytes:      Resident memory of this process at the end of the stage.
+    peak_rss_bytes: Peak resident memory of this process during the stage. Exact if the stage raised the process's
+                    memory high-water mark, otherwise the larger of its starting and ending memory.
+    read_bytes:     Bytes read by this process during the stage (including reads served from the page cache), where
+                    the platform reports them. Otherwise None.
+
+The recorded stages are written to a JSON file, which format_stage_table() prints as a table.
+"""
+
+import contextlib
+import json
+import os
+import sys
+import time
+
+import psutil
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows.
+    resource = None
+
+# The recorder collecting stages in this process, if any.
+_active_recorder = None
+
+
+def _max_rss_bytes() -> int | None:
+    """The peak resident memory of this process so far, or None if the platform doesn't report it."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, in kilobytes elsewhere.
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def _cpu_seconds() -> float:
+    """The CPU time of this process and its finished child processes."""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _bytes_read(proc: psutil.Process) -> int | None:
+    """The bytes read by a process so far, or None if the platform doesn't report it."""
+    try:
+        io = proc.io_counters()
+    except (AttributeError, NotImplementedError, psutil.Error):
+        return None
+    # 'read_chars' (Linux) counts all reads, including those served from the page cache. 'read_bytes' only counts
+    # those that reached the disk.
+    return getattr(io, "read_chars", io.read_bytes)
+
+
+class StageRecorder:
+    """Records the time, CPU, memory and reads of each stage run in this process."""
+
+    def __init__(self, label: str | None = None):
+        """Create a recorder. 'label' (such as the DEM name) is written with the stages."""
+        self.label = label
+        self.stages = []
+        self._proc = psutil.Process()
+        self._open_stages = []
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Measure the stage run inside this context."""
+        record = {"name": name,
+                  "path": "/".join([s["name"] for s in self._open_stages] + [name]),
+                  "depth": len(self._open_stages)}
+        self.stages.append(record)
+        self._open_stages.append(record)
+
+        max_rss_start = _max_rss_bytes()
+        rss_start = self._proc.memory_info().rss
+        read_start = _bytes_read(self._proc)
+        cpu_start = _cpu_seconds()
+        t_start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["wall_s"] = time.perf_counter() - t_start
+            record["cpu_s"] = _cpu_seconds() - cpu_start
+            read_end = _bytes_read(self._proc)
+            record["read_bytes"] = None if (read_start is None or read_end is None) else read_end - read_start
+            record["rss_bytes"] = self._proc.memory_info().rss
+            max_rss_end = _max_rss_bytes()
+            if max_rss_end is not None and max_rss_end > max_rss_start:
+                record["peak_rss_bytes"] = max_rss_end
+            else:
+                record["peak_rss_bytes"] = max(rss_start, record["rss_bytes"])
+            self._open_stages.remove(record)
+
+    def to_dict(self) -> dict:
+        """Return the recorded stages as a JSON-serializable dictionary."""
+        return {"label": self.label,
+                "pid": self._proc.pid,
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "max_rss_bytes": _max_rss_bytes(),
+                "stages": [dict(s) for s in self.stages if "wall_s" in s]}
+
+    def write(self, fname: str, append: bool = False) -> None:
+        """Write the recorded stages to a JSON file.
+
+        If 'append' is set and the file exists, the stages are added to the ones already in it, such as for outputs
+        rendered later in another process."""
+        timings = self.to_dict()
+        if append and os.path.exists(fname):
+            existing = read_stage_timings(fname)
+            existing["stages"].extend(timings["stages"])
+            existing["max_rss_bytes"] = max([v for v in (existing.get("max_rss_bytes"), timings["max_rss_bytes"])
+                                             if v is not None], default=None)
+            timings = existing
+
+        tmp_fname = fname + ".tmp"
+        with open(tmp_fname, "w") as f:
+            json.dump(timings, f, indent=2)
+        os.replace(tmp_fname, fname)
+
+
+def active_recorder() -> StageRecorder | None:
+    """The recorder recording stages in this process, or None."""
+    return _active_recorder
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Measure the stage run inside this context, if a recorder is recording in this process."""
+    if _active_recorder is None:
+        yield None
+    else:
+        with _active_recorder.stage(name) as record:
+            yield record
+
+
+@contextlib.contextmanager
+def recording(output_fname: str | None, label: str | None = None, append: bool = False):
+    """Record the stages run inside this context, and write them to output_fname (see StageRecorder.write()) at the
+    end, even if the context raised an error.
+
+    If output_fname is None, or another recorder is already recording in this process (whose stages will include
+    these), nothing is recorded here."""
+    global _active_recorder
+    if output_fname is None or _active_recorder is not None:
+        yield None
+        return
+
+    _active_recorder = StageRecorder(label)
+    try:
+        yield _active_recorder
+    finally:
+        recorder, _active_recorder = _active_recorder, None
+        try:
+            recorder.write(output_fname, append=append)
+        except OSError as e:
+            print(f"Could not write stage timings to {output_fname}: {e}")
+
+
+def read_stage_timings(fname: str) -> dict:
+    """Read a stage timings JSON file."""
+    with open(fname, "r") as f:
+        return json.load(f)
+
+
+def sum_stage_timings(timings_list: list) -> dict:
+    """Combine the stage timings of several runs (such as every DEM in a collection) into one.
+
+    Stages with the same path are summed, except for their memory, which is the largest of them."""
+    summed = {}
+    for timings in timings_list:
+        for s in timings["stages"]:
+            total = summed.get(s["path"])
+            if total is None:
+                summed[s["path"]] = dict(s, calls=1)
+                continue
+            total["calls"] += 1
+            for key in ("wall_s", "cpu_s", "read_bytes"):
+                total[key] = None if (total[key] is None or s[key] is None) else total[key] + s[key]
+            for key in ("rss_bytes", "peak_rss_bytes"):
+                total[key] = max(total[key], s[key])
+
+    max_rss = [t["max_rss_bytes"] for t in timings_list if t.get("max_rss_bytes") is not None]
+    return {"label": f"{len(timings_list)} runs",
+            "max_rss_bytes": max(max_rss) if max_rss else None,
+            "stages": list(summed.values())}
+
+
+def format_stage_table(timings: dict) -> str:
+    """Return a table of the stages in a stage timings dictionary, with nested stages indented under their parents.
+
+    (Stages are recorded in the order they start, so each stage's nested stages follow right after it.)"""
+    import tabulate
+
+    def _mb(nbytes):
+        return None if nbytes is None else nbytes / 2 ** 20
+
+    rows = [["  " * s["depth"] + s["name"], s.get("calls", 1), s["wall_s"], s["cpu_s"],
+             _mb(s["peak_rss_bytes"]), _mb(s["read_bytes"])]
+            for s in timings["stages"]]
+    return tabulate.tabulate(rows, headers=["stage", "calls", "wall (s)", "cpu (s)", "peak RSS (MB)", "read (MB)"],
+                             tablefmt="simple", floatfmt="0.2f", missingval="-")
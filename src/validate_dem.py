@@ -8,6 +8,7 @@ Created on Tue Jun 22 16:06:21 2021
 
 import argparse
 import ast
+import mmap
 import multiprocessing as mp
 import multiprocessing.shared_memory as shared_memory
 import numexpr
@@ -15,6 +16,8 @@ import numpy
 from osgeo import gdal, ogr, osr
 import os
 import pandas
+import pyarrow
+import pyarrow.parquet
 import re
 import signal
 import sys
@@ -23,9 +26,15 @@ import time
 import utils.progress_bar as progress_bar
 import utils.parallel_funcs as parallel_funcs
 import utils.configfile
-import utils.pickle_blosc
 import utils.split_dem
+import utils.raster_access as raster_access
+import utils.dataframe_io as dataframe_io
+import utils.stage_timings as stage_timings
+import utils.profiling as profiling
+import utils.metrics as metrics
 import plot_validation_results
+import results_table
+import summary_sketch
 import icesat2_database_v2
 import coastline_mask
 import utils.dem_geom as dem_geom
@@ -42,267 +51,300 @@ ivert_config = utils.configfile.Config()
 EMPTY_VAL = ivert_config.dem_default_ndv
 TRANSFORMEZ_CACHE_DIR = ivert_config.cache_directory
 
+# Arrays handed to the validation workers through fork inheritance (see _share_arrays()). The parent fills this in
+# immediately before forking the workers, so they see the photon arrays copy-on-write without any copies.
+_FORK_INHERITED_ARRAYS = {}
+
+# Columns of the per-cell results table filled in by the validation workers, in output order, with their dtypes.
+# "range" is given the dtype of the photon heights. "coverage_frac" is only included when measuring coverage.
+RESULTS_TABLE_COLUMNS = (("mean", float),
+                         ("median", float),
+                         ("stddev", float),
+                         ("numphotons", numpy.uint32),
+                         ("numphotons_bathy", numpy.uint32),
+                         ("numphotons_intd", numpy.uint32),
+                         ("interdecile_range", float),
+                         ("range", None),
+                         ("10p", float),
+                         ("90p", float),
+                         ("dem_elev", float),
+                         ("diff_mean", float),
+                         ("diff_median", float),
+                         ("coverage_frac", float))
+
 
 def read_dataframe_file(df_filename: str) -> pandas.DataFrame:
-    """Read a dataframe file, either from a picklefile, HDF, CSV, or feather.
+    """Read a results dataframe file in any supported format. See utils.dataframe_io.read_dataframe_file()."""
+    return dataframe_io.read_dataframe_file(df_filename)
+
 
-    (Can handle other formats by adding more "elif ..." statements in the function.)
+def _select_photon_transport(transport: str | None = None) -> str:
+    """Choose how photon arrays are handed to the validation worker processes.
+
+    Returns "fork" (workers inherit the parent's arrays copy-on-write) or "shared_memory" (arrays are copied into
+    named multiprocessing.shared_memory segments that the workers attach to). The default "auto" uses "fork" on Linux,
+    and "shared_memory" on platforms that can only spawn new processes (Windows, macOS).
     """
-    assert os.path.exists(df_filename)
-    ext = os.path.splitext(df_filename)[1]
-    ext = ext.lower()
-    if ext == ".pickle":
-        dataframe = pandas.read_pickle(df_filename)
-    elif ext in (".h5", ".hdf"):
-        dataframe = pandas.read_hdf(df_filename, mode="r")
-    elif ext in (".csv", ".txt"):
-        dataframe = pandas.read_csv(df_filename)
-    elif ext == ".feather":
-        dataframe = pandas.read_feather(df_filename)
-    elif ext == ".blosc2":
-        dataframe = utils.pickle_blosc.read(df_filename)
+    if transport is None:
+        transport = ivert_config.photon_array_transport
+    transport = str(transport).strip().lower()
+
+    if transport == "auto":
+        if sys.platform.startswith("linux") and "fork" in mp.get_all_start_methods():
+            return "fork"
+        return "shared_memory"
+    elif transport == "fork":
+        if "fork" not in mp.get_all_start_methods():
+            raise ValueError("The 'fork' photon array transport is not available on this platform.")
+        return "fork"
+    elif transport == "shared_memory":
+        return "shared_memory"
     else:
-        raise NotImplementedError(f"ERROR: Unknown dataframe file extension '{ext}'. (Currently supporting .pickle, .h5, .hdf, .csv, .txt, .feather, or .blosc2)")
-
-    return dataframe
-
-
-def validate_dem_child_process(height_array_name,
-                               height_dtype,
-                               i_array_name,
-                               i_dtype,
-                               j_array_name,
-                               j_dtype,
-                               code_array_name,
-                               code_dtype,
-                               array_shape,
-                               connection,
-                               photon_limit=None,
-                               measure_coverage=False,
-                               x_array_name=None,
-                               x_dtype=None,
-                               y_array_name=None,
-                               y_dtype=None,
-                               num_subdivisions=15):
-    """A child process for running the DEM validation in parallel.
+        raise ValueError(f"Unknown photon array transport '{transport}'. Use 'auto', 'fork', or 'shared_memory'.")
 
-    It takes the input_height (m) and the dem_indices (flattened), as well
-    as a duplexed multiprocessing.connection.Connection object (i.e. an open pipe)
-    for processing it. It reads the arrays into local memory, then uses the connection
-    to pass data back and forth until getting a "STOP" command over the connection.
 
-    'measure_coverage' is a boolean parameter to measure how well a given pixel is covered by ICESat-2 photons.
-    We'll measure a couple of different measures (centrality and coverage), and insert those parameters in the output."""
+def _share_arrays(arrays: dict, transport: str, writable_fields=()) -> tuple:
+    """Make a set of numpy arrays available to the validation worker processes.
 
-    # Define shared memory arrays here.
-    h_shm = shared_memory.SharedMemory(name=height_array_name)
-    heights = numpy.ndarray(array_shape, dtype=height_dtype, buffer=h_shm.buf)
+    Returns (array_specs, shared_arrays, memory_objs). shared_arrays maps each field to the array as the workers see it,
+    so the parent can read back anything the workers write into the 'writable_fields'.
 
-    pi_shm = shared_memory.SharedMemory(name=i_array_name)
-    photon_i = numpy.ndarray(array_shape, dtype=i_dtype, buffer=pi_shm.buf)
+    With the "fork" transport, array_specs is None and the arrays are placed in _FORK_INHERITED_ARRAYS, to be inherited
+    by the forked workers. Read-only arrays are inherited copy-on-write; the writable ones are first copied into
+    anonymous shared memory-maps so that the workers' writes are visible to the parent. No named shared memory is
+    allocated, so nothing is left behind in /dev/shm if this process gets killed.
 
-    pj_shm = shared_memory.SharedMemory(name=j_array_name)
-    photon_j = numpy.ndarray(array_shape, dtype=j_dtype, buffer=pj_shm.buf)
+    With the "shared_memory" transport, each array is copied into a named shared memory segment; array_specs maps each
+    field to its (shared_memory_name, dtype, shape), and memory_objs holds the SharedMemory objects to be unlinked by
+    clean_procs_and_pipes().
+    """
+    shared_arrays = {}
+    memory_objs = []
+
+    if transport == "fork":
+        for field, array in arrays.items():
+            if field in writable_fields:
+                buf = mmap.mmap(-1, max(array.nbytes, 1))
+                shared_array = numpy.frombuffer(buf, dtype=array.dtype, count=array.size).reshape(array.shape)
+                shared_array[:] = array
+                shared_arrays[field] = shared_array
+            else:
+                shared_arrays[field] = array
 
-    pc_shm = shared_memory.SharedMemory(name=code_array_name)
-    ph_codes = numpy.ndarray(array_shape, dtype=code_dtype, buffer=pc_shm.buf)
+        _FORK_INHERITED_ARRAYS.clear()
+        _FORK_INHERITED_ARRAYS.update(shared_arrays)
+        return None, shared_arrays, memory_objs
 
-    if measure_coverage:
-        x_shm = shared_memory.SharedMemory(name=x_array_name)
-        ph_x = numpy.ndarray(array_shape, dtype=x_dtype, buffer=x_shm.buf)
+    proc_id = os.getpid()
+    array_specs = {}
+    for field, array in arrays.items():
+        smo = shared_memory.SharedMemory(size=max(array.nbytes, 1), name=f"{field}_{proc_id}", create=True)
+        shared_array = numpy.ndarray(array.shape, dtype=array.dtype, buffer=smo.buf)
+        shared_array[:] = array
+        array_specs[field] = (smo.name, array.dtype, array.shape)
+        shared_arrays[field] = shared_array
+        memory_objs.append(smo)
 
-        y_shm = shared_memory.SharedMemory(name=y_array_name)
-        ph_y = numpy.ndarray(array_shape, dtype=y_dtype, buffer=y_shm.buf)
-    else:
-        x_shm = None
-        y_shm = None
-        ph_x = None
-        ph_y = None
+    return array_specs, shared_arrays, memory_objs
+
+
+def _attach_arrays(array_specs: dict | None) -> tuple:
+    """In a validation worker, get the arrays shared by the parent process.
+
+    Returns ({field: numpy.ndarray}, [SharedMemory handles to close when finished])."""
+    if array_specs is None:
+        return _FORK_INHERITED_ARRAYS, []
+
+    arrays = {}
+    shm_handles = []
+    for field, (shm_name, dtype, shape) in array_specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        arrays[field] = numpy.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        shm_handles.append(shm)
+
+    return arrays, shm_handles
+
+
+def _new_results_table(num_cells: int, heights_dtype, measure_coverage: bool) -> dict:
+    """Create an empty per-cell results table, as a dict of "result_<column>" arrays, to be filled in by the workers.
+
+    Statistics start out as EMPTY_VAL and photon counts as zero, so any cells never processed (if a worker dies) are
+    discarded along with the other empty cells when the outputs are written."""
+    result_columns = {}
+    for col, dtype in RESULTS_TABLE_COLUMNS:
+        if col == "coverage_frac" and not measure_coverage:
+            continue
+        dtype = heights_dtype if dtype is None else dtype
+        fill_value = 0 if numpy.issubdtype(dtype, numpy.integer) else EMPTY_VAL
+        result_columns["result_" + col] = numpy.full((num_cells,), fill_value, dtype=dtype)
+
+    return result_columns
+
+
+def _results_table_from_shared(shared_arrays: dict, cell_i, cell_j) -> results_table.ResultsTable:
+    """Copy the per-cell results the workers filled in out of the shared arrays, into a ResultsTable."""
+    columns = {col: shared_arrays["result_" + col].copy()
+               for col, _ in RESULTS_TABLE_COLUMNS if ("result_" + col) in shared_arrays}
+    return results_table.ResultsTable(cell_i, cell_j, columns)
+
+
+@profiling.profiled_process("cell_validation_worker")
+def validate_dem_child_process(array_specs,
+                               connection):
+    """A child process for running the DEM validation in parallel.
+
+    The photon heights, (i, j) cell indices and class codes, the list of DEM cells to validate, and the per-cell
+    results table are all shared by the parent process. They're either inherited through fork (array_specs is None), or
+    attached from named shared memory (array_specs maps each field to its (shared_memory_name, dtype, shape)). See
+    _share_arrays().
+
+    The parent sends (start, end) ranges of cell ordinals over the connection (a duplexed
+    multiprocessing.connection.Connection object, i.e. an open pipe). The worker writes the results for those cells
+    directly into the results table, and sends the same (start, end) back to signal completion. It keeps going until
+    getting a "STOP" command over the connection.
+
+    Cell coverage fractions (if measured) and any per-cell photon subsampling are done up front by the parent; see
+    compute_cell_coverage() and subsample_photons_per_cell()."""
+
+    shared_arrays, shm_handles = _attach_arrays(array_specs)
 
     # Just keep looping and checking the connection pipe. When we get
     # a stop command, return from the function.
     while True:
         if connection.poll():
-            if measure_coverage:
-                # If we're measuring the coverage, also give us the bounding boxes of the grid cells
-                dem_i_list, \
-                dem_j_list, \
-                dem_elev_list, \
-                cell_xmin_list, \
-                cell_xmax_list, \
-                cell_ymin_list, \
-                cell_ymax_list = connection.recv()
-
-            else:
-                dem_i_list, \
-                dem_j_list, \
-                dem_elev_list = connection.recv()
-
-                cell_xmin_list = None
-                cell_ymin_list = None
-                cell_xmax_list = None
-                cell_ymax_list = None
+            start, end = connection.recv()
 
             # Upon the "STOP" mesage, break the loop, close the shared memory objects, and return.
-            if (type(dem_i_list) is str) and (dem_i_list == "STOP"):
-                h_shm.close()
-                pi_shm.close()
-                pj_shm.close()
-                pc_shm.close()
-                if measure_coverage:
-                    x_shm.close()
-                    y_shm.close()
+            if (type(start) is str) and (start == "STOP"):
+                shared_arrays = None
+                for shm in shm_handles:
+                    shm.close()
                 return
 
-            assert len(dem_i_list) == len(dem_j_list)
-            N = len(dem_i_list)
-
-            # Do the work.
-            r_mean = numpy.zeros((N,), dtype=float)
-            r_median = numpy.zeros((N,), dtype=float)
-            r_numphotons = numpy.zeros((N,), dtype=numpy.uint32)
-            r_numphotons_bathy = r_numphotons.copy()
-            r_numphotons_intd = r_numphotons.copy()
-            r_std = numpy.zeros((N,), dtype=float)
-            r_interdecile = numpy.zeros((N,), float)
-            r_range = numpy.zeros((N,), heights.dtype)
-            r_10p = numpy.zeros((N,), float)
-            r_90p = numpy.zeros((N,), float)
-            # r_canopy_fraction = numpy.zeros((N,), numpy.float16)
-            r_dem_elev = numpy.zeros((N,), dtype=float)
-            r_mean_diff = numpy.zeros((N,), dtype=float)
-            r_med_diff = numpy.zeros((N,), dtype=float)
-            if measure_coverage:
-                r_coverage_frac = numpy.zeros((N,), dtype=float)
-            else:
-                r_coverage_frac = None
-
-            for counter, (i, j) in enumerate(zip(dem_i_list, dem_j_list)):
-                # Using numexpr.evaluate here is far more memory-and-time efficient than just doing it with the numpy arrays.
-                ph_subset_mask = numexpr.evaluate("(photon_i == i) & (photon_j == j)")
-                # Generate a small pandas dataframe from the subset
-                subset_df = pandas.DataFrame({'height': heights[ph_subset_mask],
-                                              'ph_code': ph_codes[ph_subset_mask]})
-
-                # Define and compute measures of centrality & coverage here.
-                if measure_coverage:
-                    # Add the x and y coords to the dataframe
-                    subset_df['xcoord'] = ph_x[ph_subset_mask]
-                    subset_df['ycoord'] = ph_y[ph_subset_mask]
-
-                    cell_xmin = cell_xmin_list[counter]
-                    cell_xmax = cell_xmax_list[counter]
-                    cell_ymin = cell_ymin_list[counter]
-                    cell_ymax = cell_ymax_list[counter]
-                    assert (cell_xmax > cell_xmin) and (cell_ymax > cell_ymin)
-
-                    cell_xstep = (cell_xmax - cell_xmin) / num_subdivisions
-                    # Equal to the geotransform, the y-value starts at the top (max) and iterate downward (negative step.)
-                    cell_ystep = (cell_ymin - cell_ymax) / num_subdivisions
-
-                    assert (cell_xstep > 0) and (cell_ystep < 0)
-
-                    subset_df['subset_i'] = numpy.floor((subset_df.ycoord - cell_ymax) / cell_ystep).astype(int)
-                    subset_df['subset_j'] = numpy.floor((subset_df.xcoord - cell_xmin) / cell_xstep).astype(int)
-
-                    # By taking i * (number_of_rows) + j, we come up with unique single values for the sub-cell this is in.
-                    subset_df['subset_ij'] = (subset_df.subset_i * num_subdivisions) + subset_df.subset_j
-                    # Count how many unique subset-cells are covered and divide by the number of total sub-cells.
-                    cell_fraction_covered = len(subset_df.subset_ij.unique()) / (num_subdivisions ** 2)
-                    r_coverage_frac[counter] = cell_fraction_covered
-
-                # After calculating the coverage, if we want to limit the number of photons we're dealing with total,
-                # do it here.
-                if photon_limit is not None and len(subset_df) > photon_limit:
-                    assert photon_limit >= 2
-                    subset_df = subset_df.sample(n=photon_limit)
-
-                r_numphotons[counter] = len(subset_df)
-                # if len(subset_df) > 0:
-                #     r_canopy_fraction[counter] = (subset_df.ph_code >= 2).sum() / len(subset_df)
-                # else:
-                #     r_canopy_fraction[counter] = EMPTY_VAL
-
-                r_dem_elev[counter] = dem_elev_list[counter]
-
-                ground_only_df = subset_df[numpy.isin(subset_df.ph_code, [1, 40])]
-                if len(ground_only_df) < 3:
-                    r_range[counter] = EMPTY_VAL
-                    r_10p[counter] = EMPTY_VAL
-                    r_90p[counter] = EMPTY_VAL
-                    r_interdecile[counter] = EMPTY_VAL
-                    r_numphotons_bathy[counter] = numpy.count_nonzero(ground_only_df.ph_code == 40)
-                    r_numphotons_intd[counter] = len(ground_only_df)
-                    r_mean[counter] = EMPTY_VAL
-                    r_median[counter] = EMPTY_VAL
-                    r_std[counter] = EMPTY_VAL
-                    r_mean_diff[counter] = EMPTY_VAL
-                    r_med_diff[counter] = EMPTY_VAL
-                else:
-                    height_desc = ground_only_df.height.describe(percentiles=[0.10, 0.90])
-                    r_range[counter] = height_desc['max'] - height_desc['min']
-                    # zp10, zp90 = numpy.percentile(cph_z, [10,90])
-                    zp10 = height_desc['10%']
-                    zp90 = height_desc['90%']
-                    r_10p[counter], r_90p[counter] = zp10, zp90
-                    r_interdecile[counter] = zp90 - zp10
-                    # Get only the photons within the inter-decile range
-                    # cph_z_intd = cph_z[(cph_z >= zp10) & (cph_z <= zp90)]
-                    r_numphotons_bathy[counter] = numpy.count_nonzero(ground_only_df.ph_code == 40)
-                    df_intd = ground_only_df[(ground_only_df.height >= zp10) & (ground_only_df.height <= zp90)]
-                    r_numphotons_intd[counter] = len(df_intd)
-                    if len(df_intd) >= 1:
-                        height_intd_desc = df_intd.height.describe()
-
-                        r_mean[counter] = height_intd_desc['mean']
-                        r_median[counter] = height_intd_desc['50%']
-                        r_std[counter] = height_intd_desc['std']
-                        r_mean_diff[counter] = dem_elev_list[counter] - r_mean[counter]
-                        r_med_diff[counter] = dem_elev_list[counter] - r_median[counter]
+            _validate_cell_chunk(shared_arrays, start, end)
 
-                    else:
-                        r_mean[counter]      = EMPTY_VAL
-                        r_median[counter]    = EMPTY_VAL
-                        r_std[counter]       = EMPTY_VAL
-                        r_mean_diff[counter] = EMPTY_VAL
-                        r_med_diff[counter]  = EMPTY_VAL
-
-            # Generate a little dataframe of the outputs for all the different grid cells to return.
-            results_df = pandas.DataFrame({"i": dem_i_list,
-                                           "j": dem_j_list,
-                                           "mean": r_mean,
-                                           "median": r_median,
-                                           "stddev": r_std,
-                                           "numphotons": r_numphotons,
-                                           "numphotons_bathy": r_numphotons_bathy,
-                                           "numphotons_intd": r_numphotons_intd,
-                                           "interdecile_range": r_interdecile,
-                                           "range": r_range,
-                                           "10p": r_10p,
-                                           "90p": r_90p,
-                                           # "canopy_fraction": r_canopy_fraction,
-                                           "dem_elev": r_dem_elev,
-                                           "diff_mean": r_mean_diff,
-                                           "diff_median": r_med_diff})\
-                        .set_index(["i", "j"])
-
-            if measure_coverage:
-                # Add columns for centrality measurements here.
-                # results_df["min_dist_from_center"] = r_min_distance_to_center
-                results_df["coverage_frac"] = r_coverage_frac
-
-            connection.send(results_df)
+            connection.send((start, end))
 
     raise RuntimeError("Something went wrong in dem_validate child process. Should not get here.")
 
 
+def _validate_cell_chunk(shared_arrays: dict,
+                         start: int,
+                         end: int) -> None:
+    """Validate DEM cells [start:end) against the photons, writing the outputs into the shared results table."""
+    heights = shared_arrays["heights"]
+    photon_i = shared_arrays["i"]
+    photon_j = shared_arrays["j"]
+    ph_codes = shared_arrays["codes"]
+
+    dem_i_list = shared_arrays["cell_i"][start:end]
+    dem_j_list = shared_arrays["cell_j"][start:end]
+    dem_elev_list = shared_arrays["cell_elev"][start:end]
+
+    assert len(dem_i_list) == len(dem_j_list)
+    N = len(dem_i_list)
+
+    # Do the work.
+    r_mean = numpy.zeros((N,), dtype=float)
+    r_median = numpy.zeros((N,), dtype=float)
+    r_numphotons = numpy.zeros((N,), dtype=numpy.uint32)
+    r_numphotons_bathy = r_numphotons.copy()
+    r_numphotons_intd = r_numphotons.copy()
+    r_std = numpy.zeros((N,), dtype=float)
+    r_interdecile = numpy.zeros((N,), float)
+    r_range = numpy.zeros((N,), heights.dtype)
+    r_10p = numpy.zeros((N,), float)
+    r_90p = numpy.zeros((N,), float)
+    # r_canopy_fraction = numpy.zeros((N,), numpy.float16)
+    r_dem_elev = numpy.zeros((N,), dtype=float)
+    r_mean_diff = numpy.zeros((N,), dtype=float)
+    r_med_diff = numpy.zeros((N,), dtype=float)
+
+    for counter, (i, j) in enumerate(zip(dem_i_list, dem_j_list)):
+        # Using numexpr.evaluate here is far more memory-and-time efficient than just doing it with the numpy arrays.
+        ph_subset_mask = numexpr.evaluate("(photon_i == i) & (photon_j == j)")
+        # Generate a small pandas dataframe from the subset
+        subset_df = pandas.DataFrame({'height': heights[ph_subset_mask],
+                                      'ph_code': ph_codes[ph_subset_mask]})
+
+        r_numphotons[counter] = len(subset_df)
+        # if len(subset_df) > 0:
+        #     r_canopy_fraction[counter] = (subset_df.ph_code >= 2).sum() / len(subset_df)
+        # else:
+        #     r_canopy_fraction[counter] = EMPTY_VAL
+
+        r_dem_elev[counter] = dem_elev_list[counter]
+
+        ground_only_df = subset_df[numpy.isin(subset_df.ph_code, [1, 40])]
+        if len(ground_only_df) < 3:
+            r_range[counter] = EMPTY_VAL
+            r_10p[counter] = EMPTY_VAL
+            r_90p[counter] = EMPTY_VAL
+            r_interdecile[counter] = EMPTY_VAL
+            r_numphotons_bathy[counter] = numpy.count_nonzero(ground_only_df.ph_code == 40)
+            r_numphotons_intd[counter] = len(ground_only_df)
+            r_mean[counter] = EMPTY_VAL
+            r_median[counter] = EMPTY_VAL
+            r_std[counter] = EMPTY_VAL
+            r_mean_diff[counter] = EMPTY_VAL
+            r_med_diff[counter] = EMPTY_VAL
+        else:
+            height_desc = ground_only_df.height.describe(percentiles=[0.10, 0.90])
+            r_range[counter] = height_desc['max'] - height_desc['min']
+            # zp10, zp90 = numpy.percentile(cph_z, [10,90])
+            zp10 = height_desc['10%']
+            zp90 = height_desc['90%']
+            r_10p[counter], r_90p[counter] = zp10, zp90
+            r_interdecile[counter] = zp90 - zp10
+            # Get only the photons within the inter-decile range
+            # cph_z_intd = cph_z[(cph_z >= zp10) & (cph_z <= zp90)]
+            r_numphotons_bathy[counter] = numpy.count_nonzero(ground_only_df.ph_code == 40)
+            df_intd = ground_only_df[(ground_only_df.height >= zp10) & (ground_only_df.height <= zp90)]
+            r_numphotons_intd[counter] = len(df_intd)
+            if len(df_intd) >= 1:
+                height_intd_desc = df_intd.height.describe()
+
+                r_mean[counter] = height_intd_desc['mean']
+                r_median[counter] = height_intd_desc['50%']
+                r_std[counter] = height_intd_desc['std']
+                r_mean_diff[counter] = dem_elev_list[counter] - r_mean[counter]
+                r_med_diff[counter] = dem_elev_list[counter] - r_median[counter]
+
+            else:
+                r_mean[counter]      = EMPTY_VAL
+                r_median[counter]    = EMPTY_VAL
+                r_std[counter]       = EMPTY_VAL
+                r_mean_diff[counter] = EMPTY_VAL
+                r_med_diff[counter]  = EMPTY_VAL
+
+    # Write this chunk's outputs into the shared results table. "mean" and "numphotons_intd" (which decide
+    # whether a cell is kept) go last, so a worker killed mid-write never leaves a half-written cell looking valid.
+    chunk_results = {"median": r_median,
+                     "stddev": r_std,
+                     "numphotons": r_numphotons,
+                     "numphotons_bathy": r_numphotons_bathy,
+                     "interdecile_range": r_interdecile,
+                     "range": r_range,
+                     "10p": r_10p,
+                     "90p": r_90p,
+                     # "canopy_fraction": r_canopy_fraction,
+                     "dem_elev": r_dem_elev,
+                     "diff_mean": r_mean_diff,
+                     "diff_median": r_med_diff}
+    chunk_results["numphotons_intd"] = r_numphotons_intd
+    chunk_results["mean"] = r_mean
+
+    for col, values in chunk_results.items():
+        shared_arrays["result_" + col][start:end] = values
+
+
 def clean_procs_and_pipes(procs, pipes1, pipes2, memory_objs):
     """Join all processes and close all pipes.
 
     Useful for cleaning up after multiprocessing."""
     # Close up all processes.
     for pr in procs:
-        if isinstance(pr, mp.Process):
+        if isinstance(pr, mp.process.BaseProcess):
             if pr.is_alive():
                 pr.kill()
             pr.join()
@@ -315,6 +357,9 @@ def clean_procs_and_pipes(procs, pipes1, pipes2, memory_objs):
         if isinstance(p2, mp.connection.Connection):
             p2.close()
 
+    # Drop any references to fork-inherited arrays.
+    _FORK_INHERITED_ARRAYS.clear()
+
     # Clean up shared memory objoects.
     for smo in memory_objs:
         smo.close()
@@ -326,43 +371,18 @@ def clean_procs_and_pipes(procs, pipes1, pipes2, memory_objs):
     return
 
 
-def kick_off_new_child_process(height_array_name,
-                               height_dtype,
-                               i_array_name,
-                               i_dtype,
-                               j_array_name,
-                               j_dtype,
-                               code_array_name,
-                               code_dtype,
-                               array_shape,
-                               photon_limit=None,
-                               measure_coverage=False,
-                               x_array_name=None,
-                               x_dtype=None,
-                               y_array_name=None,
-                               y_dtype=None,
-                               num_subdivisions=15):
-    """Start a new subprocess to handle and process data."""
+def kick_off_new_child_process(array_specs,
+                               transport="shared_memory"):
+    """Start a new subprocess to handle and process data.
+
+    With the "fork" transport the worker is always forked (regardless of the global multiprocessing start method) so
+    that it inherits the photon arrays. Otherwise, use the default start method."""
     pipe_parent, pipe_child = mp.Pipe(duplex=True)
-    proc = mp.Process(target=validate_dem_child_process,
-                      args=(height_array_name,
-                            height_dtype,
-                            i_array_name,
-                            i_dtype,
-                            j_array_name,
-                            j_dtype,
-                            code_array_name,
-                            code_dtype,
-                            array_shape,
-                            pipe_child),
-                      kwargs={"measure_coverage": measure_coverage,
-                              "x_array_name": x_array_name,
-                              "x_dtype": x_dtype,
-                              "y_array_name": y_array_name,
-                              "y_dtype": y_dtype,
-                              "photon_limit": photon_limit,
-                              "num_subdivisions": num_subdivisions}
-                      )
+    ctx = mp.get_context("fork") if transport == "fork" else mp.get_context()
+    proc = ctx.Process(target=validate_dem_child_process,
+                       args=(array_specs,
+                             pipe_child)
+                       )
     proc.start()
     return proc, pipe_parent, pipe_child
 
@@ -459,6 +479,7 @@ def validate_dem(dem_name: str,
                  mark_empty_results: bool = True,
                  measure_coverage: bool = False,
                  max_photons_per_cell: int | None = None,
+                 subsample_seed: int | None = None,
                  numprocs: int = parallel_funcs.physical_cpu_count(),
                  max_subdivides: int = 4,
                  subdivision_number: int = 0,
@@ -467,6 +488,7 @@ def validate_dem(dem_name: str,
                  min_bathy_confidence: float = 0.90,
                  filter_misclassified: bool = True,
                  export_error_formats: str | list | None = None,
+                 output_stage=None,
                  verbose: bool = True):
     """Validate a DEM and produce output results.
 
@@ -500,6 +522,9 @@ def validate_dem(dem_name: str,
         mark_empty_results (bool): Mark results that are empty in an "_EMPTY.txt" file.
         measure_coverage (bool): Measure the coverage of ICESat-2 photons within each grid-cell.
         max_photons_per_cell (int): Maximum number of photons per cell.
+        subsample_seed (int): Random seed used to choose which photons to keep in cells with more than
+            max_photons_per_cell photons. Use the same seed for reproducible reruns. Default None (a new random
+            selection each run).
         numprocs (int): Number of processes to use for parallelized validation.
         max_subdivides (int): Maximum number of times to subdivide the DEM in quarters before giving up.
         subdivision_number (int): The current recursion depth of this subdivision. Will not subdivide further if
@@ -510,6 +535,10 @@ def validate_dem(dem_name: str,
         export_error_formats (str, list, None): GIS formats to export the per-cell errors into,
             as a comma-separated string or list drawn from 'tif', 'gpkg', 'shp', 'xyz'. Defaults
             to None, which uses the 'export_error_formats' config value.
+        output_stage (output_stage.OutputStage): If given, the DEM's summary stats, result tif, error exports and plot
+            are rendered in the background by this output stage, and this function returns as soon as the results file
+            is written. The output files will not exist until the output stage is joined. Default None: render them
+            before returning.
         verbose (bool): Be verbose.
     """
     if shared_ret_values is None:
@@ -539,11 +568,13 @@ def validate_dem(dem_name: str,
               'mark_empty_results': mark_empty_results,
               'measure_coverage': measure_coverage,
               'max_photons_per_cell': max_photons_per_cell,
+              'subsample_seed': subsample_seed,
               'numprocs': numprocs,
               'min_confidence_level': min_confidence_level,
               'min_bathy_confidence': min_bathy_confidence,
               'filter_misclassified': filter_misclassified,
               'export_error_formats': export_error_formats,
+              'defer_outputs': output_stage is not None,
               'verbose': verbose
               }
 
@@ -560,16 +591,29 @@ def validate_dem(dem_name: str,
                              kwargs=kwargs)
 
     subproc.start()
-    subproc.join(timeout=None)
+    if metrics.textfile_enabled():
+        # Keep the metrics file up to date with the sub-process's counts while it runs.
+        while subproc.is_alive():
+            subproc.join(timeout=ivert_config.metrics_update_interval_s)
+            metrics.publish(pending=sub_shared_ret_values.get(METRICS_KEY), force=True)
+    else:
+        subproc.join(timeout=None)
     exitcode = subproc.exitcode
     subproc.close()
 
+    # Add the sub-process's counts to ours, even if it was killed.
+    metrics.merge(sub_shared_ret_values.pop(METRICS_KEY, None))
+
     if orig_dem_name is None:
         orig_dem_name = dem_name
 
     if exitcode == 0:
         shared_ret_values.update(sub_shared_ret_values)
 
+        output_job = shared_ret_values.pop(DEFERRED_OUTPUT_JOB_KEY, None)
+        if output_job is not None:
+            output_stage.submit(orig_dem_name, render_validation_outputs, output_job)
+
         return list(shared_ret_values.values())
 
     elif abs(exitcode) == abs(signal.SIGKILL):
@@ -617,6 +661,7 @@ def validate_dem(dem_name: str,
                          mark_empty_results=mark_empty_results,
                          measure_coverage=measure_coverage,
                          max_photons_per_cell=max_photons_per_cell,
+                         subsample_seed=subsample_seed,
                          numprocs=numprocs,
                          min_confidence_level=min_confidence_level,
                          min_bathy_confidence=min_bathy_confidence,
@@ -640,9 +685,9 @@ def validate_dem(dem_name: str,
             # Concatenate the results dataframes.
             output_dfs = []
             for fname in all_fnames:
-                dem_results_df = pandas.read_hdf(fname)
+                dem_results_df = read_dataframe_file(fname)
                 # Now I gotta reset the i,j indexes.
-                sub_dem_name = fname.replace("_results.h5", ".tif")
+                sub_dem_name = re.sub(dataframe_io.RESULTS_SUFFIX_REGEX, ".tif", fname)
                 parent_dem_name = dem_name
                 dem_results_df = reset_results_indexes_after_merge(dem_results_df, sub_dem_name, parent_dem_name)
                 output_dfs.append(dem_results_df)
@@ -651,17 +696,17 @@ def validate_dem(dem_name: str,
             # After we've combined all the resutls, *then* filter out outliers if they exist.
             if outliers_sd_threshold is not None:
                 assert type(outliers_sd_threshold) in (int, float)
-                diff_mean = shared_results_df["diff_mean"]
-                meanval, stdval = diff_mean.mean(), diff_mean.std()
-                low_cutoff = meanval - (stdval * outliers_sd_threshold)
-                hi_cutoff = meanval + (stdval * outliers_sd_threshold)
-                valid_mask = (diff_mean >= low_cutoff) & (diff_mean <= hi_cutoff)
-                shared_results_df = shared_results_df[valid_mask].copy()
+                shared_results = results_table.ResultsTable.from_dataframe(shared_results_df)
+                shared_results.filter_outliers(outliers_sd_threshold)
+                shared_results_df = shared_results.to_dataframe()
                 if verbose:
                     print("{0:,} DEM cells after removing outliers.".format(len(shared_results_df)))
 
-            output_fname = os.path.join(output_dir, os.path.splitext(os.path.basename(dem_name))[0] + "_results.h5")
-            shared_results_df.to_hdf(output_fname, key="icesat2", complib="zlib", mode='w')
+            output_fname = os.path.join(output_dir, os.path.splitext(os.path.basename(dem_name))[0]
+                                        + "_results" + dataframe_io.results_file_ext())
+            dataframe_io.write_dataframe_file(shared_results_df, output_fname)
+            summary_sketch.SummarySketch.from_dataframe(shared_results_df).write(
+                summary_sketch.sketch_filename(output_fname))
 
             shared_ret_values[common_key] = output_fname
 
@@ -702,9 +747,8 @@ def validate_dem(dem_name: str,
             common_key = "photon_results_dataframe_file"
             all_fnames = [sub_shared_ret_values[i][common_key] for i in range(len(sub_shared_ret_values)) if
                           common_key in sub_shared_ret_values[i]]
-            results_df = pandas.concat([pandas.read_hdf(fname) for fname in all_fnames], ignore_index=True, axis=0)
-            output_fname = os.path.join(output_dir, os.path.splitext(os.path.basename(dem_name))[0] + "_photons.h5")
-            results_df.to_hdf(output_fname, key="icesat2", complib="zlib", mode='w')
+            output_fname = os.path.join(output_dir, os.path.splitext(os.path.basename(dem_name))[0] + "_photons.parquet")
+            _merge_parquet_files(all_fnames, output_fname)
             shared_ret_values[common_key] = output_fname
 
         # Plot the results.
@@ -722,12 +766,31 @@ def validate_dem(dem_name: str,
         raise RuntimeError(f"validate_dem.validate_dem({orig_dem_name},...) exited with exitcode {exitcode}.")
 
 
+def _merge_parquet_files(input_fnames: list, output_fname: str) -> None:
+    """Concatenate Parquet files with the same columns into one, copying one row group at a time."""
+    writer = None
+    try:
+        for fname in input_fnames:
+            pq_file = pyarrow.parquet.ParquetFile(fname)
+            for rg in range(pq_file.num_row_groups):
+                row_group = pq_file.read_row_group(rg)
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(output_fname, row_group.schema, compression="zstd")
+                writer.write_table(row_group.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
 def get_dem_dataset_and_vars(dem_fn) -> tuple:
     """Get the gdal dataset and the variables in the dataset.
 
+    The dem_array is memory-mapped (read-only) if the DEM is uncompressed and its layout allows it, or read in full
+    otherwise. See utils.raster_access.
+
     Return (dem_dataset, dem_array, dem_bbox, dem_step_xy)."""
     dem_ds = gdal.Open(dem_fn, gdal.GA_ReadOnly)
-    dem_array = dem_ds.GetRasterBand(1).ReadAsArray()
+    dem_array = raster_access.RasterArray(dem_ds).read()
     gt = dem_ds.GetGeoTransform()
     dem_step_xy = (gt[1], gt[5])
     dem_bbox = (gt[0], gt[3] + (dem_ds.RasterYSize + 1) * gt[5], gt[0] + (dem_ds.RasterXSize + 1) * gt[1], gt[3])
@@ -750,7 +813,8 @@ def _setup_output_paths(dem_name, output_dir, interim_data_dir, mark_empty_resul
         os.makedirs(output_dir)
 
     results_dataframe_file = os.path.join(output_dir,
-                                           os.path.splitext(os.path.basename(dem_name))[0] + "_results.h5")
+                                           os.path.splitext(os.path.basename(dem_name))[0]
+                                           + "_results" + dataframe_io.results_file_ext())
 
     if interim_data_dir is None:
         interim_data_dir = output_dir
@@ -766,15 +830,15 @@ def _setup_output_paths(dem_name, output_dir, interim_data_dir, mark_empty_resul
 
     summary_stats_filename = ""
     if write_summary_stats:
-        summary_stats_filename = re.sub(r"_results\.h5\Z", "_summary_stats.txt", results_dataframe_file)
+        summary_stats_filename = re.sub(dataframe_io.RESULTS_SUFFIX_REGEX, "_summary_stats.txt", results_dataframe_file)
 
     result_tif_filename = ""
     if write_result_tifs:
-        result_tif_filename = re.sub(r"_results\.h5\Z", "_ICESat2_error_raster.tif", results_dataframe_file)
+        result_tif_filename = re.sub(dataframe_io.RESULTS_SUFFIX_REGEX, "_ICESat2_error_raster.tif", results_dataframe_file)
 
     plot_filename = ""
     if plot_results:
-        plot_filename = re.sub(r"_results\.h5\Z", "_plot.png", results_dataframe_file)
+        plot_filename = re.sub(dataframe_io.RESULTS_SUFFIX_REGEX, "_plot.png", results_dataframe_file)
 
     return (output_dir, interim_data_dir, results_dataframe_file,
             empty_results_filename, summary_stats_filename, result_tif_filename, plot_filename)
@@ -795,7 +859,7 @@ def _check_existing_outputs(dem_name, results_dataframe_file, empty_results_file
 
     if overwrite:
         for fn in (results_dataframe_file, summary_stats_filename,
-                   result_tif_filename, plot_filename):
+                   result_tif_filename, plot_filename, summary_sketch.sketch_filename(results_dataframe_file)):
             if fn and os.path.exists(fn):
                 os.remove(fn)
         for fn in _error_export_filenames(results_dataframe_file, export_error_formats):
@@ -810,8 +874,7 @@ def _check_existing_outputs(dem_name, results_dataframe_file, empty_results_file
         # the raw photon data. If they're missing, signal the caller to run the full pipeline.
         photon_results_file = ""
         if include_photon_level_validation:
-            base, ext = os.path.splitext(results_dataframe_file)
-            photon_results_file = base.replace("_results", "_photons") + ext
+            photon_results_file = _photon_results_filename(results_dataframe_file)
             if not os.path.exists(photon_results_file):
                 return None
 
@@ -900,12 +963,12 @@ def _fetch_photons(dem_name, band_num, dem_vertical_datum, icesat2_photon_databa
                     min_confidence_level: int = 1, min_bathy_confidence: float = 0.75):
     """Open the DEM and query overlapping ICESat-2 photons.
 
-    Returns (dem_ds, dem_array, photon_df, dem_epsg_str) or None if no photons found.
-    """
-    get_dem_dataset_and_vars(dem_name)  # result unused; preserved for validation side-effects
+    The DEM band itself is not read here; only the blocks overlapping photons are read later, in
+    _compute_photon_overlap().
 
+    Returns (dem_ds, photon_df, dem_epsg_str, photon_src_epsg) or None if no photons found.
+    """
     dem_ds = gdal.Open(dem_name, gdal.GA_ReadOnly)
-    dem_array = dem_ds.GetRasterBand(band_num).ReadAsArray()
 
     dem_horz_ref_frame, dem_vert_ref_frame = dem_geom.get_dem_reference_frame_from_file(dem_name)
     if dem_vertical_datum is not None:
@@ -921,12 +984,13 @@ def _fetch_photons(dem_name, band_num, dem_vertical_datum, icesat2_photon_databa
                    dem_wgs84_bbox[2], dem_wgs84_bbox[3],
                    date_min, date_max)
 
-    photon_df = icesat2_photon_database_obj.query_photons(
-        dem_3d_bbox,
-        photon_classes=classes,
-        omit_bboxes=omit_bboxes if omit_bboxes is not None else [],
-        min_confidence_level=min_confidence_level,
-        min_bathy_confidence=min_bathy_confidence)
+    with stage_timings.stage("query_photons"):
+        photon_df = icesat2_photon_database_obj.query_photons(
+            dem_3d_bbox,
+            photon_classes=classes,
+            omit_bboxes=omit_bboxes if omit_bboxes is not None else [],
+            min_confidence_level=min_confidence_level,
+            min_bathy_confidence=min_bathy_confidence)
 
     if photon_df is None or len(photon_df) == 0:
         return None
@@ -935,25 +999,147 @@ def _fetch_photons(dem_name, band_num, dem_vertical_datum, icesat2_photon_databa
         print("{0:,}".format(len(photon_df)), "ICESat-2 photons present in photon dataframe.")
 
     photon_src_epsg = icesat2_photon_database_obj.get_photon_src_epsg()
-    return dem_ds, dem_array, photon_df, dem_epsg_str, photon_src_epsg
+    return dem_ds, photon_df, dem_epsg_str, photon_src_epsg
+
 
+def _blocked_dem_overlap(dem_band, dem_ndv, ph_i, ph_j) -> tuple:
+    """Find the valid DEM cells containing photons, reading only the DEM blocks that contain photons.
 
-def _compute_photon_overlap(dem_ds, dem_array, photon_df, classes, dem_epsg_str,
+    Photons are grouped by the GDAL block of the DEM band they fall in. Each block-aligned window is read once, and the
+    photon-occupied and valid-data masks are built for that block only, so neither the full DEM nor any full-size
+    mask is ever held in memory.
+
+    Returns (dem_overlap_i, dem_overlap_j, dem_overlap_elevs, num_blocks_read), in row-major (i, j) order.
+    """
+    xsize, ysize = dem_band.XSize, dem_band.YSize
+    block_xsize, block_ysize = dem_band.GetBlockSize()
+    num_blocks_x = int(numpy.ceil(xsize / block_xsize))
+
+    ph_i = numpy.asarray(ph_i)
+    ph_j = numpy.asarray(ph_j)
+    block_keys = (ph_i // block_ysize) * num_blocks_x + (ph_j // block_xsize)
+    sort_order = numpy.argsort(block_keys, kind="stable")
+    block_keys = block_keys[sort_order]
+    unique_blocks, block_starts = numpy.unique(block_keys, return_index=True)
+    block_ends = numpy.append(block_starts[1:], len(block_keys))
+
+    overlap_i_list = []
+    overlap_j_list = []
+    overlap_elevs_list = []
+    for block_key, b_start, b_end in zip(unique_blocks, block_starts, block_ends):
+        yoff = int(block_key // num_blocks_x) * block_ysize
+        xoff = int(block_key % num_blocks_x) * block_xsize
+        win_ysize = min(block_ysize, ysize - yoff)
+        win_xsize = min(block_xsize, xsize - xoff)
+        block_array = dem_band.ReadAsArray(xoff, yoff, win_xsize, win_ysize)
+
+        block_photon_idx = sort_order[b_start:b_end]
+        block_mask_w_photons = numpy.zeros(block_array.shape, dtype=bool)
+        block_mask_w_photons[ph_i[block_photon_idx] - yoff, ph_j[block_photon_idx] - xoff] = True
+
+        if numpy.isnan(dem_ndv):
+            block_overlap_mask = block_mask_w_photons & ~numpy.isnan(block_array)
+        else:
+            block_overlap_mask = block_mask_w_photons & (block_array != dem_ndv)
+
+        block_i, block_j = numpy.where(block_overlap_mask)
+        overlap_i_list.append(block_i + yoff)
+        overlap_j_list.append(block_j + xoff)
+        overlap_elevs_list.append(block_array[block_overlap_mask])
+
+    if len(overlap_i_list) == 0:
+        return numpy.array([], dtype=int), numpy.array([], dtype=int), numpy.array([]), 0
+
+    dem_overlap_i = numpy.concatenate(overlap_i_list)
+    dem_overlap_j = numpy.concatenate(overlap_j_list)
+    dem_overlap_elevs = numpy.concatenate(overlap_elevs_list)
+
+    # Put the cells back in row-major order, as they'd come out of numpy.where() on the full grid.
+    row_major = numpy.lexsort((dem_overlap_j, dem_overlap_i))
+    return dem_overlap_i[row_major], dem_overlap_j[row_major], dem_overlap_elevs[row_major], len(unique_blocks)
+
+
+def _sparse_dem_overlap(dem_raster: raster_access.RasterArray, dem_ndv, ph_i, ph_j) -> tuple:
+    """Find the valid DEM cells containing photons, sampling the DEM only at the photon-occupied cells.
+
+    The photons are first reduced to their unique occupied (i, j) cells, and DEM values are fetched for just those
+    cells, either straight from a memory-mapped DEM or from the blocks containing them. Memory scales with the number of
+    photon-occupied cells rather than with the DEM area.
+
+    Returns (dem_overlap_i, dem_overlap_j, dem_overlap_elevs), in row-major (i, j) order.
+    """
+    xsize = dem_raster.shape[1]
+    cell_keys = numpy.unique(numpy.asarray(ph_i, dtype=numpy.int64) * xsize + numpy.asarray(ph_j, dtype=numpy.int64))
+    cell_i, cell_j = numpy.divmod(cell_keys, xsize)
+
+    cell_elevs = dem_raster.sample(cell_i, cell_j)
+
+    if numpy.isnan(dem_ndv):
+        good_mask = ~numpy.isnan(cell_elevs)
+    else:
+        good_mask = (cell_elevs != dem_ndv)
+
+    return cell_i[good_mask], cell_j[good_mask], cell_elevs[good_mask]
+
+
+def compute_cell_coverage(photon_x, photon_y, photon_i, photon_j, geotransform, dem_xsize,
+                          cell_i, cell_j, num_subdivisions: int = 15) -> numpy.ndarray:
+    """Compute the fraction of each DEM cell covered by ICESat-2 photons, for all cells at once.
+
+    Each cell is divided into a num_subdivisions x num_subdivisions grid of sub-cells, and coverage is the fraction of
+    those sub-cells containing at least one photon. Every photon gets a global (cell, sub-cell) key computed from its
+    DEM-projected x/y and the DEM geotransform, and the distinct keys are counted per cell with a single numpy.unique().
+
+    Returns an array of coverage fractions, aligned with (cell_i, cell_j).
+    """
+    xstart, xstep, _, ystart, _, ystep = geotransform
+    n = num_subdivisions
+    photon_i = numpy.asarray(photon_i, dtype=numpy.int64)
+    photon_j = numpy.asarray(photon_j, dtype=numpy.int64)
+
+    # Sub-cell row/column within each photon's DEM cell. (The y-values start at the top and step downward.)
+    # Clip to guard against photons landing a hair outside their cell from floating-point rounding.
+    sub_i = numpy.clip(numpy.floor((numpy.asarray(photon_y) - ystart) * n / ystep).astype(numpy.int64)
+                       - (photon_i * n), 0, n - 1)
+    sub_j = numpy.clip(numpy.floor((numpy.asarray(photon_x) - xstart) * n / xstep).astype(numpy.int64)
+                       - (photon_j * n), 0, n - 1)
+
+    photon_cell_keys = (photon_i * dem_xsize) + photon_j
+    distinct_keys = numpy.unique((photon_cell_keys * (n * n)) + (sub_i * n) + sub_j)
+    covered_cell_keys, num_subcells_covered = numpy.unique(distinct_keys // (n * n), return_counts=True)
+
+    cell_keys = (numpy.asarray(cell_i, dtype=numpy.int64) * dem_xsize) + numpy.asarray(cell_j, dtype=numpy.int64)
+    coverage_frac = numpy.zeros(len(cell_keys), dtype=float)
+    if len(covered_cell_keys) > 0:
+        idx = numpy.clip(numpy.searchsorted(covered_cell_keys, cell_keys), 0, len(covered_cell_keys) - 1)
+        found = covered_cell_keys[idx] == cell_keys
+        coverage_frac[found] = num_subcells_covered[idx[found]] / (n * n)
+
+    return coverage_frac
+
+
+def _compute_photon_overlap(dem_ds, photon_df, classes, dem_epsg_str,
                               measure_coverage, verbose,
                               photon_src_epsg="EPSG:4326+4979", cache_dir=None,
-                              user_ndv=None):
+                              user_ndv=None, band_num=1, overlap_mode=None):
     """Transform photon coordinates into DEM space and compute cell-level overlap.
 
+    The DEM is never read in full. 'overlap_mode' (default: the 'dem_overlap_mode' config setting) is one of:
+        "sparse": sample DEM values only at the unique photon-occupied cells (see _sparse_dem_overlap()).
+        "blocked": read the DEM blocks containing photons and mask them block-by-block (see _blocked_dem_overlap()).
+
     Returns (photon_df, height_field, ph_mask_ground_only, dem_overlap_i, dem_overlap_j,
-             dem_overlap_elevs, N, coverage_coords) or None if no valid overlap exists.
-    coverage_coords is (xmin_arr, xmax_arr, ymin_arr, ymax_arr) when measure_coverage=True, else None.
+             dem_overlap_elevs, N, coverage_frac) or None if no valid overlap exists.
+    coverage_frac is the per-cell photon coverage fraction (see compute_cell_coverage()) when measure_coverage=True,
+    else None.
     """
     try:
-        photon_df["dem_x"], photon_df["dem_y"], photon_df["dem_z"] = \
-            transform_points.transform_points(photon_df['x'], photon_df['y'], photon_df['z'],
-                                              src_epsg=photon_src_epsg,
-                                              dst_epsg=dem_epsg_str,
-                                              cache_dir=cache_dir)
+        with stage_timings.stage("transform_points"):
+            photon_df["dem_x"], photon_df["dem_y"], photon_df["dem_z"] = \
+                transform_points.transform_points(photon_df['x'], photon_df['y'], photon_df['z'],
+                                                  src_epsg=photon_src_epsg,
+                                                  dst_epsg=dem_epsg_str,
+                                                  cache_dir=cache_dir)
     except (ValueError, RuntimeError) as e:
         print("Warning: Unable to perform transformation. Using original points.")
         raise e
@@ -962,168 +1148,236 @@ def _compute_photon_overlap(dem_ds, dem_array, photon_df, classes, dem_epsg_str,
     photon_df["i"] = numpy.floor((photon_df["dem_y"] - ystart) / ystep).astype(int)
     photon_df["j"] = numpy.floor((photon_df["dem_x"] - xstart) / xstep).astype(int)
 
-    photon_df = photon_df[(photon_df["i"] >= 0) & (photon_df["i"] < dem_array.shape[0]) &
-                          (photon_df["j"] >= 0) & (photon_df["j"] < dem_array.shape[1])]
+    photon_df = photon_df[(photon_df["i"] >= 0) & (photon_df["i"] < dem_ds.RasterYSize) &
+                          (photon_df["j"] >= 0) & (photon_df["j"] < dem_ds.RasterXSize)]
     height_field = photon_df["dem_z"]
 
+    dem_band = dem_ds.GetRasterBand(band_num)
+
     # NDV priority: (1) user_ndv flag, (2) file header, (3) config default
     if user_ndv is not None:
         dem_ndv = user_ndv
     else:
-        dem_ndv = dem_ds.GetRasterBand(1).GetNoDataValue()
+        dem_ndv = dem_band.GetNoDataValue()
         if dem_ndv is None:
             dem_ndv = EMPTY_VAL
 
-    if numpy.isnan(dem_ndv):
-        dem_goodpixel_mask = ~numpy.isnan(dem_array)
-    else:
-        dem_goodpixel_mask = (dem_array != dem_ndv)
-
     photon_df = photon_df.set_index(["i", "j"], drop=False)
     ph_mask_ground_only = numpy.isin(photon_df["class_code"], classes)
-    dem_mask_w_ground_photons = numpy.zeros(dem_array.shape, dtype=bool)
-    dem_mask_w_ground_photons[photon_df.i[ph_mask_ground_only],
-                               photon_df.j[ph_mask_ground_only]] = 1
 
-    dem_overlap_mask = dem_goodpixel_mask & dem_mask_w_ground_photons
-    dem_overlap_i, dem_overlap_j = numpy.where(dem_overlap_mask)
-    dem_overlap_elevs = dem_array[dem_overlap_mask]
+    if overlap_mode is None:
+        overlap_mode = ivert_config.dem_overlap_mode
+    overlap_mode = str(overlap_mode).strip().lower()
+
+    ground_i = photon_df.i.to_numpy()[ph_mask_ground_only]
+    ground_j = photon_df.j.to_numpy()[ph_mask_ground_only]
+    with stage_timings.stage("dem_overlap_" + overlap_mode):
+        if overlap_mode == "sparse":
+            dem_raster = raster_access.RasterArray(dem_ds, band_num=band_num)
+            dem_overlap_i, dem_overlap_j, dem_overlap_elevs = \
+                _sparse_dem_overlap(dem_raster, dem_ndv, ground_i, ground_j)
+            if verbose and dem_raster.is_memory_mapped:
+                print("Sampled DEM cells through a memory-mapped DEM.")
+            dem_raster.close()
+        elif overlap_mode == "blocked":
+            dem_overlap_i, dem_overlap_j, dem_overlap_elevs, num_blocks_read = \
+                _blocked_dem_overlap(dem_band, dem_ndv, ground_i, ground_j)
+            if verbose:
+                print("Read {0:,} DEM blocks containing ICESat-2 photons.".format(num_blocks_read))
+        else:
+            raise ValueError(f"Unknown DEM overlap mode '{overlap_mode}'. Use 'sparse' or 'blocked'.")
 
     if verbose:
-        num_goodpixels = numpy.count_nonzero(dem_goodpixel_mask)
-        print("{:,}".format(num_goodpixels), "land cells exist in the DEM.")
-        if num_goodpixels == 0:
-            print("No land cells found in DEM with overlapping ICESat-2 data. Stopping and moving on.")
-            return None
         print("{:,} ICESat-2 photons overlap".format(len(photon_df)),
               "{:,}".format(len(dem_overlap_i)),
-              "DEM cells ({:0.2f}% of total DEM data).".format(
-                  numpy.count_nonzero(dem_overlap_mask) * 100 / num_goodpixels))
+              "valid DEM cells ({:0.2f}% of total DEM cells).".format(
+                  len(dem_overlap_i) * 100 / (dem_ds.RasterXSize * dem_ds.RasterYSize)))
 
-    if numpy.count_nonzero(dem_overlap_mask) == 0:
+    if len(dem_overlap_i) == 0:
         if verbose:
             print("No overlapping ICESat-2 data with valid land cells. Stopping and moving on.")
         return None
 
     N = len(dem_overlap_i)
-    coverage_coords = None
+    coverage_frac = None
     if measure_coverage:
-        xmin_arr = xstart + (xstep * dem_overlap_j)
-        xmax_arr = xmin_arr + xstep
-        ymax_arr = ystart + (ystep * dem_overlap_i)
-        ymin_arr = ymax_arr + ystep
-        coverage_coords = (xmin_arr, xmax_arr, ymin_arr, ymax_arr)
+        with stage_timings.stage("cell_coverage"):
+            coverage_frac = compute_cell_coverage(photon_df["dem_x"].to_numpy(), photon_df["dem_y"].to_numpy(),
+                                                  photon_df["i"].to_numpy(), photon_df["j"].to_numpy(),
+                                                  dem_ds.GetGeoTransform(), dem_ds.RasterXSize,
+                                                  dem_overlap_i, dem_overlap_j)
 
     return (photon_df, height_field, ph_mask_ground_only, dem_overlap_i, dem_overlap_j,
-            dem_overlap_elevs, N, coverage_coords)
+            dem_overlap_elevs, N, coverage_frac)
+
+
+def _stage_timings_filename(results_dataframe_file: str) -> str:
+    """Return the stage timings file name (see utils/stage_timings.py) that goes with a '_results' dataframe file."""
+    return re.sub(dataframe_io.RESULTS_SUFFIX_REGEX, "_stage_timings.json", results_dataframe_file)
+
+
+def _photon_results_filename(results_dataframe_file: str) -> str:
+    """Return the photon-level results file name that goes with a '_results' dataframe file."""
+    base = os.path.splitext(results_dataframe_file)[0]
+    return base.replace("_results", "_photons") + ".parquet"
 
 
 def _run_photon_level_validation(photon_df, height_field, ph_mask_ground_only,
                                   dem_overlap_i, dem_overlap_j, dem_overlap_elevs,
-                                  results_dataframe_file, verbose):
-    """Compute photon-level DEM minus ICESat-2 differences and write an HDF5 results file.
+                                  results_dataframe_file, verbose, chunk_size=None):
+    """Compute photon-level DEM minus ICESat-2 differences and stream them to a Parquet results file.
+
+    Each ground photon's DEM elevation is looked up directly from the (sorted) overlap cell keys, rather than joining
+    dataframes. Photons are processed and written 'chunk_size' at a time (default: the 'photon_results_chunk_size'
+    config setting), so peak memory is that of a single chunk. Photons in cells without a valid DEM elevation are
+    dropped.
 
     Returns the photon results file path.
     """
+    if chunk_size is None:
+        chunk_size = int(ivert_config.photon_results_chunk_size)
+
+    photon_results_dataframe_file = _photon_results_filename(results_dataframe_file)
     if verbose:
         print("Performing photon-level validation...")
-        print("\tSubsetting ground-only photons... ", end="")
-    photon_df_ground_only = photon_df[ph_mask_ground_only]
-    if verbose:
-        print("Done.")
-        print("\tGenerating DEM elevation dataframe... ", end="")
+        print("\tWriting", os.path.split(photon_results_dataframe_file)[1] + "... ", end="")
 
-    dem_elev_df = pandas.DataFrame(
-        {"dem_elevation": dem_overlap_elevs},
-        index=pandas.MultiIndex.from_arrays((dem_overlap_i, dem_overlap_j), names=("i", "j")))
-    if verbose:
-        print("Done with {0} records.".format(len(dem_elev_df)))
-        print("\tJoining photon_df and DEM elevation tables... ", end="")
+    # Sort the DEM cells once by cell key, to look up each photon's cell with a binary search.
+    cell_keys = results_table.ResultsTable.make_cell_key(dem_overlap_i, dem_overlap_j)
+    cell_order = numpy.argsort(cell_keys, kind="stable")
+    cell_keys = cell_keys[cell_order]
+    cell_elevs = numpy.asarray(dem_overlap_elevs)[cell_order]
 
-    photon_df_with_dem_elevs = photon_df_ground_only.join(dem_elev_df, how='left')
-    photon_df_with_dem_elevs = photon_df_with_dem_elevs[
-        pandas.notna(photon_df_with_dem_elevs["dem_elevation"])]
-    if verbose:
-        print("Done with {0} records.".format(len(photon_df_with_dem_elevs)))
-        print("\tCalculating elevation differences... ", end="")
+    ground_idx = numpy.flatnonzero(ph_mask_ground_only)
+    photon_i = photon_df["i"].to_numpy()
+    photon_j = photon_df["j"].to_numpy()
+    heights = numpy.asarray(height_field)
 
-    photon_df_with_dem_elevs["dem_minus_is2_m"] = \
-        photon_df_with_dem_elevs["dem_elevation"] - height_field
-    if verbose:
-        print("Done.")
+    writer = None
+    num_written = 0
+    try:
+        for c_start in range(0, len(ground_idx), chunk_size):
+            chunk_idx = ground_idx[c_start:c_start + chunk_size]
+            photon_keys = results_table.ResultsTable.make_cell_key(photon_i[chunk_idx], photon_j[chunk_idx])
+            pos = numpy.clip(numpy.searchsorted(cell_keys, photon_keys), 0, max(len(cell_keys) - 1, 0))
+            found = cell_keys[pos] == photon_keys
+            chunk_idx = chunk_idx[found]
+            if len(chunk_idx) == 0:
+                continue
+
+            chunk_df = photon_df.iloc[chunk_idx].reset_index(drop=True)
+            chunk_df["dem_elevation"] = cell_elevs[pos[found]]
+            chunk_df["dem_minus_is2_m"] = chunk_df["dem_elevation"].to_numpy() - heights[chunk_idx]
+
+            chunk_table = pyarrow.Table.from_pandas(chunk_df, preserve_index=False)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(photon_results_dataframe_file, chunk_table.schema,
+                                                       compression="zstd")
+            writer.write_table(chunk_table)
+            num_written += len(chunk_df)
+            del chunk_df, chunk_table
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        # No photons in valid DEM cells. Write an empty file with the output columns, so the file exists for the caller.
+        empty_df = photon_df.iloc[:0].reset_index(drop=True)
+        empty_df["dem_elevation"] = numpy.array([], dtype=cell_elevs.dtype)
+        empty_df["dem_minus_is2_m"] = numpy.array([], dtype=float)
+        empty_df.to_parquet(photon_results_dataframe_file, index=False)
 
-    base, ext = os.path.splitext(results_dataframe_file)
-    photon_results_dataframe_file = base.replace("_results", "_photons") + ext
     if verbose:
-        print("\tWriting", os.path.split(photon_results_dataframe_file)[1] + "... ", end="")
-    photon_df_with_dem_elevs.to_hdf(photon_results_dataframe_file, "icesat2", complib="zlib", complevel=3)
-    if verbose:
-        print("Done.\n")
+        print("Done with {0:,} records.\n".format(num_written))
 
     return photon_results_dataframe_file
 
 
+def subsample_photons_per_cell(photon_i, photon_j, max_photons_per_cell: int, seed: int | None = None) -> numpy.ndarray:
+    """Select at most max_photons_per_cell photons from each (i, j) grid cell, in one vectorized pass.
+
+    Every photon gets a random key from a generator seeded with 'seed'. Photons are sorted by (cell, random key), and the
+    first max_photons_per_cell photons in each cell are kept. The same seed always selects the same photons, so reruns
+    are reproducible. If seed is None, a different selection is made on each run.
+
+    Returns a boolean mask of the photons to keep.
+    """
+    assert max_photons_per_cell >= 2
+    photon_i = numpy.asarray(photon_i)
+    photon_j = numpy.asarray(photon_j)
+    num_photons = len(photon_i)
+
+    random_keys = numpy.random.default_rng(seed).random(num_photons)
+    order = numpy.lexsort((random_keys, photon_j, photon_i))
+    sorted_i = photon_i[order]
+    sorted_j = photon_j[order]
+
+    # Rank of each photon within its cell, in random-key order.
+    new_cell = numpy.ones(num_photons, dtype=bool)
+    new_cell[1:] = (sorted_i[1:] != sorted_i[:-1]) | (sorted_j[1:] != sorted_j[:-1])
+    cell_starts = numpy.flatnonzero(new_cell)
+    cell_sizes = numpy.diff(numpy.append(cell_starts, num_photons))
+    rank_in_cell = numpy.arange(num_photons) - numpy.repeat(cell_starts, cell_sizes)
+
+    keep_mask = numpy.zeros(num_photons, dtype=bool)
+    keep_mask[order[rank_in_cell < max_photons_per_cell]] = True
+    return keep_mask
+
+
 def _run_parallel_cell_validation(photon_df, height_field, dem_overlap_i, dem_overlap_j,
                                    dem_overlap_elevs, N, max_photons_per_cell,
-                                   measure_coverage, coverage_coords, numprocs, verbose):
+                                   coverage_frac, numprocs, verbose, subsample_seed=None):
     """Run the parallel ICESat-2/DEM cell validation using child processes.
 
-    Returns a list of per-chunk result DataFrames (possibly empty on error or no data).
+    The workers write their outputs into a shared per-cell results table, and only send (start, end) completion
+    messages back over the pipes. Returns a results_table.ResultsTable built once from that table. Cells that were never
+    processed (on error) are left empty, and discarded when the outputs are written. Returns None if there are no cells
+    to validate.
+
+    If max_photons_per_cell is set, at most that many photons per cell are used, selected reproducibly by
+    subsample_photons_per_cell() with 'subsample_seed'.
     """
+    if N == 0:
+        return None
+
     if verbose:
         if max_photons_per_cell is not None:
-            print("Limiting processing to {0} photons per grid cell.".format(max_photons_per_cell))
+            print("Limiting processing to {0} photons per grid cell".format(max_photons_per_cell)
+                  + ("." if subsample_seed is None else " (random seed {0}).".format(subsample_seed)))
         print("Performing ICESat-2/DEM cell validation...")
 
-    results_dataframes_list = []
     t_start = time.perf_counter()
 
     cpu_count = numprocs
-    proc_id = os.getpid()
-    height_array_name = f"heights_{proc_id}"
-    i_array_name      = f"i_{proc_id}"
-    j_array_name      = f"j_{proc_id}"
-    code_array_name   = f"codes_{proc_id}"
     assert height_field.shape == photon_df.i.shape == photon_df.j.shape == photon_df.class_code.shape
 
-    height_smo = shared_memory.SharedMemory(size=height_field.nbytes, name=height_array_name, create=True)
-    height_smo.buf[:] = height_field.to_numpy().tobytes()
-    height_dtype = height_field.dtype
-
-    i_smo = shared_memory.SharedMemory(size=photon_df.i.nbytes, name=i_array_name, create=True)
-    i_smo.buf[:] = photon_df.i.to_numpy().tobytes()
-    i_dtype = photon_df.i.dtype
-
-    j_smo = shared_memory.SharedMemory(size=photon_df.j.nbytes, name=j_array_name, create=True)
-    j_smo.buf[:] = photon_df.j.to_numpy().tobytes()
-    j_dtype = photon_df.j.dtype
-
-    code_smo = shared_memory.SharedMemory(size=photon_df.class_code.nbytes, name=code_array_name, create=True)
-    code_smo.buf[:] = photon_df.class_code.to_numpy().tobytes()
-    code_dtype = photon_df.class_code.dtype
-
-    if measure_coverage:
-        assert height_field.shape == photon_df.dem_x.shape == photon_df.dem_y.shape
-        dem_overlap_xmin, dem_overlap_xmax, dem_overlap_ymin, dem_overlap_ymax = coverage_coords
-        x_array_name = f"x_{proc_id}"
-        x_smo = shared_memory.SharedMemory(size=photon_df.dem_x.nbytes, name=x_array_name, create=True)
-        x_smo.buf[:] = photon_df.dem_x.to_numpy().tobytes()
-        x_dtype = photon_df.dem_x.dtype
-
-        y_array_name = f"y_{proc_id}"
-        y_smo = shared_memory.SharedMemory(size=photon_df.dem_y.nbytes, name=y_array_name, create=True)
-        y_smo.buf[:] = photon_df.dem_y.to_numpy().tobytes()
-        y_dtype = photon_df.dem_y.dtype
-    else:
-        dem_overlap_xmin = dem_overlap_xmax = dem_overlap_ymin = dem_overlap_ymax = None
-        x_array_name = y_array_name = None
-        x_smo = y_smo = None
-        x_dtype = y_dtype = None
-
-    if measure_coverage:
-        memory_objs = [height_smo, i_smo, j_smo, code_smo, x_smo, y_smo]
-    else:
-        memory_objs = [height_smo, i_smo, j_smo, code_smo]
+    heights = height_field.to_numpy()
+    photon_i = photon_df.i.to_numpy()
+    photon_j = photon_df.j.to_numpy()
+    ph_codes = photon_df.class_code.to_numpy()
+
+    if max_photons_per_cell is not None:
+        keep_mask = subsample_photons_per_cell(photon_i, photon_j, max_photons_per_cell, seed=subsample_seed)
+        heights, photon_i, photon_j, ph_codes = \
+            heights[keep_mask], photon_i[keep_mask], photon_j[keep_mask], ph_codes[keep_mask]
+
+    arrays = {"heights": heights,
+              "i": photon_i,
+              "j": photon_j,
+              "codes": ph_codes,
+              "cell_i": numpy.asarray(dem_overlap_i),
+              "cell_j": numpy.asarray(dem_overlap_j),
+              "cell_elev": numpy.asarray(dem_overlap_elevs)}
+
+    # Coverage fractions are already computed for every cell, so they go straight into the results table.
+    result_columns = _new_results_table(N, heights.dtype, coverage_frac is not None)
+    if coverage_frac is not None:
+        result_columns["result_coverage_frac"][:] = coverage_frac
+    arrays.update(result_columns)
+
+    transport = _select_photon_transport()
+    array_specs, shared_arrays, memory_objs = _share_arrays(arrays, transport, writable_fields=result_columns.keys())
+    del arrays, result_columns
 
     running_procs     = [None] * cpu_count
     open_pipes_parent = [None] * cpu_count
@@ -1144,29 +1398,11 @@ def _run_parallel_cell_validation(photon_df, height_field, dem_overlap_i, dem_ov
                 break
 
             running_procs[i], open_pipes_parent[i], open_pipes_child[i] = \
-                kick_off_new_child_process(height_array_name, height_dtype,
-                                           i_array_name, i_dtype,
-                                           j_array_name, j_dtype,
-                                           code_array_name, code_dtype,
-                                           height_field.shape,
-                                           photon_limit=max_photons_per_cell,
-                                           measure_coverage=measure_coverage,
-                                           x_array_name=x_array_name, x_dtype=x_dtype,
-                                           y_array_name=y_array_name, y_dtype=y_dtype)
+                kick_off_new_child_process(array_specs,
+                                           transport=transport)
 
             counter_chunk_end = min(counter_started + items_per_process_chunk, N)
-            if measure_coverage:
-                open_pipes_parent[i].send((dem_overlap_i[counter_started:counter_chunk_end],
-                                           dem_overlap_j[counter_started:counter_chunk_end],
-                                           dem_overlap_elevs[counter_started:counter_chunk_end],
-                                           dem_overlap_xmin[counter_started:counter_chunk_end],
-                                           dem_overlap_xmax[counter_started:counter_chunk_end],
-                                           dem_overlap_ymin[counter_started:counter_chunk_end],
-                                           dem_overlap_ymax[counter_started:counter_chunk_end]))
-            else:
-                open_pipes_parent[i].send((dem_overlap_i[counter_started:counter_chunk_end],
-                                           dem_overlap_j[counter_started:counter_chunk_end],
-                                           dem_overlap_elevs[counter_started:counter_chunk_end]))
+            open_pipes_parent[i].send((counter_started, counter_chunk_end))
             counter_started = counter_chunk_end
             num_chunks_started += 1
 
@@ -1178,54 +1414,34 @@ def _run_parallel_cell_validation(photon_df, height_field, dem_overlap_i, dem_ov
                 elif not proc.is_alive():
                     if verbose:
                         print("\nSub-process terminated unexpectedly. Some data may be missing. Restarting a new process.")
+                    metrics.inc("worker_restarts")
                     proc.join()
                     pipe.close()
                     pipe_child.close()
                     proc, pipe, pipe_child = kick_off_new_child_process(
-                        height_array_name, height_dtype,
-                        i_array_name, i_dtype,
-                        j_array_name, j_dtype,
-                        code_array_name, code_dtype,
-                        height_field.shape,
-                        photon_limit=max_photons_per_cell,
-                        measure_coverage=measure_coverage,
-                        x_array_name=x_array_name, x_dtype=x_dtype,
-                        y_array_name=y_array_name, y_dtype=y_dtype)
+                        array_specs,
+                        transport=transport)
                     running_procs[i] = proc
                     open_pipes_parent[i] = pipe
                     open_pipes_child[i] = pipe_child
                     num_chunks_finished += 1
 
                 if pipe.poll():
-                    chunk_result_df = pipe.recv()
-                    counter_finished += len(chunk_result_df)
+                    chunk_start, chunk_end = pipe.recv()
+                    counter_finished += chunk_end - chunk_start
                     num_chunks_finished += 1
-                    results_dataframes_list.append(chunk_result_df)
+                    metrics.inc("cells_validated", chunk_end - chunk_start)
                     if verbose:
                         progress_bar.ProgressBar(counter_finished, N,
                                                  suffix=("{0:>" + str(len(str(N))) + "d}/{1:d}").format(counter_finished, N))
 
                     if counter_started < N:
                         counter_chunk_end = min(counter_started + items_per_process_chunk, N)
-                        if measure_coverage:
-                            pipe.send((dem_overlap_i[counter_started:counter_chunk_end],
-                                       dem_overlap_j[counter_started:counter_chunk_end],
-                                       dem_overlap_elevs[counter_started:counter_chunk_end],
-                                       dem_overlap_xmin[counter_started:counter_chunk_end],
-                                       dem_overlap_xmax[counter_started:counter_chunk_end],
-                                       dem_overlap_ymin[counter_started:counter_chunk_end],
-                                       dem_overlap_ymax[counter_started:counter_chunk_end]))
-                        else:
-                            pipe.send((dem_overlap_i[counter_started:counter_chunk_end],
-                                       dem_overlap_j[counter_started:counter_chunk_end],
-                                       dem_overlap_elevs[counter_started:counter_chunk_end]))
+                        pipe.send((counter_started, counter_chunk_end))
                         counter_started = counter_chunk_end
                         num_chunks_started += 1
                     else:
-                        if measure_coverage:
-                            pipe.send(("STOP", None, None, None, None, None, None))
-                        else:
-                            pipe.send(("STOP", None, None))
+                        pipe.send(("STOP", None))
                         proc.join()
                         pipe.close()
                         pipe_child.close()
@@ -1236,31 +1452,35 @@ def _run_parallel_cell_validation(photon_df, height_field, dem_overlap_i, dem_ov
     except Exception as e:
         if verbose:
             print("\nException encountered in ICESat-2 processing loop. Exiting.")
-        clean_procs_and_pipes(running_procs, open_pipes_parent, open_pipes_child, memory_objs)
+        clean_procs_and_pipes(running_procs, open_pipes_parent, open_pipes_child, [])
         print(e)
-        return results_dataframes_list
 
-    t_end = time.perf_counter()
-    if verbose:
-        total_time_s = t_end - t_start
-        if total_time_s >= 100:
-            total_time_m = int(total_time_s / 60)
-            partial_time_s = total_time_s % 60
-            print("{0:d} minute".format(total_time_m) + ("s" if total_time_m > 1 else "")
-                  + " {0:0.1f} seconds total, ({1:0.4f} s/iteration)".format(
-                      partial_time_s, (total_time_s / N) if N > 0 else 0))
-        else:
-            print("{0:0.1f} seconds total, ({1:0.4f} s/iteration)".format(
-                total_time_s, (total_time_s / N) if N > 0 else 0))
+    else:
+        metrics.inc("photons_validated", len(heights))
+        t_end = time.perf_counter()
+        if verbose:
+            total_time_s = t_end - t_start
+            if total_time_s >= 100:
+                total_time_m = int(total_time_s / 60)
+                partial_time_s = total_time_s % 60
+                print("{0:d} minute".format(total_time_m) + ("s" if total_time_m > 1 else "")
+                      + " {0:0.1f} seconds total, ({1:0.4f} s/iteration)".format(
+                          partial_time_s, (total_time_s / N) if N > 0 else 0))
+            else:
+                print("{0:0.1f} seconds total, ({1:0.4f} s/iteration)".format(
+                    total_time_s, (total_time_s / N) if N > 0 else 0))
 
+    # Copy the results out of the shared table, then release the shared buffers.
+    results = _results_table_from_shared(shared_arrays, dem_overlap_i, dem_overlap_j)
+    shared_arrays = None
     clean_procs_and_pipes(running_procs, open_pipes_parent, open_pipes_child, memory_objs)
-    return results_dataframes_list
+    return results
 
 
-def filter_misclassified_photons(results_dataframe: pandas.DataFrame,
+def filter_misclassified_photons(results_dataframe: pandas.DataFrame | results_table.ResultsTable,
                                  mask_array: numpy.ndarray,
                                  error_threshold_m: float,
-                                 verbose: bool = True) -> tuple[pandas.DataFrame, int]:
+                                 verbose: bool = True) -> tuple[pandas.DataFrame | results_table.ResultsTable, int]:
     """Discard DEM cells whose errors are likely driven by mis-classified ICESat-2 photons.
 
     Uses a DEM-aligned coastline mask (land=1, water=0) to classify each results cell as
@@ -1273,8 +1493,8 @@ def filter_misclassified_photons(results_dataframe: pandas.DataFrame,
     Legitimate onshore ground errors (large errors with no bathy photons on land) are KEPT.
 
     Args:
-        results_dataframe: Per-cell results, MultiIndexed by (i, j). Must contain the
-            'diff_mean', 'numphotons_bathy', and 'numphotons' columns.
+        results_dataframe: Per-cell results, as a ResultsTable or a dataframe MultiIndexed by (i, j).
+            Must contain the 'diff_mean', 'numphotons_bathy', and 'numphotons' columns.
         mask_array: Coastline mask aligned to the DEM grid (coastline_mask.MASK_LAND / WATER).
         error_threshold_m: Absolute-error threshold (meters) above which a matching cell is dropped.
         verbose: Print a diagnostic message.
@@ -1282,12 +1502,12 @@ def filter_misclassified_photons(results_dataframe: pandas.DataFrame,
     Returns:
         (filtered_dataframe, n_photons_discarded), where n_photons_discarded is the number of
         photons in the discarded cells (reported to the user, while the unit dropped is the cell).
+        A ResultsTable is filtered in place (via its keep-mask) and returned; a dataframe is copied.
     """
     if len(results_dataframe) == 0:
         return results_dataframe, 0
 
-    i_idx = results_dataframe.index.get_level_values("i").to_numpy()
-    j_idx = results_dataframe.index.get_level_values("j").to_numpy()
+    i_idx, j_idx = _results_ij(results_dataframe)
 
     # Guard against any indices outside the mask (shouldn't happen, but stay safe).
     in_bounds = ((i_idx >= 0) & (i_idx < mask_array.shape[0]) &
@@ -1299,74 +1519,76 @@ def filter_misclassified_photons(results_dataframe: pandas.DataFrame,
     offshore = cell_mask_vals == coastline_mask.MASK_WATER
     # Cells over MASK_NODATA (unknown) are neither -> never auto-discarded.
 
-    err = results_dataframe["diff_mean"].abs().to_numpy()
-    has_bathy = results_dataframe["numphotons_bathy"].to_numpy() > 0
+    err = numpy.abs(numpy.asarray(results_dataframe["diff_mean"]))
+    has_bathy = numpy.asarray(results_dataframe["numphotons_bathy"]) > 0
 
     discard = (err > error_threshold_m) & (offshore | (onshore & has_bathy))
 
-    n_photons_discarded = int(results_dataframe.loc[discard, "numphotons"].sum())
+    n_photons_discarded = int(numpy.asarray(results_dataframe["numphotons"])[discard].sum())
 
     if verbose and discard.any():
         print("{0:,} DEM cells flagged as likely-misclassified and removed.".format(
             int(discard.sum())))
 
+    if isinstance(results_dataframe, results_table.ResultsTable):
+        return results_dataframe.filter(~discard), n_photons_discarded
+
     return results_dataframe[~discard].copy(), n_photons_discarded
 
 
-def _write_validation_outputs(results_dataframes_list, dem_ds, dem_name,
+def _write_validation_outputs(results, dem_ds, dem_name,
                                results_dataframe_file, empty_results_filename,
                                summary_stats_filename, result_tif_filename, plot_filename,
                                write_summary_stats, write_result_tifs, plot_results,
                                location_name, outliers_sd_threshold, mark_empty_results,
                                shared_ret_values, verbose, files_to_export,
-                               filter_misclassified=True, export_error_formats=None):
-    """Concatenate results, filter outliers and misclassified photons, and write all output files.
+                               filter_misclassified=True, export_error_formats=None, defer_outputs=False):
+    """Filter empty cells, outliers and misclassified photons from the results, and write all output files.
+
+    'results' is a results_table.ResultsTable. The filters are composed into its keep-mask, and the filtered results
+    are materialized once before writing.
+
+    The results file (and its summary sketch) are always written here. If defer_outputs is set, the other outputs
+    aren't rendered: their job is put in shared_ret_values[DEFERRED_OUTPUT_JOB_KEY] instead, to be rendered later by
+    render_validation_outputs().
 
     Returns the final files_to_export list.
     """
-    if len(results_dataframes_list) == 0:
+    if results is None or len(results) == 0:
         return files_to_export
 
-    results_dataframe = pandas.concat(results_dataframes_list)
-    results_dataframe = results_dataframe[
-        (results_dataframe["mean"] != EMPTY_VAL)
-        & (~numpy.isnan(results_dataframe["mean"]))
-        & (results_dataframe["numphotons_intd"] >= 3)].copy()
+    results.filter_empty(EMPTY_VAL)
 
     if verbose:
         print("{0:,} valid interdecile photon records in {1:,} DEM cells.".format(
-            results_dataframe["numphotons_intd"].sum(), len(results_dataframe)))
+            results["numphotons_intd"].sum(), len(results)))
 
     if outliers_sd_threshold is not None:
         assert type(outliers_sd_threshold) in (int, float)
-        diff_mean = results_dataframe["diff_mean"]
-        meanval, stdval = diff_mean.mean(), diff_mean.std()
-        low_cutoff = meanval - (stdval * outliers_sd_threshold)
-        hi_cutoff  = meanval + (stdval * outliers_sd_threshold)
-        results_dataframe = results_dataframe[
-            (diff_mean >= low_cutoff) & (diff_mean <= hi_cutoff)].copy()
+        results.filter_outliers(outliers_sd_threshold)
         if verbose:
-            print("{0:,} DEM cells after removing outliers.".format(len(results_dataframe)))
+            print("{0:,} DEM cells after removing outliers.".format(len(results)))
 
     # Discard cells whose large errors are likely driven by mis-classified ICESat-2 photons
     # (e.g. false offshore 'bathy_floor'/'ground', or onshore 'bathy_floor'), using a
     # coastline mask to classify each cell as onshore or offshore.
-    if filter_misclassified and len(results_dataframe) > 0:
+    if filter_misclassified and len(results) > 0:
         # Write the mask alongside the other results (in output_dir), not next to the source DEM.
         mask_output_fname = os.path.join(
             os.path.dirname(results_dataframe_file),
             os.path.splitext(os.path.basename(dem_name))[0] + "_coastline_mask.tif")
-        mask_fname = coastline_mask.get_or_create_coastline_mask(
-            dem_name, output_fname=mask_output_fname, verbose=verbose)
+        with stage_timings.stage("coastline_mask"):
+            mask_fname = coastline_mask.get_or_create_coastline_mask(
+                dem_name, output_fname=mask_output_fname, verbose=verbose)
+            mask_array = coastline_mask.load_coastline_mask_array(mask_fname) if mask_fname is not None else None
         if mask_fname is not None:
-            mask_array = coastline_mask.load_coastline_mask_array(mask_fname)
-            results_dataframe, n_photons_discarded = filter_misclassified_photons(
-                results_dataframe, mask_array,
+            results, n_photons_discarded = filter_misclassified_photons(
+                results, mask_array,
                 ivert_config.icesat2_misclassification_error_threshold_m, verbose=verbose)
         elif verbose:
             print("Coastline mask unavailable; skipping misclassification filter.")
 
-    if len(results_dataframe) == 0:
+    if len(results) == 0:
         if verbose:
             print("No valid results in results dataframe. No outputs computed.")
         if mark_empty_results:
@@ -1378,53 +1600,118 @@ def _write_validation_outputs(results_dataframes_list, dem_ds, dem_name,
             shared_ret_values["empty_results_filename"] = empty_results_filename
         return files_to_export
 
-    base, ext = os.path.splitext(results_dataframe_file)
-    ext = ext.lower().strip()
-    if ext in (".txt", ".csv"):
-        results_dataframe.to_csv(results_dataframe_file)
-    else:
-        results_dataframe.to_hdf(results_dataframe_file, key="icesat2", complib="zlib", mode='w')
+    results = results.materialize()
+    results_dataframe = results.to_dataframe()
+
+    with stage_timings.stage("write_results_file"):
+        dataframe_io.write_dataframe_file(results_dataframe, results_dataframe_file)
     if verbose:
         print(results_dataframe_file, "written.")
     files_to_export.append(results_dataframe_file)
     shared_ret_values["results_dataframe_file"] = results_dataframe_file
 
+    # A small, mergeable summary of these results, for building collection summaries without re-reading every cell.
+    with stage_timings.stage("write_summary_sketch"):
+        summary_sketch.SummarySketch.from_dataframe(results_dataframe).write(
+            summary_sketch.sketch_filename(results_dataframe_file))
+
+    if export_error_formats is None:
+        export_error_formats = ivert_config.export_error_formats
+    if location_name is None:
+        location_name = os.path.split(dem_name)[1]
+
+    # Everything else is rendered from the results: all in one job, so it can be handed to an output_stage.OutputStage.
+    output_job = {"dem_name": dem_name,
+                  "results_dataframe_file": results_dataframe_file,
+                  "summary_stats_filename": summary_stats_filename if write_summary_stats else None,
+                  "result_tif_filename": result_tif_filename if write_result_tifs else None,
+                  "export_error_formats": _normalize_export_formats(export_error_formats),
+                  "plot_filename": plot_filename if plot_results else None,
+                  "location_name": location_name,
+                  # If this DEM's stages are being timed, the rendering stages are added to its timings file.
+                  "stage_timings_filename": _stage_timings_filename(results_dataframe_file)
+                  if stage_timings.active_recorder() is not None else None,
+                  "verbose": verbose}
+
+    # The output file names are known up front, whenever the job is actually rendered.
     if write_summary_stats:
-        write_summary_stats_file(results_dataframe, summary_stats_filename, verbose=verbose)
         files_to_export.append(summary_stats_filename)
         shared_ret_values["summary_stats_filename"] = summary_stats_filename
-
     if write_result_tifs:
-        if dem_ds is None:
-            dem_ds = gdal.Open(dem_name, gdal.GA_ReadOnly)
-        generate_result_geotiff(results_dataframe, dem_ds, result_tif_filename, verbose=verbose)
         files_to_export.append(result_tif_filename)
         shared_ret_values["result_tif_filename"] = result_tif_filename
-
-    if export_error_formats is None:
-        export_error_formats = ivert_config.export_error_formats
-    if export_error_formats:
-        if dem_ds is None:
-            dem_ds = gdal.Open(dem_name, gdal.GA_ReadOnly)
-        exported = export_error_results(results_dataframe, dem_ds, results_dataframe_file,
-                                        export_error_formats, verbose=verbose)
+    if output_job["export_error_formats"]:
+        exported = _error_export_filenames(results_dataframe_file, output_job["export_error_formats"])
         files_to_export.extend(exported)
         shared_ret_values["error_export_files"] = exported
-
     if plot_results:
-        if location_name is None:
-            location_name = os.path.split(dem_name)[1]
-        plot_validation_results.plot_histograms_and_line(results_dataframe,
-                                                          plot_filename,
-                                                          place_name=location_name,
-                                                          figsize=(10, 4),
-                                                          verbose=verbose)
         files_to_export.append(plot_filename)
         shared_ret_values["plot_filename"] = plot_filename
 
+    if defer_outputs:
+        # Hand the job back to validate_dem(), to be rendered in the background.
+        shared_ret_values[DEFERRED_OUTPUT_JOB_KEY] = output_job
+    else:
+        render_validation_outputs(output_job, results=results, results_dataframe=results_dataframe, dem_ds=dem_ds)
+
     return files_to_export
 
 
+# Key under which validate_dem_parallel() returns a deferred output-rendering job in its shared_ret_values.
+DEFERRED_OUTPUT_JOB_KEY = "_deferred_output_job"
+
+# Key under which validate_dem_parallel() returns its metrics counts in its shared_ret_values (see utils/metrics.py).
+METRICS_KEY = "_metrics"
+
+
+@profiling.profiled_process("render_outputs")
+def render_validation_outputs(output_job: dict,
+                              results: results_table.ResultsTable | None = None,
+                              results_dataframe: pandas.DataFrame | None = None,
+                              dem_ds=None) -> None:
+    """Write a DEM's summary stats, error GeoTIFF, error exports, and plot, as described by an output job.
+
+    The output job is built by _write_validation_outputs(). If the (filtered) results aren't given, they're read from
+    the job's results file, so the job can be rendered in another process, such as by an output_stage.OutputStage."""
+    dem_name = output_job["dem_name"]
+    verbose = output_job["verbose"]
+
+    # When rendered in the background, after the DEM's other stages were timed, add these stages to its timings file.
+    with stage_timings.recording(output_job.get("stage_timings_filename"), label=os.path.basename(dem_name),
+                                 append=True):
+        with stage_timings.stage("render_outputs"):
+            if results_dataframe is None:
+                with stage_timings.stage("read_results_file"):
+                    results_dataframe = dataframe_io.read_dataframe_file(output_job["results_dataframe_file"])
+            if results is None:
+                results = results_table.ResultsTable.from_dataframe(results_dataframe)
+
+            if output_job["summary_stats_filename"] is not None:
+                with stage_timings.stage("write_summary_stats"):
+                    write_summary_stats_file(results_dataframe, output_job["summary_stats_filename"], verbose=verbose)
+
+            if output_job["result_tif_filename"] is not None:
+                if dem_ds is None:
+                    dem_ds = gdal.Open(dem_name, gdal.GA_ReadOnly)
+                with stage_timings.stage("write_error_geotiff"):
+                    generate_result_geotiff(results, dem_ds, output_job["result_tif_filename"], verbose=verbose)
+
+            if output_job["export_error_formats"]:
+                if dem_ds is None:
+                    dem_ds = gdal.Open(dem_name, gdal.GA_ReadOnly)
+                export_error_results(results, dem_ds, output_job["results_dataframe_file"],
+                                     output_job["export_error_formats"], verbose=verbose)
+
+            if output_job["plot_filename"] is not None:
+                with stage_timings.stage("write_plot"):
+                    plot_validation_results.plot_histograms_and_line(results_dataframe,
+                                                                      output_job["plot_filename"],
+                                                                      place_name=output_job["location_name"],
+                                                                      figsize=(10, 4),
+                                                                      verbose=verbose)
+
+
+@profiling.profiled_process("validate_dem_parallel")
 def validate_dem_parallel(dem_name: str,
                           output_dir: str | None = None,
                           dates: None | list[int, int] | tuple[int, int] = None,
@@ -1448,15 +1735,18 @@ def validate_dem_parallel(dem_name: str,
                           omit_bboxes: None | list[float] | tuple[float] = None,
                           measure_coverage: bool = False,
                           max_photons_per_cell: int | None = None,
+                          subsample_seed: int | None = None,
                           numprocs: int = parallel_funcs.physical_cpu_count(),
                           min_confidence_level: int = 4,
                           min_bathy_confidence: float = 0.90,
                           filter_misclassified: bool = True,
                           export_error_formats: str | list | None = None,
+                          defer_outputs: bool = False,
                           verbose: bool = True):
     """Validate a single DEM.
 
-    Parameters are described above in the vdalite_dem() docstring."""
+    Parameters are described above in the vdalite_dem() docstring. If defer_outputs is set, the output files other than
+    the results file are not rendered here. See _write_validation_outputs()."""
     if not os.path.exists(dem_name):
         raise FileNotFoundError(f"Could not find file {dem_name}.")
 
@@ -1467,6 +1757,9 @@ def validate_dem_parallel(dem_name: str,
         summary_stats_filename, result_tif_filename, plot_filename = \
         _setup_output_paths(dem_name, output_dir, interim_data_dir, mark_empty_results,
                              write_summary_stats, write_result_tifs, plot_results, verbose)
+    if not overwrite:
+        # Results from an older run may be in another format (e.g. '_results.h5'). Use them rather than re-validating.
+        results_dataframe_file = dataframe_io.existing_results_file(results_dataframe_file)
 
     early = _check_existing_outputs(dem_name, results_dataframe_file, empty_results_filename,
                                      summary_stats_filename, result_tif_filename, plot_filename,
@@ -1479,64 +1772,88 @@ def validate_dem_parallel(dem_name: str,
 
     files_to_export = []
 
-    fetch_result = _fetch_photons(dem_name, band_num, dem_vertical_datum,
-                                   icesat2_photon_database_obj, dates, classes, omit_bboxes, verbose,
-                                   min_confidence_level=min_confidence_level,
-                                   min_bathy_confidence=min_bathy_confidence)
-    if fetch_result is None:
-        if mark_empty_results:
-            with open(empty_results_filename, 'w') as f:
-                f.write(os.path.basename(dem_name) + " had no ICESat-2 results.")
-            if verbose:
-                print("Created", empty_results_filename, "to indicate no valid ICESat-2 data was returned here.")
-            shared_ret_values["empty_results_filename"] = empty_results_filename
-            files_to_export.append(empty_results_filename)
-        return files_to_export
-    dem_ds, dem_array, photon_df, dem_epsg_str, photon_src_epsg = fetch_result
-
-    overlap_result = _compute_photon_overlap(dem_ds, dem_array, photon_df, classes,
-                                              dem_epsg_str, measure_coverage, verbose,
-                                              photon_src_epsg=photon_src_epsg,
-                                              cache_dir=TRANSFORMEZ_CACHE_DIR,
-                                              user_ndv=dem_ndv)
-    if overlap_result is None:
-        if mark_empty_results:
-            with open(empty_results_filename, 'w') as f:
-                f.write(os.path.basename(dem_name) + " had no ICESat-2 results.")
-            if verbose:
-                print("Created", empty_results_filename, "to indicate no data was returned here.")
-            shared_ret_values["empty_results_filename"] = empty_results_filename
-            files_to_export.append(empty_results_filename)
-        return files_to_export
-    photon_df, height_field, ph_mask_ground_only, dem_overlap_i, dem_overlap_j, \
-        dem_overlap_elevs, N, coverage_coords = overlap_result
+    # Time each stage of the validation, and write the timings to a JSON file next to the results.
+    stage_timings_filename = _stage_timings_filename(results_dataframe_file) \
+        if ivert_config.write_stage_timings else None
+    if stage_timings_filename is not None:
+        shared_ret_values["stage_timings_filename"] = stage_timings_filename
+
+    with (stage_timings.recording(stage_timings_filename, label=os.path.basename(dem_name)),
+          metrics.publishing(shared_ret_values, METRICS_KEY)):
+        with stage_timings.stage("fetch_photons"):
+            fetch_result = _fetch_photons(dem_name, band_num, dem_vertical_datum,
+                                           icesat2_photon_database_obj, dates, classes, omit_bboxes, verbose,
+                                           min_confidence_level=min_confidence_level,
+                                           min_bathy_confidence=min_bathy_confidence)
+        if fetch_result is None:
+            if mark_empty_results:
+                with open(empty_results_filename, 'w') as f:
+                    f.write(os.path.basename(dem_name) + " had no ICESat-2 results.")
+                if verbose:
+                    print("Created", empty_results_filename, "to indicate no valid ICESat-2 data was returned here.")
+                shared_ret_values["empty_results_filename"] = empty_results_filename
+                files_to_export.append(empty_results_filename)
+            return files_to_export
+        dem_ds, photon_df, dem_epsg_str, photon_src_epsg = fetch_result
+
+        with stage_timings.stage("photon_overlap"):
+            overlap_result = _compute_photon_overlap(dem_ds, photon_df, classes,
+                                                      dem_epsg_str, measure_coverage, verbose,
+                                                      photon_src_epsg=photon_src_epsg,
+                                                      cache_dir=TRANSFORMEZ_CACHE_DIR,
+                                                      user_ndv=dem_ndv,
+                                                      band_num=band_num)
+        if overlap_result is None:
+            if mark_empty_results:
+                with open(empty_results_filename, 'w') as f:
+                    f.write(os.path.basename(dem_name) + " had no ICESat-2 results.")
+                if verbose:
+                    print("Created", empty_results_filename, "to indicate no data was returned here.")
+                shared_ret_values["empty_results_filename"] = empty_results_filename
+                files_to_export.append(empty_results_filename)
+            return files_to_export
+        photon_df, height_field, ph_mask_ground_only, dem_overlap_i, dem_overlap_j, \
+            dem_overlap_elevs, N, coverage_frac = overlap_result
+
+        if include_photon_level_validation:
+            with stage_timings.stage("photon_level_validation"):
+                photon_file = _run_photon_level_validation(photon_df, height_field, ph_mask_ground_only,
+                                                            dem_overlap_i, dem_overlap_j, dem_overlap_elevs,
+                                                            results_dataframe_file, verbose)
+            files_to_export.append(photon_file)
+            shared_ret_values["photon_results_dataframe_file"] = photon_file
+
+        with stage_timings.stage("cell_validation"):
+            results = _run_parallel_cell_validation(
+                photon_df, height_field, dem_overlap_i, dem_overlap_j, dem_overlap_elevs, N,
+                max_photons_per_cell, coverage_frac, numprocs, verbose, subsample_seed=subsample_seed)
+
+        with stage_timings.stage("write_outputs"):
+            files_to_export = _write_validation_outputs(
+                results, dem_ds, dem_name, results_dataframe_file, empty_results_filename,
+                summary_stats_filename, result_tif_filename, plot_filename,
+                write_summary_stats, write_result_tifs, plot_results, location_name,
+                outliers_sd_threshold, mark_empty_results, shared_ret_values, verbose, files_to_export,
+                filter_misclassified=filter_misclassified, export_error_formats=export_error_formats,
+                defer_outputs=defer_outputs)
 
-    if include_photon_level_validation:
-        photon_file = _run_photon_level_validation(photon_df, height_field, ph_mask_ground_only,
-                                                    dem_overlap_i, dem_overlap_j, dem_overlap_elevs,
-                                                    results_dataframe_file, verbose)
-        files_to_export.append(photon_file)
-        shared_ret_values["photon_results_dataframe_file"] = photon_file
+    return files_to_export
 
-    results_list = _run_parallel_cell_validation(
-        photon_df, height_field, dem_overlap_i, dem_overlap_j, dem_overlap_elevs, N,
-        max_photons_per_cell, measure_coverage, coverage_coords, numprocs, verbose)
 
-    return _write_validation_outputs(
-        results_list, dem_ds, dem_name, results_dataframe_file, empty_results_filename,
-        summary_stats_filename, result_tif_filename, plot_filename,
-        write_summary_stats, write_result_tifs, plot_results, location_name,
-        outliers_sd_threshold, mark_empty_results, shared_ret_values, verbose, files_to_export,
-        filter_misclassified=filter_misclassified, export_error_formats=export_error_formats)
+# The only results columns used by write_summary_stats_file(). Results files can be read with just these columns
+# when only the summary stats are needed.
+SUMMARY_STATS_COLUMNS = ("diff_mean", "numphotons_intd", "numphotons_bathy", "stddev")
 
 
-def write_summary_stats_file(results_df: pandas.DataFrame,
+def write_summary_stats_file(results_df: pandas.DataFrame | summary_sketch.SummarySketch,
                              statsfile_name: str,
                              verbose: bool = True) -> None:
     """Write the summary statistics file.
 
     Args:
-        results_df: pandas dataframe - contains the summary statistics
+        results_df: pandas dataframe - contains the summary statistics (at least the SUMMARY_STATS_COLUMNS). Or a
+            summary_sketch.SummarySketch of the results, in which case the percentiles are computed from its error
+            histogram (to within summary_sketch.DIFF_BIN_WIDTH).
         statsfile_name: string - the name of the file to write
         verbose: bool - if True, print diagnostic messages
 
@@ -1546,34 +1863,55 @@ def write_summary_stats_file(results_df: pandas.DataFrame,
     if results_df is None:
         if verbose:
             print("write_summary_stats_file(): No results dataframe to write. Returning")
+        return
 
-    if len(results_df) == 0:
+    percentile_levels = [0, 1, 5, 10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 99, 100]
+
+    if isinstance(results_df, summary_sketch.SummarySketch):
+        sketch = results_df
+        n_cells = sketch.n_cells
+        total_photons = sketch.sum_numphotons_intd
+        mean_photons = sketch.mean_photons_per_cell()
+        mean_bias = sketch.mean()
+        rmse = sketch.rmse()
+        n_bathy = sketch.n_bathy_cells()
+        mean_roughness = sketch.mean_stddev()
+        percentile_values = sketch.percentile(percentile_levels) if n_cells > 0 else None
+    else:
+        n_cells = len(results_df)
+        if n_cells > 0:
+            total_photons = results_df["numphotons_intd"].sum()
+            mean_photons = results_df["numphotons_intd"].mean()
+            mean_diff = results_df["diff_mean"]
+            mean_bias = mean_diff.mean()
+            rmse = numpy.sqrt(numpy.mean(numpy.power(mean_diff, 2)))
+            n_bathy = numpy.count_nonzero(results_df["numphotons_bathy"] > 0)
+            mean_roughness = results_df["stddev"].mean()
+            percentile_values = numpy.percentile(mean_diff, percentile_levels)
+
+    if n_cells == 0:
         if verbose:
             print("write_summary_stats_file(): No stats to compute in results dataframe. Returning")
         return
 
     lines = list()
-    lines.append("Number of DEM cells validated (cells): {0}".format(len(results_df)))
-    lines.append("Total number of ground photons used to validate this DEM (photons): {0}".format(results_df["numphotons_intd"].sum()))
-    lines.append("Mean number of photons used to validate each cell (photons): {0}".format(results_df["numphotons_intd"].mean()))
+    lines.append("Number of DEM cells validated (cells): {0}".format(n_cells))
+    lines.append("Total number of ground photons used to validate this DEM (photons): {0}".format(total_photons))
+    lines.append("Mean number of photons used to validate each cell (photons): {0}".format(mean_photons))
 
-    mean_diff = results_df["diff_mean"]
-
-    lines.append("Mean bias error (DEM - ICESat-2) (m): {0}".format(mean_diff.mean()))
-    lines.append("RMSE (m): {0}".format(numpy.sqrt(numpy.mean(numpy.power(mean_diff, 2)))))
+    lines.append("Mean bias error (DEM - ICESat-2) (m): {0}".format(mean_bias))
+    lines.append("RMSE (m): {0}".format(rmse))
     lines.append("== Decile ranges of errors (DEM - ICESat-2) (m) (Look for long-tails, indicating possible artifacts.) ===")
 
-    percentile_levels = [0, 1, 5, 10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 99, 100]
-    percentile_values = numpy.percentile(mean_diff, percentile_levels)
     for l, v in zip(percentile_levels, percentile_values):
         lines.append("    {0:>3d} percentile error level (m): {1}".format(l, v))
 
-    lines.append("Number of cells with bathymetry photons: {0:d}".format(numpy.count_nonzero(results_df["numphotons_bathy"] > 0)))
+    lines.append("Number of cells with bathymetry photons: {0:d}".format(n_bathy))
 
     # lines.append("Mean canopy cover (% cover): {0:0.02f}".format(results_df["canopy_fraction"].mean()*100))
     # lines.append("% of cells with >0 measured canopy (%): {0}".format((numpy.count_nonzero(results_df.canopy_fraction > 0.0) / len(results_df))*100))
     # lines.append("Mean canopy cover in 'wooded' cells containing >0 canopy (% cover): {0}".format(results_df[results_df["canopy_fraction"] > 0]["canopy_fraction"].mean()*100))
-    lines.append("Mean roughness (stddev. of photon elevations within each cell (m)): {0}".format(results_df["stddev"].mean()))
+    lines.append("Mean roughness (stddev. of photon elevations within each cell (m)): {0}".format(mean_roughness))
 
     out_text = "\n".join(lines)
     with open(statsfile_name, 'w') as outf:
@@ -1588,25 +1926,37 @@ def write_summary_stats_file(results_df: pandas.DataFrame,
     return
 
 
+def _results_ij(results) -> tuple:
+    """Return the (i, j) DEM-cell index arrays of a ResultsTable or an (i, j)-MultiIndexed results dataframe."""
+    if isinstance(results, results_table.ResultsTable):
+        return results.i, results.j
+
+    return (results.index.get_level_values("i").to_numpy(),
+            results.index.get_level_values("j").to_numpy())
+
+
 def generate_result_geotiff(results_dataframe, dem_ds, result_tif_filename, verbose=True):
-    """Given the results in the dataframe, output geotiffs to visualize these.
+    """Given the results (a ResultsTable or dataframe), output geotiffs to visualize these.
 
     Name the geotiffs after the dataframe: [original_filename]_<tag>.tif
 
     Geotiff tags will include:
         - mean_diff
+
+    The raster is written one row of tiles at a time, through a single float32 strip buffer, scattering in only the
+    cells that fall within each strip. The full-size error grid is never held in memory.
     """
     gt = dem_ds.GetGeoTransform()
     projection = dem_ds.GetProjection()
     xsize, ysize = dem_ds.RasterXSize, dem_ds.RasterYSize
     emptyval = float(EMPTY_VAL)
-    result_array = numpy.zeros([ysize, xsize], dtype=float) + emptyval
 
-    indices = results_dataframe.index.to_numpy()
-    ivals = [idx[0] for idx in indices]
-    jvals = [idx[1] for idx in indices]
-    # Insert the valid values.
-    result_array[ivals, jvals] = results_dataframe["diff_mean"]
+    # Sort the cells by row so that each strip's cells are one contiguous slice.
+    ivals, jvals = _results_ij(results_dataframe)
+    sort_order = numpy.argsort(ivals, kind="stable")
+    ivals = ivals[sort_order]
+    jvals = jvals[sort_order]
+    errors = numpy.asarray(results_dataframe["diff_mean"], dtype=numpy.float32)[sort_order]
 
     driver = gdal.GetDriverByName("GTiff")
     out_ds = driver.Create(result_tif_filename,
@@ -1618,8 +1968,19 @@ def generate_result_geotiff(results_dataframe, dem_ds, result_tif_filename, verb
     out_ds.SetProjection(projection) # Might need to add .ExportToWkt()
     out_ds.SetGeoTransform(gt)
     band = out_ds.GetRasterBand(1)
-    band.WriteArray(result_array)
     band.SetNoDataValue(emptyval)
+
+    strip_ysize = band.GetBlockSize()[1]
+    strip_buffer = numpy.empty([strip_ysize, xsize], dtype=numpy.float32)
+    for yoff in range(0, ysize, strip_ysize):
+        nrows = min(strip_ysize, ysize - yoff)
+        strip = strip_buffer[:nrows, :]
+        strip.fill(emptyval)
+        # Insert the valid values within this strip.
+        start, end = numpy.searchsorted(ivals, (yoff, yoff + nrows))
+        strip[ivals[start:end] - yoff, jvals[start:end]] = errors[start:end]
+        band.WriteArray(strip, 0, yoff)
+
     band.GetStatistics(0, 1)
     band = None
     out_ds = None
@@ -1651,20 +2012,23 @@ _ERROR_EXPORT_FIELDS = (
 def _results_cell_centers(results_dataframe, dem_ds):
     """Return (x, y) arrays of DEM-cell-center coordinates for each result row.
 
-    Coordinates are in the DEM's own CRS, derived from the (i, j) multi-index and the
+    Coordinates are in the DEM's own CRS, derived from the (i, j) cell indices and the
     DEM geotransform. The 0.5 offsets place each point at the center of its pixel.
     """
     gt = dem_ds.GetGeoTransform()
-    indices = results_dataframe.index.to_numpy()
-    ivals = numpy.array([idx[0] for idx in indices], dtype=float)
-    jvals = numpy.array([idx[1] for idx in indices], dtype=float)
+    ivals, jvals = _results_ij(results_dataframe)
+    ivals = ivals.astype(float)
+    jvals = jvals.astype(float)
     x = gt[0] + (jvals + 0.5) * gt[1] + (ivals + 0.5) * gt[2]
     y = gt[3] + (jvals + 0.5) * gt[4] + (ivals + 0.5) * gt[5]
     return x, y
 
 
 def _export_errors_vector(results_dataframe, dem_ds, out_fname, fmt, verbose=True):
-    """Write one point per validated cell (at the cell center) to a GeoPackage or Shapefile."""
+    """Write one point per validated cell (at the cell center) to a GeoPackage or Shapefile.
+
+    Point geometries (as WKB) and attribute columns are built in numpy, then bulk-written through GDAL's Arrow stream
+    API where available, or in batched transactions otherwise."""
     driver_name = {"gpkg": "GPKG", "shp": "ESRI Shapefile"}[fmt]
     driver = ogr.GetDriverByName(driver_name)
     if driver is None:
@@ -1687,34 +2051,83 @@ def _export_errors_vector(results_dataframe, dem_ds, out_fname, fmt, verbose=Tru
         layer.CreateField(ogr.FieldDefn(name, ftype))
 
     x_centers, y_centers = _results_cell_centers(results_dataframe, dem_ds)
-    col_arrays = {col: results_dataframe[col].to_numpy() for _, col in fields}
-    layer_defn = layer.GetLayerDefn()
-
-    layer.StartTransaction()
-    for n in range(len(results_dataframe)):
-        feat = ogr.Feature(layer_defn)
-        for name, col in fields:
-            val = col_arrays[col][n]
-            if col.startswith("numphotons"):
-                feat.SetField(name, int(val))
-            else:
-                feat.SetField(name, float(val))
-        point = ogr.Geometry(ogr.wkbPoint)
-        point.AddPoint_2D(float(x_centers[n]), float(y_centers[n]))
-        feat.SetGeometry(point)
-        layer.CreateFeature(feat)
-        feat = None
-    layer.CommitTransaction()
+    col_arrays = {name: numpy.asarray(results_dataframe[col]).astype(
+                      numpy.int32 if col.startswith("numphotons") else numpy.float64)
+                  for name, col in fields}
+    wkb_points = _points_to_wkb(x_centers, y_centers)
+
+    if not _write_features_arrow(layer, wkb_points, col_arrays):
+        _write_features_batched(layer, wkb_points, col_arrays)
+    layer = None
     data_source = None
 
     if verbose:
         print(out_fname, "written.")
 
 
+# Number of features written per OGR transaction when the Arrow bulk path isn't available.
+_VECTOR_EXPORT_BATCH_SIZE = 100000
+
+
+def _points_to_wkb(x, y) -> numpy.ndarray:
+    """Encode 2D points as little-endian WKB, built in numpy. Returns an (N, 21) uint8 array, one WKB point per row."""
+    wkb_dtype = numpy.dtype([("byte_order", "u1"), ("geom_type", "<u4"), ("x", "<f8"), ("y", "<f8")])
+    wkb = numpy.empty(len(x), dtype=wkb_dtype)
+    wkb["byte_order"] = 1  # little-endian
+    wkb["geom_type"] = ogr.wkbPoint
+    wkb["x"] = x
+    wkb["y"] = y
+    return wkb.view(numpy.uint8).reshape(len(x), wkb_dtype.itemsize)
+
+
+def _write_features_arrow(layer, wkb_points, col_arrays) -> bool:
+    """Write all the features to the layer in one go through GDAL's Arrow stream API (GDAL >= 3.8).
+
+    Returns False, having written nothing, if Layer.WriteArrow isn't available in this GDAL build."""
+    if not hasattr(layer, "WriteArrow"):
+        return False
+
+    # A binary array of the fixed-width WKB rows, built straight from the numpy buffer: offsets are every 21 bytes.
+    num_points, wkb_size = wkb_points.shape
+    offsets = numpy.arange(0, (num_points + 1) * wkb_size, wkb_size, dtype=numpy.int32)
+    geometry = pyarrow.Array.from_buffers(pyarrow.binary(), num_points,
+                                          [None, pyarrow.py_buffer(offsets), pyarrow.py_buffer(wkb_points)])
+    geometry_field = pyarrow.field(layer.GetGeometryColumn() or "geometry", pyarrow.binary(),
+                                   metadata={"ARROW:extension:name": "ogc.wkb"})
+
+    table = pyarrow.Table.from_arrays([pyarrow.array(values) for values in col_arrays.values()] + [geometry],
+                                      schema=pyarrow.schema([pyarrow.field(name, pyarrow.from_numpy_dtype(values.dtype))
+                                                             for name, values in col_arrays.items()]
+                                                            + [geometry_field]))
+
+    layer.StartTransaction()
+    layer.WriteArrow(table)
+    layer.CommitTransaction()
+    return True
+
+
+def _write_features_batched(layer, wkb_points, col_arrays, batch_size=_VECTOR_EXPORT_BATCH_SIZE) -> None:
+    """Write the features one at a time, committing an OGR transaction every batch_size features."""
+    layer_defn = layer.GetLayerDefn()
+    field_indices = [(layer_defn.GetFieldIndex(name), values.tolist()) for name, values in col_arrays.items()]
+    num_points = len(wkb_points)
+
+    for b_start in range(0, num_points, batch_size):
+        layer.StartTransaction()
+        for n in range(b_start, min(b_start + batch_size, num_points)):
+            feat = ogr.Feature(layer_defn)
+            for field_idx, values in field_indices:
+                feat.SetField(field_idx, values[n])
+            feat.SetGeometryDirectly(ogr.CreateGeometryFromWkb(wkb_points[n].tobytes()))
+            layer.CreateFeature(feat)
+            feat = None
+        layer.CommitTransaction()
+
+
 def _export_errors_xyz(results_dataframe, dem_ds, out_fname, verbose=True):
     """Write a whitespace-delimited 'x y error' text file, one cell-center point per line."""
     x_centers, y_centers = _results_cell_centers(results_dataframe, dem_ds)
-    errors = results_dataframe["diff_mean"].to_numpy()
+    errors = numpy.asarray(results_dataframe["diff_mean"])
     numpy.savetxt(out_fname,
                   numpy.column_stack([x_centers, y_centers, errors]),
                   fmt="%.8g")
@@ -1758,9 +2171,10 @@ def export_error_results(results_dataframe, dem_ds, results_dataframe_file,
         'xyz'  - Whitespace-delimited 'x y error' text file.
 
     Args:
-        results_dataframe: validation results, (i, j)-multi-indexed, with a 'diff_mean' column.
+        results_dataframe: validation results, as a ResultsTable or an (i, j)-multi-indexed dataframe,
+            with a 'diff_mean' column.
         dem_ds: an open gdal.Dataset for the source DEM (supplies CRS and geotransform).
-        results_dataframe_file: path to the '<dem>_results.h5' file (used to derive output names).
+        results_dataframe_file: path to the '<dem>_results.<ext>' file (used to derive output names).
         formats: comma-separated string (e.g. 'tif,gpkg') or iterable of format names.
         verbose: print a line per file written.
 
@@ -1775,12 +2189,13 @@ def export_error_results(results_dataframe, dem_ds, results_dataframe_file,
     filenames = _error_export_filenames(results_dataframe_file, formats)
 
     for fmt, out_fname in zip(formats, filenames):
-        if fmt == "tif":
-            generate_result_geotiff(results_dataframe, dem_ds, out_fname, verbose=verbose)
-        elif fmt in ("gpkg", "shp"):
-            _export_errors_vector(results_dataframe, dem_ds, out_fname, fmt, verbose=verbose)
-        elif fmt == "xyz":
-            _export_errors_xyz(results_dataframe, dem_ds, out_fname, verbose=verbose)
+        with stage_timings.stage("export_errors_" + fmt):
+            if fmt == "tif":
+                generate_result_geotiff(results_dataframe, dem_ds, out_fname, verbose=verbose)
+            elif fmt in ("gpkg", "shp"):
+                _export_errors_vector(results_dataframe, dem_ds, out_fname, fmt, verbose=verbose)
+            elif fmt == "xyz":
+                _export_errors_xyz(results_dataframe, dem_ds, out_fname, verbose=verbose)
         exported.append(out_fname)
 
     return exported
@@ -1810,6 +2225,10 @@ def read_and_parse_args():
                         help='Delete the interim data files generated. Reduces storage requirements. (Default: keep them all.)')
     parser.add_argument("--measure_coverage", "-mc", action="store_true", default=False,
                         help="Measure the coverage %age of icesat-2 data in each of the output DEM cells.")
+    parser.add_argument("--max_photons_per_cell", "-mp", type=int, default=None,
+                        help="Use at most this many photons in each DEM cell, randomly chosen. Default: use all photons.")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Random seed for choosing photons with --max_photons_per_cell. Use the same seed to get reproducible results between runs.")
     parser.add_argument('--write_result_tifs', action='store_true', default=False,
                         help=""""Write output geotiff with the errors in cells that have ICESat-2 photons, NDVs elsewhere.""")
     parser.add_argument("--outlier_sd_threshold", default="2.5",
@@ -1858,6 +2277,8 @@ if __name__ == "__main__":
                  location_name=args.place_name,
                  outliers_sd_threshold=ast.literal_eval(args.outlier_sd_threshold),
                  measure_coverage=args.measure_coverage,
+                 max_photons_per_cell=args.max_photons_per_cell,
+                 subsample_seed=args.seed,
                  numprocs=args.numprocs,
                  band_num=args.band_num,
                  filter_misclassified=not args.no_misclassification_filter,
@@ -20,26 +20,41 @@ import traceback
 import icesat2_database_v2
 import plot_validation_results as plot_validation_results
 import validate_dem as validate_dem
+import summary_sketch
+import collection_manifest
+import output_stage
 import utils.query_yes_no as yes_no
 import utils.is_aws as is_aws
 import utils.configfile as configfile
+import utils.dataframe_io as dataframe_io
+import utils.stage_timings as stage_timings
+import utils.metrics as metrics
 
 
-def write_summary_csv_file(total_results_df_or_file: pandas.DataFrame | str,
+def write_summary_csv_file(total_results_df_or_file: pandas.DataFrame | str | dict,
                            list_of_empty_files: list[str] | tuple[str],
                            csv_name: str,
                            verbose: bool = True) -> pandas.DataFrame:
-    """Write a summary csv of all the results in a collection, after they've been run."""
-    if type(total_results_df_or_file) is str:
-        total_df = pandas.read_hdf(total_results_df_or_file)
+    """Write a summary csv of all the results in a collection, after they've been run.
+
+    The results may be a dataframe (or dataframe file) of all the cells, with a 'filename' column, or a dictionary of
+    {filename: summary_sketch.SummarySketch} with one sketch per DEM."""
+    if isinstance(total_results_df_or_file, dict):
+        sketches = total_results_df_or_file
     else:
-        assert isinstance(total_results_df_or_file, pandas.DataFrame)
-        total_df = total_results_df_or_file
+        if type(total_results_df_or_file) is str:
+            total_df = dataframe_io.read_dataframe_file(total_results_df_or_file)
+        else:
+            assert isinstance(total_results_df_or_file, pandas.DataFrame)
+            total_df = total_results_df_or_file
 
-    if 'filename' not in total_df.columns:
-        raise ValueError("total_df must have a 'filename' column.")
+        if 'filename' not in total_df.columns:
+            raise ValueError("total_df must have a 'filename' column.")
 
-    unique_files = total_df['filename'].unique().tolist()
+        sketches = {fname: summary_sketch.SummarySketch.from_dataframe(temp_df)
+                    for fname, temp_df in total_df.groupby('filename', observed=True, sort=False)}
+
+    unique_files = list(sketches.keys())
     all_filenames = list(unique_files) + list(list_of_empty_files)
     N = len(all_filenames)
 
@@ -53,13 +68,13 @@ def write_summary_csv_file(total_results_df_or_file: pandas.DataFrame | str,
 
     # Fill in the values
     for i, fname in enumerate(all_filenames):
-        if fname in unique_files:
-            temp_df = total_df[total_df['filename'] == fname]
-            means[i] = temp_df['diff_mean'].mean()
-            stds[i] = temp_df['diff_mean'].std()
-            rmses[i] = (sum((temp_df['diff_mean'] ** 2)) / (len(temp_df) - 1)) ** 0.5
-            n_cells[i] = len(temp_df)
-            photons_per_cell[i] = temp_df['numphotons_intd'].mean()
+        if fname in sketches:
+            sketch = sketches[fname]
+            means[i] = sketch.mean()
+            stds[i] = sketch.std(ddof=1)
+            rmses[i] = (sketch.sum_of_squares() / (sketch.count() - 1)) ** 0.5 if sketch.count() > 1 else numpy.nan
+            n_cells[i] = sketch.n_cells
+            photons_per_cell[i] = sketch.mean_photons_per_cell()
             # canopy_mean[i] = temp_df['canopy_fraction'].mean()
             # canopy_mean_gt0[i] = temp_df[temp_df['canopy_fraction'] > 0]['canopy_fraction'].mean()
 
@@ -92,6 +107,31 @@ def write_summary_csv_file(total_results_df_or_file: pandas.DataFrame | str,
     return output_df
 
 
+def output_files_of(shared_ret_values: dict) -> list[str]:
+    """Return the output file names in validate_dem()'s shared return values, as a flat list.
+
+    Most values are single file names, but some (such as 'error_export_files') are lists of them."""
+    output_files = []
+    for value in shared_ret_values.values():
+        if isinstance(value, str):
+            output_files.append(value)
+        elif isinstance(value, (list, tuple)):
+            output_files.extend(fn for fn in value if isinstance(fn, str))
+    return output_files
+
+
+def read_summary_sketch(results_file: str) -> summary_sketch.SummarySketch:
+    """Read the summary sketch written alongside a DEM's results file.
+
+    Results from older runs don't have one; build it from the results file (reading only the columns it needs)."""
+    sketch_fname = summary_sketch.sketch_filename(results_file)
+    if os.path.exists(sketch_fname):
+        return summary_sketch.SummarySketch.read(sketch_fname)
+
+    return summary_sketch.SummarySketch.from_dataframe(
+        dataframe_io.read_dataframe_file(results_file, columns=summary_sketch.SKETCH_COLUMNS))
+
+
 def validate_list_of_dems(dem_list_or_dir: str | list[str],
                           classes: list[int] | tuple[int] = [1, 6, 40],
                           output_dir: str | None = None,
@@ -108,15 +148,21 @@ def validate_list_of_dems(dem_list_or_dir: str | list[str],
                           write_result_tifs: bool = False,
                           write_summary_csv: bool = True,
                           measure_coverage: bool = False,
+                          max_photons_per_cell: int | None = None,
+                          subsample_seed: int | None = None,
                           outliers_sd_threshold: float = 2.5,
                           min_confidence_level: int = 1,
                           min_bathy_confidence: float = 0.75,
                           export_error_formats: str | list | None = None,
+                          print_stage_timings: bool = False,
                           verbose: bool = True):
     """Take a list of DEMs, presumably in a single area, and output validation files for those DEMs.
 
     DEMs should encompass a contiguous area so as to use the same set of ICESat-2 granules for
-    validation."""
+    validation.
+
+    If print_stage_timings, print a table of the time and memory each validation stage took, summed over all the DEMs
+    (from their '_stage_timings.json' files, see the 'write_stage_timings' setting)."""
     if output_dir is None:
         if isinstance(dem_list_or_dir, str) and os.path.isdir(dem_list_or_dir):
             stats_and_plots_dir = dem_list_or_dir
@@ -190,15 +236,23 @@ def validate_list_of_dems(dem_list_or_dir: str | list[str],
                                                                                     "_plot") + ".png")
     csv_name = os.path.join(stats_and_plots_dir, stats_and_plots_base.replace("_results",
                                                                               "_individual_results") + ".csv")
-    results_h5 = os.path.join(stats_and_plots_dir, stats_and_plots_base + ".h5")
-
-    # If the .h5 results file already exists but not the other files, just
-    # create them and exit.
-    if (not overwrite) and (results_h5 is not None) and os.path.exists(results_h5):
+    results_h5 = os.path.join(stats_and_plots_dir, stats_and_plots_base + dataframe_io.results_file_ext())
+    manifest_fname = os.path.join(stats_and_plots_dir, stats_and_plots_base.replace("_results",
+                                                                                     "_manifest") + ".jsonl")
+    summary_inputs_fname = os.path.join(stats_and_plots_dir, stats_and_plots_base.replace("_results",
+                                                                                           "_summary_inputs") + ".json")
+
+    # If the results file already exists but not the other files, just
+    # create them and exit. (With a manifest, we check the DEMs for changes below instead.)
+    if (not overwrite) and (results_h5 is not None) and os.path.exists(results_h5) \
+            and not os.path.exists(manifest_fname):
         results_df = None
 
         if not os.path.exists(statsfile_name):
-            results_df = pandas.read_hdf(results_h5)
+            # If the plot is already there, only the summary-stats columns are needed.
+            results_df = dataframe_io.read_dataframe_file(
+                results_h5,
+                columns=validate_dem.SUMMARY_STATS_COLUMNS if os.path.exists(plot_file_name) else None)
             if verbose:
                 print(results_df, "read.")
             validate_dem.write_summary_stats_file(results_df,
@@ -207,7 +261,7 @@ def validate_list_of_dems(dem_list_or_dir: str | list[str],
 
         if not os.path.exists(plot_file_name):
             if results_df is None:
-                results_df = pandas.read_hdf(results_h5)
+                results_df = dataframe_io.read_dataframe_file(results_h5)
                 if verbose:
                     print(results_df, "read.")
             plot_validation_results.plot_histograms_and_line(results_df,
@@ -255,13 +309,62 @@ def validate_list_of_dems(dem_list_or_dir: str | list[str],
 
     files_to_export = []
     list_of_results_dfs = []
+    list_of_results_dem_names = []
     list_of_empty_files = []
+    # Summary sketch of each DEM with results, keyed by DEM file name.
+    sketches = {}
+
+    # The job manifest records each DEM's fingerprint, status, and results summary. DEMs that haven't changed since
+    # they were last validated, with the same options, are skipped.
+    manifest = collection_manifest.CollectionManifest(manifest_fname)
+    opts_hash = collection_manifest.options_hash(
+        {"classes": classes, "band_num": band_num, "input_vdatum": input_vdatum, "dem_ndv": dem_ndv,
+         "include_photon_validation": include_photon_validation, "write_result_tifs": write_result_tifs,
+         "create_individual_results": create_individual_results, "measure_coverage": measure_coverage,
+         "max_photons_per_cell": max_photons_per_cell, "subsample_seed": subsample_seed,
+         "outliers_sd_threshold": outliers_sd_threshold, "min_confidence_level": min_confidence_level,
+         "min_bathy_confidence": min_bathy_confidence, "export_error_formats": export_error_formats,
+         "results_file_format": dataframe_io.results_file_format()})
+    num_validated = 0
+
+    # Each DEM's outputs (besides its results file) are rendered in the background while the next DEM is validated.
+    # They're all joined before the collection summary is made.
+    num_output_workers = int(configfile.Config().output_stage_workers)
+    dem_output_stage = output_stage.OutputStage(max_workers=num_output_workers, verbose=verbose) \
+        if num_output_workers > 0 else None
+    output_files_by_dem = {}
+
+    # Export the collection's throughput metrics to a text file, if the 'metrics_textfile' setting is set (and the
+    # caller isn't exporting them already).
+    metrics_config = configfile.Config()
+    if metrics_config.metrics_textfile is not None and not metrics.textfile_enabled():
+        metrics.configure(metrics_config.metrics_textfile,
+                          fmt=metrics_config.metrics_format,
+                          interval_s=metrics_config.metrics_update_interval_s)
 
     # For each DEM, validate it.
     for i, dem_path in enumerate(dem_list):
         if verbose:
             print("\n=======", os.path.split(dem_path)[1], "(" + str(i + 1), "of", str(len(dem_list)) + ")", "=======")
 
+        record = None if overwrite else manifest.current_record(dem_path, opts_hash)
+        if record is not None:
+            if verbose:
+                print(os.path.basename(dem_path), "is unchanged since it was last validated. Skipping.")
+            files_to_export.extend(record["output_files"])
+            if record["status"] == collection_manifest.STATUS_DONE:
+                list_of_results_dfs.append(record["results_file"])
+                list_of_results_dem_names.append(os.path.basename(dem_path))
+                sketch = manifest.sketch_of(record)
+                sketches[os.path.basename(dem_path)] = sketch if sketch is not None \
+                    else read_summary_sketch(record["results_file"])
+            else:
+                list_of_empty_files.append(record["empty_file"])
+            metrics.inc("dems_skipped")
+            continue
+
+        num_validated += 1
+
         if output_dir is None:
             this_output_dir = os.path.split(dem_path)[0]
         elif os.path.isdir(output_dir):
@@ -272,8 +375,12 @@ def validate_list_of_dems(dem_list_or_dir: str | list[str],
             if not os.path.exists(this_output_dir):
                 os.mkdir(this_output_dir)
 
-        results_h5_file = os.path.join(this_output_dir, os.path.splitext(os.path.split(dem_path)[1])[0] + "_results.h5")
-        empty_fname = results_h5_file.replace("_results.h5", "_results_EMPTY.txt")
+        results_h5_file = os.path.join(this_output_dir, os.path.splitext(os.path.split(dem_path)[1])[0]
+                                       + "_results" + dataframe_io.results_file_ext())
+        if not overwrite:
+            # validate_dem() keeps using results from an older run in another format (e.g. '_results.h5').
+            results_h5_file = dataframe_io.existing_results_file(results_h5_file)
+        empty_fname = re.sub(dataframe_io.RESULTS_SUFFIX_REGEX, "_results_EMPTY.txt", results_h5_file)
 
         try:
             shared_ret_values = {}
@@ -298,30 +405,54 @@ def validate_list_of_dems(dem_list_or_dir: str | list[str],
                                       outliers_sd_threshold=outliers_sd_threshold,
                                       mark_empty_results=True,
                                       measure_coverage=measure_coverage,
+                                      max_photons_per_cell=max_photons_per_cell,
+                                      subsample_seed=subsample_seed,
                                       min_confidence_level=min_confidence_level,
                                       min_bathy_confidence=min_bathy_confidence,
                                       export_error_formats=export_error_formats,
+                                      output_stage=dem_output_stage,
                                       verbose=verbose)
         except MemoryError:
             if verbose:
                 print(f"Skipping {os.path.basename(dem_path)} due to memory error.")
+            manifest.record(dem_path, opts_hash, collection_manifest.STATUS_FAILED)
+            metrics.inc("dems_failed")
             continue
 
         except KeyboardInterrupt as e:
+            if dem_output_stage is not None:
+                dem_output_stage.shutdown(cancel_pending=True)
             raise e
 
         except Exception:
             if verbose:
                 print(f"Skipping {os.path.basename(dem_path)}: {traceback.format_exc()}")
+            manifest.record(dem_path, opts_hash, collection_manifest.STATUS_FAILED)
+            metrics.inc("dems_failed")
             continue
 
-        files_to_export.extend(list(shared_ret_values.values()))
+        output_files = output_files_of(shared_ret_values)
+        output_files_by_dem[dem_path] = output_files
+        files_to_export.extend(output_files)
 
         if os.path.exists(results_h5_file):
             list_of_results_dfs.append(results_h5_file)
+            list_of_results_dem_names.append(os.path.basename(dem_path))
+            sketch = read_summary_sketch(results_h5_file)
+            sketches[os.path.basename(dem_path)] = sketch
+            manifest.record(dem_path, opts_hash, collection_manifest.STATUS_DONE, results_file=results_h5_file,
+                            output_files=output_files, sketch=sketch)
+            metrics.inc("dems_completed")
 
         elif os.path.exists(empty_fname):
             list_of_empty_files.append(empty_fname)
+            manifest.record(dem_path, opts_hash, collection_manifest.STATUS_EMPTY, empty_file=empty_fname,
+                            output_files=output_files)
+            metrics.inc("dems_completed")
+
+        else:
+            manifest.record(dem_path, opts_hash, collection_manifest.STATUS_FAILED, output_files=output_files)
+            metrics.inc("dems_failed")
 
 
         # On the IVERT server, the local EC2 instance has limited disk space. If it's more than the maximnum disk usage
@@ -342,38 +473,80 @@ def validate_list_of_dems(dem_list_or_dir: str | list[str],
     if verbose:
         print()
 
+    # Wait for all the DEMs' outputs to finish rendering. Record any DEMs whose outputs failed as "failed" in the
+    # manifest, so they're re-done on the next run. Their results files are still used in the summary below.
+    if dem_output_stage is not None:
+        if verbose and len(dem_output_stage) > 0:
+            print(f"Waiting for the outputs of {len(dem_output_stage)} DEMs to finish rendering.")
+        output_failures = dem_output_stage.join()
+        dem_output_stage.shutdown()
+        for dem_path in output_failures:
+            manifest.record(dem_path, opts_hash, collection_manifest.STATUS_FAILED,
+                            output_files=output_files_by_dem.get(dem_path, []))
+
+    # Drop superseded records from the manifest.
+    manifest.compact()
+
+    # Bring the metrics file up to date with the last DEMs.
+    metrics.publish(force=True)
+
+    if print_stage_timings:
+        timings_files = [fn for output_files in output_files_by_dem.values() for fn in output_files
+                         if fn.endswith("_stage_timings.json") and os.path.exists(fn)]
+        if len(timings_files) > 0:
+            print(f"Stage timings of {len(timings_files)} DEMs:")
+            print(stage_timings.format_stage_table(
+                stage_timings.sum_stage_timings([stage_timings.read_stage_timings(fn) for fn in timings_files])))
+            print()
+
     if len(list_of_results_dfs) == 0:
         if verbose:
             print("No results dataframes generated. Aborting.")
         return
 
-    # Generate the overall summary stats file.
-    total_results_df = plot_validation_results.get_data_from_h5_or_list(list_of_results_dfs,
-                                                                        orig_filenames=dem_list,
-                                                                        include_filenames=True,
-                                                                        verbose=verbose)
+    # The summary files can only be reused if they were built from exactly these DEMs. DEMs may have been deleted
+    # from the collection, or left out by the file name filters, since then.
+    summary_files = [statsfile_name, plot_file_name] + ([csv_name] if write_summary_csv else []) \
+        + ([results_h5] if results_h5 is not None else [])
+    current_summary_inputs = collection_manifest.summary_inputs(list_of_results_dem_names, list_of_empty_files)
+    if num_validated == 0 and not overwrite and all(os.path.exists(fn) for fn in summary_files) \
+            and collection_manifest.read_summary_inputs(summary_inputs_fname) == current_summary_inputs:
+        if verbose:
+            print("No DEMs have changed since the last run. The collection summary files are up to date.")
+        files_to_export.extend(summary_files)
+        return files_to_export
+
+    # Merge the per-DEM summary sketches into the collection summary, without loading every DEM's cells at once.
+    if verbose:
+        print("Summarizing {0} results files.".format(len(list_of_results_dfs)))
+    total_sketch = summary_sketch.SummarySketch()
+    for dem_name in list_of_results_dem_names:
+        total_sketch.merge(sketches[dem_name])
 
     if write_summary_csv:
-        write_summary_csv_file(total_results_df, list_of_empty_files, csv_name, verbose=verbose)
+        write_summary_csv_file(sketches, list_of_empty_files, csv_name, verbose=verbose)
         files_to_export.append(csv_name)
 
     # Output the statistics summary file.
-    validate_dem.write_summary_stats_file(total_results_df, statsfile_name, verbose=verbose)
+    validate_dem.write_summary_stats_file(total_sketch, statsfile_name, verbose=verbose)
     files_to_export.append(statsfile_name)
 
     # Output the validation results plot.
-    plot_validation_results.plot_histograms_and_line(total_results_df,
-                                                     plot_file_name,
-                                                     place_name=place_name,
-                                                     verbose=verbose)
+    plot_validation_results.plot_histograms_and_line_from_sketch(total_sketch,
+                                                                 plot_file_name,
+                                                                 place_name=place_name,
+                                                                 verbose=verbose)
     files_to_export.append(plot_file_name)
 
     if results_h5 is not None:
-        total_results_df.to_hdf(results_h5, key="results", complib="zlib", complevel=3)
+        dataframe_io.concat_dataframe_files(list_of_results_dfs, results_h5,
+                                            filenames=list_of_results_dem_names, key="results")
         if verbose:
             print(results_h5, "written.")
         files_to_export.append(results_h5)
 
+    collection_manifest.write_summary_inputs(summary_inputs_fname, current_summary_inputs)
+
     return files_to_export
 
 
@@ -448,7 +621,7 @@ def define_and_parse_args():
                              "in the -output_dir directory. Default: True")
 
     parser.add_argument("--include_photon_validation", "-ph", action="store_true", default=False,
-                        help="Produce a photon database (stored in '*_photon_level_results.h5') with errors on a "
+                        help="Produce a photon database (stored in '*_photons.parquet') with errors on a "
                              "photon-level (not cell-level) scale. Useful for identifying bad ICESat-2 granules.")
 
     parser.add_argument("--delete_datafiles", "-del", action="store_true", default=False,
@@ -462,6 +635,13 @@ def define_and_parse_args():
     parser.add_argument("--measure_coverage", "-mc", action="store_true", default=False,
                         help="Measure the coverage %age of icesat-2 data in each of the output DEM cells.")
 
+    parser.add_argument("--max_photons_per_cell", "-mp", type=int, default=None,
+                        help="Use at most this many photons in each DEM cell, randomly chosen. Default: use all photons.")
+
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Random seed for choosing photons with --max_photons_per_cell. Use the same seed to get "
+                             "reproducible results between runs.")
+
     parser.add_argument("-wrt", "--write_result_tifs", dest="write_result_tifs",
                         type=yes_no.interpret_yes_no, default=True,
                         help="Write output geotiff with the errors in cells that have ICESat-2 photons, "
@@ -529,6 +709,8 @@ def main():
                           # mask_out_lakes=args.mask_lakes,
                           # omit_bad_granules=True,
                           measure_coverage=args.measure_coverage,
+                          max_photons_per_cell=args.max_photons_per_cell,
+                          subsample_seed=args.seed,
                           write_summary_csv=args.write_summary_csv,
                           outliers_sd_threshold=ast.literal_eval(args.outlier_sd_threshold),
                           verbose=not args.quiet)
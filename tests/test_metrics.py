@@ -0,0 +1,43 @@
+"""Tests of the metric names and layout of utils.metrics.render(), in both text formats."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import utils.metrics as metrics  # noqa: E402
+
+
+def test_render_openmetrics():
+    lines = metrics.render({"dems_completed": 3}, fmt="openmetrics").splitlines()
+
+    # The counter family is typed without the '_total' suffix its sample has.
+    assert "# TYPE ivert_dems_completed counter" in lines
+    assert "ivert_dems_completed_total 3" in lines
+    assert "# TYPE ivert_dems_completed_total counter" not in lines
+    assert "ivert_dems_failed_total 0" in lines
+    assert lines[-1] == "# EOF"
+
+
+def test_render_prometheus():
+    lines = metrics.render({"dems_completed": 3}, fmt="prometheus").splitlines()
+
+    # The TYPE line names the sample itself, as the node-exporter textfile collector expects.
+    assert "# TYPE ivert_dems_completed_total counter" in lines
+    assert "ivert_dems_completed_total 3" in lines
+    assert "# TYPE ivert_dems_completed counter" not in lines
+    assert "# EOF" not in lines
+
+
+def test_render_gauges():
+    text = metrics.render({"cells_validated": 10}, start_time=1700000000.5, fmt="prometheus")
+
+    assert "# TYPE ivert_cells_per_second gauge" in text.splitlines()
+    assert "ivert_start_time_seconds 1700000000.5" in text.splitlines()
+
+
+def test_render_unknown_format():
+    with pytest.raises(ValueError):
+        metrics.render({}, fmt="json")